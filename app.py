@@ -1,14 +1,19 @@
 from flask import Flask
 from flask_login import LoginManager
-from models import db, bcrypt, User, Product
+from models import db, bcrypt, User, Product, Post, Firmware, post_search
 from datetime import datetime, timedelta
 
-from routes import auth_bp, cart_bp, main_bp, admin_bp, users_bp, payment_bp, products_bp, api_bp, devices_bp
+from routes import auth_bp, cart_bp, main_bp, admin_bp, users_bp, payment_bp, products_bp, api_bp, devices_bp, \
+    workshop_bp
+from services import token_cache, presence, gauge_payload_cache, firmware_registry, debug_capture, fleet_stats, \
+    config_profiles, device_changes, telemetry, fleet_analytics, build_deltas, build_lock
 
 import stripe
 import os
 
-app = Flask(__name__, static_folder="static", static_url_path='/static')
+# MULTIGAUGE_INSTANCE_PATH moves site.db, telemetry.db and shared state elsewhere (tests use a temp dir)
+app = Flask(__name__, static_folder="static", static_url_path='/static',
+            instance_path=os.environ.get('MULTIGAUGE_INSTANCE_PATH'))
 
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///site.db"
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "your_secret_key")
@@ -18,6 +23,46 @@ stripe.api_key = os.environ.get("STRIPE_SECRET_KEY", "")
 app.config['FIRMWARE_UPLOAD_DIR'] = os.path.join(app.root_path, 'uploads', 'firmware')
 os.makedirs(app.config['FIRMWARE_UPLOAD_DIR'], exist_ok=True)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload
+# Set to the nginx internal location (e.g. '/internal/firmware/') to hand OTA
+# downloads to nginx with X-Accel-Redirect instead of streaming them from Python
+app.config['FIRMWARE_ACCEL_REDIRECT'] = os.environ.get('FIRMWARE_ACCEL_REDIRECT')
+
+app.config['ROLLOUT_DOWNLOAD_LEASE'] = 15 * 60  # seconds a staged-rollout download slot is held
+app.config['ROLLOUT_RETRY_AFTER'] = 10 * 60     # seconds deferred devices are told to wait
+
+# State shared between gunicorn workers (cache generations, ...)
+app.config['SHARED_STATE_DIR'] = os.path.join(app.instance_path, 'shared')
+
+app.config['DEVICE_TOKEN_CACHE_SIZE'] = 10000
+app.config['DEVICE_TOKEN_CACHE_TTL'] = 300  # seconds
+
+app.config['PRESENCE_FLUSH_INTERVAL'] = 5  # seconds between last_seen_at writes
+app.config['FLEET_STATS_RECONCILE_INTERVAL'] = 3600  # seconds between fleet_stats rebuilds by each worker's presence flush
+
+app.config['EFFECTIVE_CONFIG_CACHE_SIZE'] = 4096  # resolved (profile, overrides) configs
+
+# /api/v1/wait long-poll: longest wait, and how often each worker checks for changes
+# made by the others. Waits only happen under gevent (or threaded) workers.
+app.config['DEVICE_WAIT_TIMEOUT'] = 25  # seconds, below nginx proxy_read_timeout
+app.config['DEVICE_WAIT_POLL_INTERVAL'] = 0.5
+
+# /api/v1/telemetry: samples are buffered per worker and written to a separate
+# SQLite file (one table per day + per-minute rollups)
+app.config['TELEMETRY_DB'] = os.path.join(app.instance_path, 'telemetry.db')
+app.config['TELEMETRY_FLUSH_INTERVAL'] = 1.0  # seconds
+app.config['TELEMETRY_BUFFER_MAX'] = 200000   # samples held per worker before devices get 503
+app.config['TELEMETRY_MAX_BATCH'] = 1000      # samples per request
+app.config['TELEMETRY_RETENTION_DAYS'] = 30
+app.config['FLEET_ANALYTICS_BUCKET_MINUTES'] = 5  # analytics windows end on these boundaries and are cached per bucket
+
+app.config['GAUGE_PAYLOAD_CACHE_BYTES'] = 32 * 1024 * 1024  # encoded /api/v1/gauge bodies
+app.config['GAUGE_PAYLOAD_CACHE_GZIP'] = True
+
+# /api/v1/debug request capture, shared by all workers. Off unless API_DEBUG_CAPTURE=1,
+# and then only a sample of requests (API_DEBUG_SAMPLE_RATE=1.0 to see them all)
+app.config['API_DEBUG_CAPTURE'] = os.environ.get('API_DEBUG_CAPTURE', '0') == '1'
+app.config['API_DEBUG_SAMPLE_RATE'] = float(os.environ.get('API_DEBUG_SAMPLE_RATE', '0.05'))
+app.config['API_DEBUG_SLOTS'] = 256
 
 '''###
 log = logging.getLogger('werkzeug')
@@ -25,6 +70,55 @@ log.setLevel(logging.ERROR)
 ###'''
 
 db.init_app(app)
+token_cache.init_app(app)
+presence.init_app(app)
+gauge_payload_cache.init_app(app)
+firmware_registry.init_app(app)
+debug_capture.init_app(app)
+config_profiles.init_app(app)
+device_changes.init_app(app)
+telemetry.init_app(app)
+fleet_analytics.init_app(app)
+
+
+@app.cli.command('rebuild-fleet-stats')
+def rebuild_fleet_stats():
+    """Recompute the fleet_stats counters from the devices table."""
+    fleet_stats.rebuild()
+
+
+@app.cli.command('build-firmware-deltas')
+def build_firmware_deltas():
+    """Build bsdiff patches to the active firmware from the versions the fleet runs (started on activation)."""
+    with build_lock():
+        active = Firmware.query.filter_by(is_active=True).first()
+        if not active:
+            print('No active firmware')
+            return
+        deltas = build_deltas(active)
+        db.session.commit()
+    if deltas:
+        firmware_registry.invalidate()
+        device_changes.notify_all()
+    print(f'{len(deltas)} delta update(s) built for v{active.version}')
+
+
+@app.cli.command('reconcile-post-counters')
+def reconcile_post_counters():
+    """Recount post likes/favorites/comments/features and repair drifted counters (run from cron)."""
+    print(f'{Post.reconcile_counters()} posts repaired')
+
+
+@app.cli.command('refresh-trending')
+def refresh_trending():
+    """Recompute posts.trending_score from the counters (run from cron, after reconcile-post-counters)."""
+    print(f'{Post.refresh_trending()} trending scores updated')
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """Re-index every post in posts_fts (after changing what gets indexed)."""
+    post_search.rebuild()
 
 # Set up Flask-Login
 login_manager = LoginManager()
@@ -44,6 +138,7 @@ app.register_blueprint(products_bp)
 app.register_blueprint(users_bp)
 app.register_blueprint(api_bp)
 app.register_blueprint(devices_bp)
+app.register_blueprint(workshop_bp)
 
 # Run the application
 if __name__ == "__main__":
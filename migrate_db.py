@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
-import sqlite3, datetime, hashlib, os
+import sqlite3, datetime, hashlib, os, json
+
+from models.config_profile import DEFAULT_ESP_CONFIG, diff_patch
 
 conn = sqlite3.connect('instance/site.db')
 c = conn.cursor()
@@ -28,6 +30,95 @@ for col, dtype, default in new_cols:
     else:
         print(f'users.{col} already exists')
 
+# Content hashes used for ETags and /api/v1/sync
+if 'config_hash' not in cols:
+    c.execute('ALTER TABLE devices ADD COLUMN config_hash VARCHAR(64)')
+    print('Added: devices.config_hash')
+pcols = [r[1] for r in c.execute('PRAGMA table_info(posts)').fetchall()]
+if 'data_hash' not in pcols:
+    c.execute('ALTER TABLE posts ADD COLUMN data_hash VARCHAR(64)')
+    print('Added: posts.data_hash')
+
+for table, id_col, text_col, hash_col in (('devices', 'id', 'config_json', 'config_hash'),
+                                          ('posts', 'id', 'data', 'data_hash')):
+    rows = c.execute(f'SELECT {id_col}, {text_col} FROM {table} WHERE {hash_col} IS NULL AND {text_col} IS NOT NULL').fetchall()
+    for row_id, text in rows:
+        c.execute(f'UPDATE {table} SET {hash_col} = ? WHERE {id_col} = ?',
+                  (hashlib.sha256(text.encode('utf-8')).hexdigest(), row_id))
+    print(f'Hashed {len(rows)} {table}.{text_col}')
+
+c.execute('CREATE INDEX IF NOT EXISTS ix_firmwares_checksum ON firmwares (checksum)')
+
+# Config profiles: devices keep only their overrides against the default profile
+if 'profile_id' not in cols:
+    c.execute('ALTER TABLE devices ADD COLUMN profile_id INTEGER REFERENCES config_profiles (id)')
+    print('Added: devices.profile_id')
+    rows = c.execute('SELECT id, config_json FROM devices WHERE config_json IS NOT NULL').fetchall()
+    for row_id, text in rows:
+        try:
+            config = json.loads(text)
+        except ValueError:
+            config = None
+        overrides = diff_patch(DEFAULT_ESP_CONFIG, config) if isinstance(config, dict) else None
+        text = json.dumps(overrides) if overrides else None
+        c.execute('UPDATE devices SET config_json = ?, config_hash = ? WHERE id = ?',
+                  (text, hashlib.sha256(text.encode('utf-8')).hexdigest() if text else None, row_id))
+    print(f'Converted {len(rows)} devices.config_json to overrides')
+
+# Indexes for the paginated / filtered admin devices page
+c.execute('CREATE INDEX IF NOT EXISTS ix_devices_last_seen_id ON devices (last_seen_at, id)')
+c.execute('CREATE INDEX IF NOT EXISTS ix_devices_country ON devices (country)')
+c.execute('CREATE INDEX IF NOT EXISTS ix_devices_firmware_version ON devices (firmware_version)')
+
+# Geohash of latitude/longitude, indexed for the fleet map and nearest-device lookups
+if 'geohash' not in cols:
+    from models.geohash import encode as geohash_encode
+    c.execute('ALTER TABLE devices ADD COLUMN geohash VARCHAR(12)')
+    rows = c.execute('SELECT id, latitude, longitude FROM devices '
+                     'WHERE latitude IS NOT NULL AND longitude IS NOT NULL').fetchall()
+    for row_id, lat, lon in rows:
+        c.execute('UPDATE devices SET geohash = ? WHERE id = ?', (geohash_encode(lat, lon), row_id))
+    print(f'Added: devices.geohash ({len(rows)} positions hashed)')
+c.execute('CREATE INDEX IF NOT EXISTS ix_devices_geohash ON devices (geohash)')
+
+# Denormalized post counters, backfilled from their tables
+pcols = [r[1] for r in c.execute('PRAGMA table_info(posts)').fetchall()]
+for col, table in (('like_count', 'post_likes'), ('favorite_count', 'post_favorites'),
+                   ('comment_count', 'post_comments'), ('feature_count', 'post_feature')):
+    if col not in pcols:
+        c.execute(f'ALTER TABLE posts ADD COLUMN {col} INTEGER NOT NULL DEFAULT 0')
+        c.execute(f'UPDATE posts SET {col} = (SELECT COUNT(*) FROM {table} WHERE {table}.post_id = posts.id)')
+        print(f'Added: posts.{col}')
+
+# Precomputed trending score, and the indexes behind the 'trending' and 'top' sorts
+if 'trending_score' not in pcols:
+    from models.trending import trending_score
+    c.execute('ALTER TABLE posts ADD COLUMN trending_score FLOAT')
+    rows = c.execute('SELECT id, like_count, favorite_count, downloads, posted_at FROM posts').fetchall()
+    for row_id, likes, favorites, downloads, posted_at in rows:
+        c.execute('UPDATE posts SET trending_score = ? WHERE id = ?',
+                  (trending_score(likes, favorites, downloads, posted_at), row_id))
+    print(f'Added: posts.trending_score ({len(rows)} scored)')
+c.execute('CREATE INDEX IF NOT EXISTS ix_posts_trending_id ON posts (trending_score, id)')
+c.execute('CREATE INDEX IF NOT EXISTS ix_posts_like_count_id ON posts (like_count, id)')
+
+# (sort key, id) indexes for the keyset-paginated workshop, profile and comment listings
+c.execute('CREATE INDEX IF NOT EXISTS ix_posts_posted_at_id ON posts (posted_at, id)')
+c.execute('CREATE INDEX IF NOT EXISTS ix_posts_downloads_id ON posts (downloads, id)')
+c.execute('CREATE INDEX IF NOT EXISTS ix_posts_posted_by_posted_at_id ON posts (posted_by, posted_at, id)')
+c.execute('CREATE INDEX IF NOT EXISTS ix_post_comments_post_created_id ON post_comments (post_id, created_at, id)')
+
+# Full-text search index over posts (models/search.py keeps it in sync afterwards)
+if not c.execute("SELECT 1 FROM sqlite_master WHERE name = 'posts_fts'").fetchone():
+    from models.search import CREATE_FTS, gauge_tokens
+    c.execute(CREATE_FTS)
+    rows = c.execute('SELECT p.id, p.title, p.description, u.username, p.gauge_type, p.data '
+                     'FROM posts p LEFT JOIN users u ON u.id = p.posted_by').fetchall()
+    for post_id, title, description, username, gauge_type, data in rows:
+        c.execute('INSERT INTO posts_fts (rowid, title, description, username, tokens) VALUES (?, ?, ?, ?, ?)',
+                  (post_id, title or '', description or '', username or '', f'{gauge_type or ""} {gauge_tokens(data)}'))
+    print(f'Created posts_fts ({len(rows)} posts indexed)')
+
 conn.commit()
 
 # Seed 2 fake firmwares
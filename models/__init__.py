@@ -4,11 +4,15 @@ from flask_bcrypt import Bcrypt
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 
+from .hashing import content_hash
+
 from .post import Post, PostLike, PostComment, PostFavorite, PostFeature
 from .user import User
 from .cart import Cart, CartItem
 from .subscriber import EmailSubscribers
 from .product import Product
 from .order import Order, OrderItem, Address
-from .device import Device, DeviceToken
-from .firmware import Firmware
\ No newline at end of file
+from .device import Device, DeviceToken, FleetStat
+from .config_profile import ConfigProfile, DEFAULT_ESP_CONFIG, merge_patch, diff_patch
+from .firmware import Firmware, FirmwareDelta, FirmwareRollout, FirmwareRolloutDownload
+from . import search as post_search
@@ -0,0 +1,90 @@
+from datetime import datetime
+from models import db
+
+
+# --- Default ESP32 config (matches dash_config_t defaults) ---
+DEFAULT_ESP_CONFIG = {
+    "speed_unit": 0,
+    "speed_number_color": {"r": 255, "g": 255, "b": 255},
+    "speed_unit_color": {"r": 150, "g": 150, "b": 150},
+    "speed_grid_color": {"r": 0, "g": 60, "b": 140},
+    "speed_car_color": {"r": 255, "g": 255, "b": 255},
+    "speed_shadow_color": {"r": 120, "g": 120, "b": 120},
+    "tilt_angle_color": {"r": 255, "g": 80, "b": 80},
+    "tilt_unit_color": {"r": 130, "g": 130, "b": 130},
+    "tilt_warning_deg": 25,
+    "danger_color": {"r": 200, "g": 0, "b": 0},
+    "tilt_speed": 1.0,
+    "data_circle_color": {"r": 0, "g": 212, "b": 255},
+    "data_circle_dim_color": {"r": 0, "g": 100, "b": 120},
+    "data_circle_inner_color": {"r": 0, "g": 60, "b": 140},
+    "data_bar_color": {"r": 0, "g": 212, "b": 255},
+    "data_center_color": {"r": 0, "g": 212, "b": 255},
+    "volt_gauge_color": {"r": 255, "g": 149, "b": 0},
+    "volt_warning_color": {"r": 255, "g": 0, "b": 0},
+    "volt_warning_low": 11.7,
+    "volt_warning_high": 13.5,
+    "volt_sim_enabled": True,
+    "volt_sim_value": 12.8,
+    "rpm_sim_enabled": True,
+    "rpm_sim_value": 3500.0,
+    "imu_filter_tau": 0.35,
+    "speed_sim_enabled": True,
+    "speed_sim_max": 200,
+    "speed_sim_accel": 40,
+    "speed_sim_decel": 50,
+    "language": 0,
+    "brightness": 80,
+    "welcome_word": "utilisateurs",
+    "wifi_ssid": "GaugeCluster",
+    "wifi_password": "12345678",
+    "wifi_channel": 1
+}
+
+
+def merge_patch(base, patch):
+    """RFC 7396 merge of `patch` onto `base`: nested objects merge, None removes a key."""
+    if not isinstance(patch, dict):
+        return patch
+    merged = dict(base) if isinstance(base, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            merged.pop(key, None)
+        else:
+            merged[key] = merge_patch(merged.get(key), value)
+    return merged
+
+
+def diff_patch(base, target):
+    """Smallest merge patch turning `base` into `target` (inverse of merge_patch)."""
+    patch = {}
+    for key, value in target.items():
+        if key not in base:
+            patch[key] = value
+        elif isinstance(value, dict) and isinstance(base[key], dict):
+            nested = diff_patch(base[key], value)
+            if nested:
+                patch[key] = nested
+        elif value != base[key]:
+            patch[key] = value
+    for key in base:
+        if key not in target:
+            patch[key] = None
+    return patch
+
+
+class ConfigProfile(db.Model):
+    """Named base config; devices store only their overrides against it.
+
+    `version` is bumped on every change so resolved configs can be cached by
+    (profile id, version, device override hash). The profile named 'default'
+    applies to devices without a profile; while no such row exists the
+    built-in DEFAULT_ESP_CONFIG is used.
+    """
+    __tablename__ = 'config_profiles'
+
+    id          = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name        = db.Column(db.String(50), unique=True, nullable=False)
+    config_json = db.Column(db.Text, nullable=False)
+    version     = db.Column(db.Integer, nullable=False, default=1)
+    updated_at  = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,32 +1,115 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy.orm import validates
 from models import db
+from models.hashing import content_hash
+from models import geohash as geo
 
 
 class Device(db.Model):
     __tablename__ = 'devices'
+    __table_args__ = (db.Index('ix_devices_last_seen_id', 'last_seen_at', 'id'),)
 
     id               = db.Column(db.Integer, primary_key=True, autoincrement=True)
     hardware_id      = db.Column(db.String(50), unique=True, nullable=False)
     name             = db.Column(db.String(100), nullable=True)
     user_id          = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     assigned_post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=True)
-    firmware_version = db.Column(db.String(20), nullable=True)
+    firmware_version = db.Column(db.String(20), nullable=True, index=True)
     last_seen_at     = db.Column(db.DateTime, nullable=True)
     registered_at    = db.Column(db.DateTime, default=datetime.utcnow)
-    config_json      = db.Column(db.Text, nullable=True)
+    profile_id       = db.Column(db.Integer, db.ForeignKey('config_profiles.id'), nullable=True)  # None: 'default' profile
+    config_json      = db.Column(db.Text, nullable=True)  # overrides against the profile (merge patch)
+    config_hash      = db.Column(db.String(64), nullable=True)  # SHA-256 of config_json, set on write
     tag              = db.Column(db.String(30), nullable=True, default=None)
     latitude         = db.Column(db.Float, nullable=True)
     longitude        = db.Column(db.Float, nullable=True)
+    geohash          = db.Column(db.String(12), nullable=True, index=True)  # of latitude/longitude, set on write
     module_type      = db.Column(db.String(30), nullable=True, default='ESP32-S3')
-    country          = db.Column(db.String(5), nullable=True, default='FR')
+    country          = db.Column(db.String(5), nullable=True, default='FR', index=True)
 
     user          = db.relationship('User', backref=db.backref('devices', lazy=True))
     assigned_post = db.relationship('Post', backref=db.backref('assigned_devices', lazy=True))
 
+    @classmethod
+    def filtered(cls, country=None, firmware_version=None, status=None, search=None, tag=None,
+                 threshold_minutes=10):
+        """Query of devices matching the admin filters, evaluated in SQL."""
+        query = cls.query
+        if tag:
+            query = query.filter(cls.tag == tag)
+        if country:
+            query = query.filter(cls.country == country)
+        if firmware_version:
+            query = query.filter(cls.firmware_version == firmware_version)
+        if status:
+            cutoff = datetime.utcnow() - timedelta(minutes=threshold_minutes)
+            if status == 'online':
+                query = query.filter(cls.last_seen_at >= cutoff)
+            else:
+                query = query.filter(db.or_(cls.last_seen_at < cutoff, cls.last_seen_at.is_(None)))
+        if search:
+            pattern = f'%{search}%'
+            query = query.filter(db.or_(cls.name.ilike(pattern), cls.hardware_id.ilike(pattern)))
+        return query
+
+    @validates('config_json')
+    def _hash_config(self, key, value):
+        self.config_hash = content_hash(value)
+        return value
+
+    @validates('latitude', 'longitude')
+    def _hash_position(self, key, value):
+        lat = value if key == 'latitude' else self.latitude
+        lon = value if key == 'longitude' else self.longitude
+        self.geohash = geo.encode(lat, lon) if lat is not None and lon is not None else None
+        return value
+
+    @classmethod
+    def within(cls, south, west, north, east, query=None):
+        """Devices inside a bounding box (west > east crosses the antimeridian), via the geohash index."""
+        query = query if query is not None else cls.query
+        ranges = geo.cover(south, west, north, east)
+        query = query.filter(db.or_(*[db.and_(cls.geohash >= low, cls.geohash < high) for low, high in ranges]))
+        query = query.filter(cls.latitude.between(south, north))
+        if west <= east:
+            return query.filter(cls.longitude.between(west, east))
+        return query.filter(db.or_(cls.longitude >= west, cls.longitude <= east))
+
+    @classmethod
+    def nearest(cls, lat, lon, k=10, query=None):
+        """The `k` devices closest to (lat, lon), as [(device, distance_km)].
+
+        Searches a box around the point, doubling its radius until it holds
+        `k` devices within that radius; nothing closer can be outside it.
+        """
+        radius = 1.0
+        while True:
+            found = cls.within(*geo.bbox_around(lat, lon, radius), query=query).all()
+            ranked = sorted(((d, geo.distance_km(lat, lon, d.latitude, d.longitude)) for d in found),
+                            key=lambda pair: pair[1])
+            within_radius = [pair for pair in ranked if pair[1] <= radius]
+            if len(within_radius) >= k or radius >= geo.MAX_DISTANCE_KM:
+                return within_radius[:k]
+            radius *= 4 if len(found) < k else 2
+
+    def last_seen(self):
+        """last_seen_at, including presence not yet flushed to the database"""
+        from services import presence
+        pending = presence.last_seen(self.id)
+        if pending and (not self.last_seen_at or pending > self.last_seen_at):
+            return pending
+        return self.last_seen_at
+
+    def current_firmware(self):
+        """firmware_version, including a reported version not yet flushed"""
+        from services import presence
+        return presence.firmware_version(self.id) or self.firmware_version
+
     def is_online(self, threshold_minutes=10):
-        if not self.last_seen_at:
+        last_seen = self.last_seen()
+        if not last_seen:
             return False
-        diff = (datetime.utcnow() - self.last_seen_at).total_seconds()
+        diff = (datetime.utcnow() - last_seen).total_seconds()
         return diff < (threshold_minutes * 60)
 
 
@@ -42,3 +125,19 @@ class DeviceToken(db.Model):
 
     device = db.relationship('Device', backref=db.backref('tokens', lazy=True))
     user   = db.relationship('User', backref=db.backref('device_tokens', lazy=True))
+
+
+class FleetStat(db.Model):
+    """Materialized device counter, one row per (dimension, value).
+
+    Maintained incrementally by services.fleet_stats; dimensions are
+    'total', 'firmware', 'country', 'module_type', 'tag' and 'seen_minute'
+    (devices whose last_seen_at falls in that UTC minute).
+    """
+    __tablename__ = 'fleet_stats'
+    __table_args__ = (db.UniqueConstraint('dimension', 'value', name='uq_fleet_stats_dimension_value'),)
+
+    id           = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    dimension    = db.Column(db.String(20), nullable=False)
+    value        = db.Column(db.String(50), nullable=False, default='')
+    device_count = db.Column(db.Integer, nullable=False, default=0)
@@ -1,3 +1,4 @@
+import hashlib
 from datetime import datetime
 from models import db
 
@@ -9,10 +10,85 @@ class Firmware(db.Model):
     version     = db.Column(db.String(20), unique=True, nullable=False)
     filename    = db.Column(db.String(255), nullable=False)
     file_size   = db.Column(db.Integer, nullable=False)
-    checksum    = db.Column(db.String(64), nullable=True)
+    checksum    = db.Column(db.String(64), nullable=True, index=True)
     notes       = db.Column(db.Text, nullable=True)
     is_active   = db.Column(db.Boolean, default=False, nullable=False)
     uploaded_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     uploader = db.relationship('User', backref=db.backref('uploaded_firmwares', lazy=True))
+
+
+class FirmwareDelta(db.Model):
+    __tablename__ = 'firmware_deltas'
+    __table_args__ = (db.UniqueConstraint('from_firmware_id', 'to_firmware_id'),)
+
+    id               = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    from_firmware_id = db.Column(db.Integer, db.ForeignKey('firmwares.id'), nullable=False)
+    to_firmware_id   = db.Column(db.Integer, db.ForeignKey('firmwares.id'), nullable=False)
+    filename         = db.Column(db.String(255), nullable=False)   # bsdiff4 patch in FIRMWARE_UPLOAD_DIR
+    file_size        = db.Column(db.Integer, nullable=False)
+    checksum         = db.Column(db.String(64), nullable=False)    # SHA-256 of the patch file
+    created_at       = db.Column(db.DateTime, default=datetime.utcnow)
+
+    from_firmware = db.relationship('Firmware', foreign_keys=[from_firmware_id])
+    to_firmware   = db.relationship('Firmware', foreign_keys=[to_firmware_id],
+                                    backref=db.backref('deltas', lazy=True))
+
+
+class FirmwareRollout(db.Model):
+    """Staged delivery of a firmware: a hashed percentage of matching devices,
+    capped by a number of concurrent downloads, paused when failures rise."""
+    __tablename__ = 'firmware_rollouts'
+
+    id                = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    firmware_id       = db.Column(db.Integer, db.ForeignKey('firmwares.id'), nullable=False, index=True)
+    percentage        = db.Column(db.Integer, default=100, nullable=False)  # 0-100, cohorts hashed by hardware_id
+    max_concurrent    = db.Column(db.Integer, nullable=True)                # None = no download budget
+    country           = db.Column(db.String(100), nullable=True)            # comma-separated filters, None = any
+    tag               = db.Column(db.String(100), nullable=True)
+    module_type       = db.Column(db.String(100), nullable=True)
+    status            = db.Column(db.String(20), default='running', nullable=False)  # running, paused, completed
+    paused_reason     = db.Column(db.String(255), nullable=True)
+    failure_threshold = db.Column(db.Float, default=0.2, nullable=False)    # failure ratio that auto-pauses
+    min_reports       = db.Column(db.Integer, default=10, nullable=False)   # reports needed before auto-pause
+    success_count     = db.Column(db.Integer, default=0, nullable=False)
+    failure_count     = db.Column(db.Integer, default=0, nullable=False)
+    created_by        = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at        = db.Column(db.DateTime, default=datetime.utcnow)
+
+    firmware = db.relationship('Firmware', backref=db.backref('rollouts', lazy=True))
+
+    def cohort(self, hardware_id):
+        """Stable bucket 0-99 for a device; raising `percentage` only ever adds devices."""
+        digest = hashlib.sha256(f'{self.firmware_id}:{hardware_id}'.encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % 100
+
+    def matches(self, device):
+        for column, value in (('country', device.country), ('tag', device.tag),
+                              ('module_type', device.module_type)):
+            allowed = getattr(self, column)
+            if allowed and (value or '') not in [v.strip() for v in allowed.split(',')]:
+                return False
+        return self.cohort(device.hardware_id) < self.percentage
+
+    def failure_ratio(self):
+        total = self.success_count + self.failure_count
+        return self.failure_count / total if total else 0.0
+
+    def should_pause(self):
+        total = self.success_count + self.failure_count
+        return total >= self.min_reports and self.failure_ratio() > self.failure_threshold
+
+
+class FirmwareRolloutDownload(db.Model):
+    """A device's slot in a rollout's download budget, released by its OTA report."""
+    __tablename__ = 'firmware_rollout_downloads'
+    __table_args__ = (db.UniqueConstraint('rollout_id', 'device_id'),)
+
+    id          = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    rollout_id  = db.Column(db.Integer, db.ForeignKey('firmware_rollouts.id'), nullable=False, index=True)
+    device_id   = db.Column(db.Integer, db.ForeignKey('devices.id'), nullable=False)
+    status      = db.Column(db.String(20), default='downloading', nullable=False)  # downloading, succeeded, failed
+    started_at  = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
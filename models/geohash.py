@@ -0,0 +1,116 @@
+"""Geohash encoding and bounding-box covers for the devices.geohash B-tree index.
+
+A geohash interleaves longitude and latitude bits, so nearby points share a
+prefix and a cell is a contiguous range of the index. The base32 alphabet is
+in ASCII order, which makes string order match cell order.
+"""
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9  # ~5 m cells; what devices.geohash stores
+_AFTER_LAST = '{'  # sorts after every base32 character: cell + '{' bounds the cell's range
+
+EARTH_RADIUS_KM = 6371.0
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM  # antipodes
+
+
+def encode(lat, lon, precision=PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(lat degrees, lon degrees) spanned by a cell of `precision` characters."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def _cells(south, west, north, east, precision):
+    lat_step, lon_step = cell_size(precision)
+    rows = range(int((south + 90) // lat_step), int(min(north + 90, 179.999999) // lat_step) + 1)
+    cols = range(int((west + 180) // lon_step), int(min(east + 180, 359.999999) // lon_step) + 1)
+    return rows, cols, lat_step, lon_step
+
+
+def cover_precision(south, west, north, east, max_cells=32):
+    """Longest precision whose cells cover the box with at most `max_cells` cells."""
+    for precision in range(PRECISION, 0, -1):
+        rows, cols, _, _ = _cells(south, west, north, east, precision)
+        if len(rows) * len(cols) <= max_cells:
+            return precision
+    return 1
+
+
+def cover(south, west, north, east, max_cells=32):
+    """[(low, high)] string ranges of devices.geohash whose union covers the box.
+
+    Matches are `low <= geohash < high`; adjacent cells are merged into one
+    range. The cover is a superset: filter on latitude/longitude afterwards.
+    A box with west > east crosses the antimeridian.
+    """
+    if west > east:
+        return cover(south, west, north, 180.0, max_cells) + cover(south, -180.0, north, east, max_cells)
+    south, north = max(south, -90.0), min(north, 90.0)
+    west, east = max(west, -180.0), min(east, 180.0)
+    precision = cover_precision(south, west, north, east, max_cells)
+    rows, cols, lat_step, lon_step = _cells(south, west, north, east, precision)
+    cells = sorted({encode(-90 + (i + 0.5) * lat_step, -180 + (j + 0.5) * lon_step, precision)
+                    for i in rows for j in cols})
+
+    ranges = []
+    for cell in cells:
+        if ranges and _successor(ranges[-1][1]) == cell:
+            ranges[-1][1] = cell
+        else:
+            ranges.append([cell, cell])
+    return [(low, high + _AFTER_LAST) for low, high in ranges]
+
+
+def _successor(cell):
+    """Next cell of the same precision in index order, or None after the last."""
+    for i in range(len(cell) - 1, -1, -1):
+        index = BASE32.index(cell[i])
+        if index < 31:
+            return cell[:i] + BASE32[index + 1] + BASE32[0] * (len(cell) - i - 1)
+    return None
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def bbox_around(lat, lon, radius_km):
+    """(south, west, north, east) containing every point within `radius_km`."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    south, north = lat - dlat, lat + dlat
+    if south <= -90 or north >= 90:
+        return max(south, -90.0), -180.0, min(north, 90.0), 180.0
+    dlon = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+    west, east = lon - dlon, lon + dlon
+    if west < -180:
+        west += 360
+    if east > 180:
+        east -= 360
+    return south, west, north, east
@@ -0,0 +1,19 @@
+import hashlib
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def content_hash(text):
+    """SHA-256 of a stored JSON blob, computed once at write time so readers can compare cheaply."""
+    if text is None:
+        return None
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+@event.listens_for(Engine, 'connect')
+def _register_content_hash(dbapi_connection, connection_record):
+    """Expose content_hash() to SQL so set-based UPDATEs can keep the hash columns in step."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function('content_hash', 1, content_hash, deterministic=True)
@@ -1,12 +1,26 @@
 
 from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import validates
 from models import db
+from models.hashing import content_hash
+from models.trending import trending_score
+
+# Counters that feed trending_score
+_TRENDING_INPUTS = ('like_count', 'favorite_count', 'downloads')
 
 class Post(db.Model):
     __tablename__ = 'posts'
+    # (sort key, id) indexes for the keyset-paginated listings
+    __table_args__ = (db.Index('ix_posts_trending_id', 'trending_score', 'id'),
+                      db.Index('ix_posts_like_count_id', 'like_count', 'id'),
+                      db.Index('ix_posts_posted_at_id', 'posted_at', 'id'),
+                      db.Index('ix_posts_downloads_id', 'downloads', 'id'),
+                      db.Index('ix_posts_posted_by_posted_at_id', 'posted_by', 'posted_at', 'id'))
     
     id          = db.Column(db.Integer, primary_key=True, autoincrement=True) # Post ID
     data        = db.Column(db.Text)                                          # JSON GaugeFace file
+    data_hash   = db.Column(db.String(64), nullable=True)                     # SHA-256 of data, set on write
     title       = db.Column(db.String(255), nullable=False)                   # Post title
     description = db.Column(db.String(255), nullable=False)                   # Post description
     gauge_type  = db.Column(db.String(255), nullable=False)
@@ -16,6 +30,19 @@ class Post(db.Model):
 
     downloads = db.Column(db.Integer, default=0, nullable=False)  # Total number of downloads
 
+    # Denormalized counts, kept in step by increment() where rows are added/removed
+    like_count     = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    favorite_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    comment_count  = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    feature_count  = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+
+    trending_score = db.Column(db.Float, nullable=True)  # see models/trending.py; recomputed with the counters
+
+    @validates('data')
+    def _hash_data(self, key, value):
+        self.data_hash = content_hash(value)
+        return value
+
     def posted_how_long_ago(self):
         now = datetime.utcnow()
         diff = now - self.posted_at
@@ -34,18 +61,97 @@ class Post(db.Model):
         else:
             return self.posted_at.strftime("%b %d, %Y")  # e.g., "Apr 07, 2025"
 
+    @classmethod
+    def increment(cls, post_id, **deltas):
+        """Atomically add to counter columns, e.g. increment(post.id, like_count=1).
+
+        A single UPDATE ... SET col = col + n in the caller's transaction, so it
+        commits or rolls back together with the row it counts. trending_score is
+        recomputed from the new counts in the same statement.
+        """
+        values = {getattr(cls, column): getattr(cls, column) + delta for column, delta in deltas.items()}
+        if any(column in deltas for column in _TRENDING_INPUTS):
+            values[cls.trending_score] = db.func.trending_score(
+                *[getattr(cls, column) + deltas.get(column, 0) for column in _TRENDING_INPUTS], cls.posted_at)
+        cls.query.filter_by(id=post_id).update(values, synchronize_session=False)
+
+    @classmethod
+    def refresh_trending(cls):
+        """Recompute every trending_score from the counters; fixes rows written outside increment()
+        and applies changed weights. Returns how many rows changed."""
+        score = db.func.trending_score(*[getattr(cls, column) for column in _TRENDING_INPUTS], cls.posted_at)
+        result = db.session.execute(
+            db.update(cls)
+            .where(cls.trending_score.is_distinct_from(score))
+            .values({cls.trending_score: score})
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        return result.rowcount
+
+    @classmethod
+    def reconcile_counters(cls):
+        """Recount every counter column from its table and fix posts that drifted. Returns how many."""
+        counts = {
+            cls.like_count: PostLike,
+            cls.favorite_count: PostFavorite,
+            cls.comment_count: PostComment,
+            cls.feature_count: PostFeature,
+        }
+        actual = {column: db.select(db.func.count()).where(model.post_id == cls.id).scalar_subquery()
+                  for column, model in counts.items()}
+        result = db.session.execute(
+            db.update(cls)
+            .where(db.or_(*[column != count for column, count in actual.items()]))
+            .values({column: count for column, count in actual.items()})
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        return result.rowcount
+
+    @classmethod
+    def preload_listing(cls, posts, viewer=None):
+        """Batch-load what a page of post cards displays, in a constant number of queries.
+
+        Sets user_username and the viewer's liked / favorited flags on each
+        post, instead of one query per post and per attribute while rendering.
+        """
+        from models.user import User
+
+        ids = [post.id for post in posts]
+        if not ids:
+            return posts
+        usernames = dict(db.session.query(User.id, User.username)
+                         .filter(User.id.in_({post.posted_by for post in posts})))
+        liked = favorited = set()
+        if viewer is not None and viewer.is_authenticated:
+            liked = {row[0] for row in db.session.query(PostLike.post_id)
+                     .filter(PostLike.user_id == viewer.id, PostLike.post_id.in_(ids))}
+            favorited = {row[0] for row in db.session.query(PostFavorite.post_id)
+                         .filter(PostFavorite.user_id == viewer.id, PostFavorite.post_id.in_(ids))}
+
+        for post in posts:
+            post.user_username = usernames.get(post.posted_by)
+            post.liked = post.id in liked
+            post.favorited = post.id in favorited
+        return posts
+
     def total_likes(self):
-        return len(self.likes)
+        return self.like_count
     
     def total_features(self):
-        return len(self.features)
+        return self.feature_count
 
     def is_featured(self):
-        return len(self.features) > 0
+        return self.feature_count > 0
     
     def __repr__(self):
         return f'<Post {self.title}>'
 
+@event.listens_for(Post, 'before_insert')
+def _initial_trending_score(mapper, connection, post):
+    if post.posted_at is None:
+        post.posted_at = datetime.utcnow()
+    post.trending_score = trending_score(post.like_count, post.favorite_count, post.downloads, post.posted_at)
+
 class PostLike(db.Model):
     __tablename__ = 'post_likes'
 
@@ -62,6 +168,7 @@ class PostLike(db.Model):
 
 class PostComment(db.Model):
     __tablename__ = 'post_comments'
+    __table_args__ = (db.Index('ix_post_comments_post_created_id', 'post_id', 'created_at', 'id'),)
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)           # Comment ID
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), nullable=False) # The ID of the post being commented on
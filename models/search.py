@@ -0,0 +1,182 @@
+"""FTS5 full-text index over workshop posts (posts_fts).
+
+One row per post, rowid = posts.id, columns: title, description, author
+username and `tokens` extracted from the GaugeFace JSON (element classes,
+displayed values, units). Kept in step by mapper events on Post and User;
+counter UPDATEs go around the mapper and leave the index alone.
+"""
+import json
+import re
+
+from sqlalchemy import DDL, event, inspect, text
+
+from models import db
+from models.post import Post
+from models.user import User
+
+# bm25 column weights: title, description, username, gauge tokens
+BM25_WEIGHTS = (10.0, 4.0, 2.0, 1.0)
+TRENDING_WEIGHT = 0.5  # per unit of trending_score; one half-life of age is worth ~0.35 bm25
+CANDIDATES = 1000  # best bm25 matches re-ranked with trending
+RANKED_MATCHES = 2000  # above this many matches, candidates are the newest instead of the best (see search())
+
+CREATE_FTS = ("CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5("
+              "title, description, username, tokens, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+
+# Mirrors static/js/core/values/Value.js and units/UnitType.js: value name -> [(unit name, abbreviation)]
+_TEMPERATURE = [('Celsius', '°C'), ('Fahrenheit', '°F'), ('Kelvin', 'K')]
+_PRESSURE = [('PSI', 'psi'), ('Bar', 'bar'), ('InHg', 'inHg'), ('KPa', 'kPa')]
+VALUE_UNITS = {
+    'RPM': [('RPM', 'rpm')],
+    'Coolant Temp': _TEMPERATURE,
+    'Oil Temp': _TEMPERATURE,
+    'Transmission Temp': _TEMPERATURE,
+    'Oil Pressure': _PRESSURE,
+    'Transmission Fluid Pressure': _PRESSURE,
+    'Fuel Pressure': _PRESSURE,
+    'Boost Pressure': _PRESSURE,
+    'Distance Driven': [('Meter', 'm'), ('Foot', 'ft'), ('Kilometer', 'km'), ('Mile', 'mi')],
+    'Speed': [('Kilometers per hour', 'km/h'), ('Miles per hour', 'mph')],
+    'Fuel Level': [('Liter', 'L'), ('Gallon', 'gal'), ('CC', 'cc')],
+}
+
+_CAMEL = re.compile(r'(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])')
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def gauge_tokens(data):
+    """Searchable words from a GaugeFace JSON document ('' if it can't be parsed)."""
+    try:
+        face = json.loads(data) if isinstance(data, str) else data
+    except ValueError:
+        return ''
+
+    tokens = []
+    stack = [face]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict):
+            element_type = node.get('type')
+            if isinstance(element_type, str):
+                tokens += [element_type, _CAMEL.sub(' ', element_type)]  # "CNeedle", "C Needle"
+            value = node.get('gaugeValue')
+            if isinstance(value, dict) and isinstance(value.get('value'), str):
+                units = VALUE_UNITS.get(value['value'], [])
+                index = value.get('unitIndex')
+                tokens.append(value['value'])
+                if units:
+                    tokens += units[index] if isinstance(index, int) and 0 <= index < len(units) else units[0]
+            stack.extend(v for v in node.values() if isinstance(v, (dict, list)))
+    return ' '.join(dict.fromkeys(tokens))
+
+
+def match_expression(query):
+    """FTS5 MATCH string for free text: every word must match, the last as a prefix (type-ahead)."""
+    words = _WORD.findall(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words[:-1]] + [f'"{words[-1]}"*']
+    return ' '.join(terms)
+
+
+def search(query, base=None, limit=12, offset=0):
+    """Posts matching `query`, best first, as a list (at most `limit`, after `offset`).
+
+    bm25 picks the CANDIDATES best text matches inside FTS5, among the posts
+    that pass `base`'s filters (a filtered Post query; they are joined into
+    the candidate query, so a narrow filter still finds every match). The
+    candidates are re-ranked by bm25 blended with the trending score, so the
+    sort never touches more than CANDIDATES rows.
+
+    Picking the best CANDIDATES means scoring every match (~5 us each), so a
+    query matching more than RANKED_MATCHES posts takes the newest CANDIDATES
+    instead, which FTS5 reads straight off its rowid order. Such a term has
+    an idf near zero and bm25 barely separates its matches anyway, and the
+    trending score that ranks them favours recent posts.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    base = base if base is not None else Post.query
+    fts = db.table('posts_fts', db.column('rowid'))
+    filters = base.whereclause
+
+    def matching(*columns):
+        select = db.select(*columns).select_from(fts).where(db.literal_column('posts_fts').op('MATCH')(expression))
+        if filters is not None:
+            # +rowid keeps posts_fts the outer loop: driven from an index on posts
+            # instead, SQLite would re-run the MATCH once per filtered post
+            select = select.join(Post, Post.id == db.literal_column('+posts_fts.rowid')).where(filters)
+        return select
+
+    score = db.func.bm25(db.literal_column('posts_fts'), *BM25_WEIGHTS)
+    matches = db.session.execute(matching(db.func.count())).scalar()
+    if not matches:
+        return []
+    candidates = (matching(fts.c.rowid.label('post_id'), score.label('score'))
+                  .order_by(score if matches <= RANKED_MATCHES else fts.c.rowid.desc())
+                  .limit(CANDIDATES).subquery())
+    return (base.join(candidates, Post.id == candidates.c.post_id)
+            .order_by(candidates.c.score - TRENDING_WEIGHT * db.func.coalesce(Post.trending_score, 0), Post.id.desc())
+            .offset(offset).limit(limit).all())
+
+
+def _index(connection, post, username=None):
+    if username is None:
+        username = connection.execute(db.select(User.username).where(User.id == post.posted_by)).scalar()
+    connection.execute(text('DELETE FROM posts_fts WHERE rowid = :rowid'), {'rowid': post.id})
+    connection.execute(
+        text('INSERT INTO posts_fts (rowid, title, description, username, tokens) '
+             'VALUES (:rowid, :title, :description, :username, :tokens)'),
+        {'rowid': post.id, 'title': post.title or '', 'description': post.description or '',
+         'username': username or '', 'tokens': f'{post.gauge_type or ""} {gauge_tokens(post.data)}'})
+
+
+def rebuild():
+    """Re-index every post (first run, or after changing gauge_tokens)."""
+    db.session.execute(text(CREATE_FTS))
+    db.session.execute(text('DELETE FROM posts_fts'))
+    usernames = dict(db.session.query(User.id, User.username))
+    last_id = 0
+    while True:
+        posts = Post.query.filter(Post.id > last_id).order_by(Post.id).limit(500).all()
+        if not posts:
+            break
+        for post in posts:
+            _index(db.session.connection(), post, usernames.get(post.posted_by))
+        last_id = posts[-1].id
+    db.session.commit()
+
+
+# --- Sync: upload, edit, delete, rename ---
+
+event.listen(Post.__table__, 'after_create', DDL(CREATE_FTS))
+
+_INDEXED = ('title', 'description', 'data', 'gauge_type', 'posted_by')
+
+
+@event.listens_for(Post, 'after_insert')
+def _post_inserted(mapper, connection, post):
+    _index(connection, post)
+
+
+@event.listens_for(Post, 'after_update')
+def _post_updated(mapper, connection, post):
+    state = inspect(post)
+    if any(state.attrs[column].history.has_changes() for column in _INDEXED):
+        _index(connection, post)
+
+
+@event.listens_for(Post, 'after_delete')
+def _post_deleted(mapper, connection, post):
+    connection.execute(text('DELETE FROM posts_fts WHERE rowid = :rowid'), {'rowid': post.id})
+
+
+@event.listens_for(User, 'after_update')
+def _user_renamed(mapper, connection, user):
+    if inspect(user).attrs.username.history.has_changes():
+        connection.execute(text('UPDATE posts_fts SET username = :username WHERE rowid IN '
+                                '(SELECT id FROM posts WHERE posted_by = :user_id)'),
+                           {'username': user.username, 'user_id': user.id})
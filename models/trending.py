@@ -0,0 +1,36 @@
+import math
+import sqlite3
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Engagement weights
+LIKE_WEIGHT = 3.0
+FAVORITE_WEIGHT = 4.0
+DOWNLOAD_WEIGHT = 1.0
+
+HALF_LIFE_HOURS = 72  # a post's score halves every 3 days at equal engagement
+_DECAY_SECONDS = HALF_LIFE_HOURS * 3600 / math.log(2)
+_EPOCH = datetime(2025, 1, 1)
+
+
+def trending_score(likes, favorites, downloads, posted_at):
+    """ln of (1 + weighted engagement) * exp(-age / tau), shifted to a fixed epoch.
+
+    The decay factor is the same for every post at a given moment, so ranking
+    by ln(1 + engagement) + (posted_at - epoch) / tau never goes stale: the
+    score only changes when engagement does, and needs no periodic re-decay.
+    """
+    if isinstance(posted_at, str):
+        posted_at = datetime.fromisoformat(posted_at)
+    engagement = LIKE_WEIGHT * (likes or 0) + FAVORITE_WEIGHT * (favorites or 0) + DOWNLOAD_WEIGHT * (downloads or 0)
+    age = ((posted_at or _EPOCH) - _EPOCH).total_seconds()
+    return math.log1p(max(engagement, 0)) + age / _DECAY_SECONDS
+
+
+@event.listens_for(Engine, 'connect')
+def _register_trending_score(dbapi_connection, connection_record):
+    """Expose trending_score() to SQL so counter UPDATEs can recompute the score in the same statement."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function('trending_score', 4, trending_score, deterministic=True)
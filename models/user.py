@@ -1,6 +1,6 @@
 from models import db
 from flask_login import UserMixin
-from models.post import PostFavorite, PostLike
+from models.post import Post, PostFavorite, PostLike
 
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
@@ -40,12 +40,14 @@ class User(db.Model, UserMixin):
 
         if favorite:
             db.session.delete(favorite)
+            Post.increment(post.id, favorite_count=-1)
             db.session.commit()
             return False
         else:
             # If the user is not favoriting the post, favorite it
             new_favorite = PostFavorite(user_id=self.id, post_id=post.id)
             db.session.add(new_favorite)
+            Post.increment(post.id, favorite_count=1)
             db.session.commit()
             return True
         
@@ -63,11 +65,13 @@ class User(db.Model, UserMixin):
 
         if like:
             db.session.delete(like)
+            Post.increment(post.id, like_count=-1)
             db.session.commit()
             return False
         else:
             # If the user is not favoriting the post, favorite it
             new_like = PostLike(user_id=self.id, post_id=post.id)
             db.session.add(new_like)
+            Post.increment(post.id, like_count=1)
             db.session.commit()
             return True
\ No newline at end of file
@@ -1,13 +1,21 @@
 import os
+import json
 import hashlib
+import tempfile
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify
 from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload
+from werkzeug.formparser import parse_form_data
 from werkzeug.utils import secure_filename
 
-from models import db, Order, Firmware, Device
+from models import db, Order, Firmware, FirmwareRollout, Device, ConfigProfile, DEFAULT_ESP_CONFIG, merge_patch
+from services import delete_deltas, delete_rollouts, firmware_registry, keyset_paginate, SortKey, \
+    fleet_stats, bulk_update_devices, config_profiles, device_changes, fleet_analytics, device_map, start_build
 
 admin_bp = Blueprint('admin', __name__)
 
+DEVICES_PER_PAGE = 50
+
 @admin_bp.route("/admin")
 @login_required
 def admin_dashboard():
@@ -57,6 +65,30 @@ def firmware_list():
     return render_template("admin_firmware.html", firmwares=firmwares)
 
 
+class _HashingUpload:
+    """Hidden temp file in FIRMWARE_UPLOAD_DIR that hashes the upload as werkzeug writes it.
+
+    Used as the multipart parser's stream_factory, so the body goes to disk
+    once and is hashed on the way; the caller renames the file into place so
+    firmware_download never sees a partial image.
+    """
+
+    def __init__(self, directory):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        os.fchmod(fd, 0o644)  # mkstemp makes it 0600; nginx serves the images as another user
+        self._file = os.fdopen(fd, 'w+b')
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):  # seek, read and close for FileStorage
+        return getattr(self._file, name)
+
+
 @admin_bp.route("/admin/firmware/upload", methods=['GET', 'POST'])
 @login_required
 def firmware_upload():
@@ -65,50 +97,75 @@ def firmware_upload():
         return redirect(url_for('main.index'))
 
     if request.method == 'POST':
-        version = request.form.get('version', '').strip()
-        notes = request.form.get('notes', '').strip()
-        firmware_file = request.files.get('firmware')
-
-        if not version or not firmware_file:
-            flash('Version and firmware file are required.', 'danger')
-            return redirect(url_for('admin.firmware_upload'))
+        firmware_dir = current_app.config['FIRMWARE_UPLOAD_DIR']
+        uploads = []
+
+        def stream_factory(total_content_length, content_type, filename, content_length=None):
+            uploads.append(_HashingUpload(firmware_dir))
+            return uploads[-1]
+
+        # Parsed here rather than through request.files, whose default stream_factory
+        # would spool the image to a temp file of its own before we could copy it
+        try:
+            _, form, files = parse_form_data(request.environ, stream_factory=stream_factory,
+                                             max_content_length=request.max_content_length,
+                                             max_form_memory_size=request.max_form_memory_size,
+                                             max_form_parts=request.max_form_parts)
+            return _store_firmware(form, files.get('firmware'))
+        finally:
+            for upload in uploads:
+                upload.close()
+                if os.path.exists(upload.path):
+                    os.remove(upload.path)
 
-        if Firmware.query.filter_by(version=version).first():
-            flash(f'Firmware version {version} already exists.', 'danger')
-            return redirect(url_for('admin.firmware_upload'))
+    return render_template("admin_firmware_upload.html")
 
-        if not firmware_file.filename.endswith('.bin'):
-            flash('Only .bin files are accepted.', 'danger')
-            return redirect(url_for('admin.firmware_upload'))
 
-        filename = secure_filename(f"firmware_v{version}.bin")
-        firmware_dir = current_app.config['FIRMWARE_UPLOAD_DIR']
-        filepath = os.path.join(firmware_dir, filename)
-        firmware_file.save(filepath)
-
-        file_size = os.path.getsize(filepath)
-        sha256 = hashlib.sha256()
-        with open(filepath, 'rb') as f:
-            for chunk in iter(lambda: f.read(8192), b''):
-                sha256.update(chunk)
-        checksum = sha256.hexdigest()
-
-        fw = Firmware(
-            version=version,
-            filename=filename,
-            file_size=file_size,
-            checksum=checksum,
-            notes=notes or None,
-            is_active=False,
-            uploaded_by=current_user.id
-        )
-        db.session.add(fw)
-        db.session.commit()
-
-        flash(f'Firmware v{version} uploaded successfully.', 'success')
-        return redirect(url_for('admin.firmware_list'))
+def _store_firmware(form, firmware_file):
+    """Register an upload parsed by firmware_upload. Returns the response."""
+    version = form.get('version', '').strip()
+    notes = form.get('notes', '').strip()
+
+    if not version or not firmware_file:
+        flash('Version and firmware file are required.', 'danger')
+        return redirect(url_for('admin.firmware_upload'))
+
+    if Firmware.query.filter_by(version=version).first():
+        flash(f'Firmware version {version} already exists.', 'danger')
+        return redirect(url_for('admin.firmware_upload'))
+
+    if not firmware_file.filename.endswith('.bin'):
+        flash('Only .bin files are accepted.', 'danger')
+        return redirect(url_for('admin.firmware_upload'))
+
+    filename = secure_filename(f"firmware_v{version}.bin")
+    upload = firmware_file.stream
+    upload.close()
+    checksum = upload.sha256.hexdigest()
+
+    # Identical binaries share one image on disk
+    duplicate = Firmware.query.filter_by(checksum=checksum).first()
+    if duplicate:
+        filename = duplicate.filename
+        flash(f'Binary is identical to v{duplicate.version}; reusing its image.', 'success')
+    else:
+        os.replace(upload.path, os.path.join(current_app.config['FIRMWARE_UPLOAD_DIR'], filename))
+
+    fw = Firmware(
+        version=version,
+        filename=filename,
+        file_size=upload.size,
+        checksum=checksum,
+        notes=notes or None,
+        is_active=False,
+        uploaded_by=current_user.id
+    )
+    db.session.add(fw)
+    db.session.commit()
+    firmware_registry.invalidate()
 
-    return render_template("admin_firmware_upload.html")
+    flash(f'Firmware v{version} uploaded successfully.', 'success')
+    return redirect(url_for('admin.firmware_list'))
 
 
 @admin_bp.route("/admin/firmware/<int:firmware_id>/activate", methods=['POST'])
@@ -121,8 +178,28 @@ def firmware_activate(firmware_id):
     Firmware.query.update({'is_active': False})
     fw = Firmware.query.get_or_404(firmware_id)
     fw.is_active = True
+
+    # Optional staged rollout; without one every device is offered the update at once
+    percentage = request.form.get('rollout_percentage', type=int)
+    max_concurrent = request.form.get('max_concurrent', type=int)
+    filters = {col: request.form.get(col, '').strip() or None for col in ('country', 'tag', 'module_type')}
+    # Each activation replaces whatever rollout was gating this firmware before
+    FirmwareRollout.query.filter(FirmwareRollout.firmware_id == fw.id, FirmwareRollout.status != 'completed') \
+        .update({'status': 'completed'})
+    if (percentage is not None and percentage < 100) or max_concurrent or any(filters.values()):
+        db.session.add(FirmwareRollout(
+            firmware_id=fw.id,
+            percentage=max(0, min(100, percentage if percentage is not None else 100)),
+            max_concurrent=max_concurrent,
+            created_by=current_user.id,
+            **filters
+        ))
     db.session.commit()
+    firmware_registry.invalidate()
+    device_changes.notify_all()
 
+    # Delta patches are built in the background; until they land devices get the full image
+    start_build(current_app._get_current_object())
     flash(f'Firmware v{fw.version} is now the active version.', 'success')
     return redirect(url_for('admin.firmware_list'))
 
@@ -138,16 +215,56 @@ def firmware_delete(firmware_id):
 
     firmware_dir = current_app.config['FIRMWARE_UPLOAD_DIR']
     filepath = os.path.join(firmware_dir, fw.filename)
-    if os.path.exists(filepath):
+    shared = Firmware.query.filter(Firmware.filename == fw.filename, Firmware.id != fw.id).first()
+    if os.path.exists(filepath) and not shared:
         os.remove(filepath)
 
+    delete_deltas(fw)
+    delete_rollouts(fw)
     db.session.delete(fw)
     db.session.commit()
+    firmware_registry.invalidate()
 
     flash(f'Firmware v{fw.version} deleted.', 'success')
     return redirect(url_for('admin.firmware_list'))
 
 
+@admin_bp.route("/admin/firmware/rollouts/<int:rollout_id>", methods=['POST'])
+@login_required
+def firmware_rollout_update(rollout_id):
+    if not current_user.is_moderator():
+        flash("You do not have permission.", "danger")
+        return redirect(url_for('main.index'))
+
+    rollout = FirmwareRollout.query.get_or_404(rollout_id)
+    action = request.form.get('action', 'update')
+
+    if action == 'pause':
+        rollout.status = 'paused'
+        rollout.paused_reason = f'Paused by {current_user.username}'
+    elif action == 'resume':
+        # Start a fresh failure window so an old auto-pause does not trigger again
+        rollout.status = 'running'
+        rollout.paused_reason = None
+        rollout.success_count = 0
+        rollout.failure_count = 0
+    elif action == 'complete':
+        rollout.status = 'completed'
+
+    percentage = request.form.get('percentage', type=int)
+    if percentage is not None:
+        rollout.percentage = max(0, min(100, percentage))
+    if 'max_concurrent' in request.form:
+        rollout.max_concurrent = request.form.get('max_concurrent', type=int)
+
+    db.session.commit()
+    if action == 'complete':
+        firmware_registry.invalidate()  # after the commit, or another worker could reload the old rollout
+
+    flash(f'Rollout of v{rollout.firmware.version}: {rollout.status}, {rollout.percentage}% of devices.', 'success')
+    return redirect(url_for('admin.firmware_list'))
+
+
 # --- Admin Device Overview ---
 
 @admin_bp.route("/admin/devices")
@@ -157,14 +274,135 @@ def admin_devices():
         flash("You do not have permission to view this page.", "danger")
         return redirect(url_for('main.index'))
 
-    devices = Device.query.order_by(Device.last_seen_at.desc().nullslast()).all()
+    filters = {
+        'country': request.args.get('country', '').strip(),
+        'fw': request.args.get('fw', '').strip(),
+        'status': request.args.get('status', '').strip(),
+        'q': request.args.get('q', '').strip(),
+    }
+
+    query = Device.filtered(filters['country'], filters['fw'], filters['status'], filters['q']) \
+        .options(joinedload(Device.user))
+
+    page = keyset_paginate(
+        query,
+        [SortKey(Device.last_seen_at, descending=True, nullable=True), SortKey(Device.id)],
+        request.args.get('cursor'),
+        DEVICES_PER_PAGE
+    )
+
     firmwares = Firmware.query.order_by(Firmware.uploaded_at.desc()).all()
+    stats = fleet_stats.snapshot()
+    countries = sorted(stats['country'])
+    fw_versions = sorted(v for v in stats['firmware'] if v != 'unknown')
+
+    return render_template("admin_devices.html", devices=page.items, next_cursor=page.next_cursor,
+                           filters=filters, filter_args={k: v for k, v in filters.items() if v},
+                           firmwares=firmwares, countries=countries, fw_versions=fw_versions, stats=stats)
+
 
-    countries = sorted(set(d.country or 'FR' for d in devices))
-    fw_versions = sorted(set(d.firmware_version for d in devices if d.firmware_version))
+@admin_bp.route("/admin/fleet/stats")
+@login_required
+def fleet_stats_json():
+    """Materialized fleet counters for the admin dashboard."""
+    if not current_user.is_moderator():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(fleet_stats.snapshot())
+
+
+@admin_bp.route("/admin/fleet/analytics")
+@login_required
+def fleet_analytics_json():
+    """Telemetry distributions and threshold crossings per country, over the last `minutes`."""
+    if not current_user.is_moderator():
+        return jsonify({'error': 'Forbidden'}), 403
+    minutes = max(1, min(request.args.get('minutes', 60, type=int), 7 * 24 * 60))
+    return jsonify(fleet_analytics.summary(minutes))
+
+
+@admin_bp.route("/admin/fleet/map")
+@login_required
+def fleet_map_json():
+    """Clustered device markers for the map's visible box (south, west, north, east), same filters as the list."""
+    if not current_user.is_moderator():
+        return jsonify({'error': 'Forbidden'}), 403
+    box = [request.args.get(k, type=float) for k in ('south', 'west', 'north', 'east')]
+    if None in box or not (-90 <= box[0] <= box[2] <= 90 and -180 <= box[1] <= 180 and -180 <= box[3] <= 180):
+        return jsonify({'error': 'south, west, north and east are required (degrees)'}), 400
+
+    query = Device.filtered(request.args.get('country', '').strip(), request.args.get('fw', '').strip(),
+                            request.args.get('status', '').strip(), request.args.get('q', '').strip())
+    return jsonify(device_map.clusters(*box, query=query))
+
+
+@admin_bp.route("/admin/devices/nearest")
+@login_required
+def nearest_devices():
+    """The k devices closest to a point, for support."""
+    if not current_user.is_moderator():
+        return jsonify({'error': 'Forbidden'}), 403
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({'error': 'lat and lon are required (degrees)'}), 400
+    k = max(1, min(request.args.get('k', 10, type=int), 100))
+    return jsonify({'devices': device_map.nearest(lat, lon, k)})
+
+
+# --- Config profiles ---
+
+@admin_bp.route("/admin/config-profiles")
+@login_required
+def config_profile_list():
+    if not current_user.is_moderator():
+        return jsonify({'error': 'Forbidden'}), 403
+
+    counts = dict(db.session.query(Device.profile_id, db.func.count(Device.id)).group_by(Device.profile_id))
+    profiles = ConfigProfile.query.order_by(ConfigProfile.name).all()
+    return jsonify({'profiles': [{
+        'id': p.id,
+        'name': p.name,
+        'version': p.version,
+        'updated_at': p.updated_at.isoformat() if p.updated_at else None,
+        # devices without a profile follow 'default'
+        'devices': counts.get(p.id, 0) + (counts.get(None, 0) if p.name == 'default' else 0),
+    } for p in profiles]})
+
+
+@admin_bp.route("/admin/config-profiles/<name>", methods=['POST'])
+@login_required
+def config_profile_save(name):
+    """Create or update a profile from a full `config` or a merge `patch`."""
+    if not current_user.is_moderator():
+        return jsonify({'error': 'Forbidden'}), 403
+
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'Invalid JSON'}), 400
+    if len(name) > 50:
+        return jsonify({'error': 'Profile name too long'}), 400
+
+    profile = ConfigProfile.query.filter_by(name=name).first()
+    current = json.loads(profile.config_json) if profile else DEFAULT_ESP_CONFIG
+
+    if isinstance(data.get('config'), dict):
+        config = data['config']
+    elif isinstance(data.get('patch'), dict):
+        config = merge_patch(current, data['patch'])
+    else:
+        return jsonify({'error': 'config or patch object is required'}), 400
+
+    if profile is None:
+        profile = ConfigProfile(name=name, config_json=json.dumps(config), version=1)
+        db.session.add(profile)
+    else:
+        profile.config_json = json.dumps(config)
+        profile.version = ConfigProfile.version + 1
+    db.session.commit()
+    config_profiles.invalidate()
+    device_changes.notify_all()
 
-    return render_template("admin_devices.html", devices=devices, firmwares=firmwares,
-                           countries=countries, fw_versions=fw_versions)
+    return jsonify({'status': 'ok', 'id': profile.id, 'name': profile.name, 'version': profile.version})
 
 
 @admin_bp.route("/admin/devices/push-firmware", methods=['POST'])
@@ -184,10 +422,7 @@ def push_firmware():
     if not fw:
         return jsonify({'error': 'Firmware not found'}), 404
 
-    updated = 0
-    for dev in Device.query.filter(Device.id.in_(device_ids)).all():
-        dev.firmware_version = fw.version
-        updated += 1
+    updated = bulk_update_devices(device_ids, 'firmware', fw.version)
     db.session.commit()
 
     return jsonify({'status': 'ok', 'updated': updated, 'version': fw.version, 'device_ids': device_ids})
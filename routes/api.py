@@ -1,15 +1,23 @@
 import json
+import math
+import time
 import os
-from flask import Blueprint, request, jsonify, send_from_directory, current_app
+from flask import Blueprint, request, jsonify, send_from_directory, current_app, url_for
+from markupsafe import escape
 from functools import wraps
 from datetime import datetime
-from models import db, Device, DeviceToken, Firmware, Post
+from sqlalchemy.orm import defer
+from models import db, Device, DeviceToken, Firmware, FirmwareRollout, Post
+from models import geohash as geo
+from services import token_cache, presence, gauge_payload_cache, payload_version, firmware_registry, parse_version, \
+    debug_capture, active_rollout, offer_update, report_result, keyset_paginate, SortKey, config_profiles, \
+    device_changes, can_block, device_encoding, telemetry, TelemetryBufferFull, METRICS
 
 api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
 
-# --- Debug: store last raw requests for inspection ---
-_debug_log = []
-_DEBUG_MAX = 50
+_DEBUG_BODY_MAX = 2000
+_DEBUG_PAGE_SIZE = 50
+_VERSION_MAX = 20  # Device.firmware_version / Firmware.version column size
 
 
 # --- Auth decorator for ESP32 Bearer token ---
@@ -21,14 +29,16 @@ def require_device_token(f):
         if not auth_header.startswith('Bearer '):
             return jsonify({'error': 'Missing or invalid Authorization header'}), 401
 
-        token_str = auth_header[7:]
-        token = DeviceToken.query.filter_by(token=token_str, is_active=True).first()
-        if not token:
+        token = token_cache.lookup(auth_header[7:])
+        if not token or not token.is_active:
             return jsonify({'error': 'Invalid or revoked token'}), 401
 
-        device = token.device
-        device.last_seen_at = datetime.utcnow()
-        db.session.commit()
+        # config_json (device overrides) is only loaded on a resolved-config cache miss
+        device = db.session.get(Device, token.device_id, options=[defer(Device.config_json)])
+        if not device:
+            return jsonify({'error': 'Invalid or revoked token'}), 401
+
+        presence.record(device.id)
 
         kwargs['device'] = device
         kwargs['token'] = token
@@ -37,18 +47,120 @@ def require_device_token(f):
     return decorated
 
 
+# --- Payload helpers (shared by the single-purpose endpoints and /sync) ---
+
+def _reported_version(value):
+    """A firmware version reported by a device, or None unless it is a short string."""
+    if isinstance(value, str) and 0 < len(value) <= _VERSION_MAX:
+        return value
+    return None
+
+
+def _gauge_hash(post):
+    if not post:
+        return None
+    return f'{post.id}-{payload_version(post)}'
+
+
+def _not_modified(etag):
+    """304 response if the client already holds `etag`, else None."""
+    if etag and request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def _device_format():
+    """JSON, or CBOR when the device's Accept header asks for it."""
+    return device_encoding.negotiate(request.accept_mimetypes)
+
+
+def _format_etag(etag, mimetype):
+    """Give each representation its own validator."""
+    if etag and mimetype != device_encoding.JSON:
+        return f'{etag}.cbor'
+    return etag
+
+
+def _encoded_response(body, mimetype, etag=None):
+    response = current_app.response_class(body, mimetype=mimetype)
+    response.vary.add('Accept')
+    if etag:
+        response.set_etag(etag)
+    return response
+
+
+def _device_response(payload, etag=None):
+    """`payload` encoded in the format negotiated with the device."""
+    mimetype = _device_format()
+    return _encoded_response(device_encoding.encode(payload, mimetype), mimetype, etag)
+
+
+def _gauge_payload(post):
+    if not post:
+        return {'post_id': None, 'data': None}
+
+    try:
+        gauge_data = json.loads(post.data)
+    except (json.JSONDecodeError, TypeError):
+        gauge_data = post.data
+
+    return {
+        'post_id': post.id,
+        'title': post.title,
+        'gauge_type': post.gauge_type,
+        'data': gauge_data
+    }
+
+
+def _config_payload(device):
+    return config_profiles.effective(device)
+
+
+def _firmware_update(release, current_version, device):
+    if release and release.version_tuple > parse_version(current_version):
+        if release.rollout_id:
+            rollout = db.session.get(FirmwareRollout, release.rollout_id)
+            if rollout and not offer_update(rollout, device):
+                return {
+                    'update_available': False,
+                    'version': current_version,
+                    'deferred': True,
+                    'retry_after': current_app.config['ROLLOUT_RETRY_AFTER']
+                }
+
+        update = {
+            'update_available': True,
+            'version': release.version,
+            'file_size': release.file_size,
+            'checksum': release.checksum,
+            'download_url': '/api/v1/firmware/download'
+        }
+
+        # bsdiff4 patch from the running version; `checksum` above still
+        # verifies the patched image
+        delta = release.deltas.get(current_version)
+        if delta:
+            update['delta'] = {
+                'from_version': current_version,
+                'file_size': delta.file_size,
+                'checksum': delta.checksum,
+                'format': 'bsdiff4',
+                'download_url': f'/api/v1/firmware/delta?from={current_version}'
+            }
+        return update
+
+    return {'update_available': False, 'version': current_version}
+
+
 # --- Endpoints ---
 
 @api_bp.route('/heartbeat', methods=['POST'])
 @require_device_token
 def heartbeat(device, token):
     data = request.get_json(silent=True) or {}
-
-    if 'firmware_version' in data:
-        device.firmware_version = data['firmware_version']
-
-    device.last_seen_at = datetime.utcnow()
-    db.session.commit()
+    presence.record(device.id, _reported_version(data.get('firmware_version')))
 
     return jsonify({
         'status': 'ok',
@@ -57,91 +169,306 @@ def heartbeat(device, token):
     }), 200
 
 
+@api_bp.route('/sync', methods=['POST'])
+@require_device_token
+def sync(device, token):
+    """Boot-time round trip: heartbeat, status, config, gauge and firmware check.
+
+    The device posts its firmware_version and the config_hash / gauge_hash it
+    holds; config and gauge are only included when they differ. Devices with
+    GPS may add latitude / longitude.
+    """
+    data = request.get_json(silent=True) or {}
+    reported = data.get('firmware_version')
+    if reported is not None and not isinstance(reported, str):
+        return jsonify({'error': 'firmware_version must be a string'}), 400
+    current_version = reported or '0.0.0'
+    presence.record(device.id, _reported_version(reported))
+    _update_position(device, data.get('latitude'), data.get('longitude'))
+
+    post = None
+    if device.assigned_post_id:
+        post = db.session.get(Post, device.assigned_post_id, options=[defer(Post.data)])
+
+    result = {
+        'status': 'ok',
+        'device_id': device.id,
+        'hardware_id': device.hardware_id,
+        'name': device.name,
+        'assigned_post_id': post.id if post else None,
+        'assigned_gauge': post.title if post else None,
+        'config_hash': config_profiles.etag(device),
+        'gauge_hash': _gauge_hash(post),
+        'firmware': _firmware_update(firmware_registry.active(), current_version, device)
+    }
+
+    if result['config_hash'] != data.get('config_hash'):
+        result['config'] = _config_payload(device)
+
+    if result['gauge_hash'] != data.get('gauge_hash'):
+        result['gauge'] = _gauge_payload(post)
+
+    return _device_response(result), 200
+
+
+def _update_position(device, lat, lon):
+    """Store a reported GPS position, only when it moved out of its ~150 m geohash cell."""
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (lat, lon)):
+        return
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return
+    if device.geohash and device.geohash[:7] == geo.encode(lat, lon, 7):
+        return
+    device.latitude, device.longitude = lat, lon
+    db.session.commit()
+
+
+def _wait_changes(device, config_hash, gauge_hash, release_id, current_version):
+    """What changed for `device` since it last saw these hashes and this release; {} if nothing."""
+    result = {}
+
+    etag = config_profiles.etag(device)
+    if config_hash is not None and etag != config_hash:
+        result['config_hash'] = etag
+        result['config'] = _config_payload(device)
+
+    if gauge_hash is not None:
+        post = None
+        if device.assigned_post_id:
+            post = db.session.get(Post, device.assigned_post_id, options=[defer(Post.data)])
+        if (_gauge_hash(post) or '') != gauge_hash:
+            result['gauge_hash'] = _gauge_hash(post)
+            result['gauge'] = _gauge_payload(post)
+
+    release = firmware_registry.active()
+    if (release.id if release else None) != release_id:
+        result['firmware'] = _firmware_update(release, current_version, device)
+
+    return result
+
+
+@api_bp.route('/wait', methods=['GET'])
+@require_device_token
+def wait_for_changes(device, token):
+    """Long-poll: answer as soon as the device's config, gauge or the active firmware changes.
+
+    The device passes the config_hash and gauge_hash it holds (as returned by
+    /sync) and its firmware_version. Differences are answered right away;
+    otherwise the request waits up to DEVICE_WAIT_TIMEOUT seconds and ends
+    with 204. Under sync workers it never waits, so it degrades to a poll.
+    """
+    config_hash = request.args.get('config_hash')
+    gauge_hash = request.args.get('gauge_hash')
+    current_version = request.args.get('firmware_version') or '0.0.0'
+    presence.record(device.id)
+
+    timeout = current_app.config['DEVICE_WAIT_TIMEOUT']
+    timeout = max(0.0, min(request.args.get('timeout', timeout, type=float), timeout))
+    if not can_block(request.environ):
+        timeout = 0.0
+    deadline = time.monotonic() + timeout
+
+    release = firmware_registry.active()
+    release_id = release.id if release else None
+    device_id = device.id
+
+    with device_changes.listen(device_id) as changed:
+        while True:
+            result = _wait_changes(device, config_hash, gauge_hash, release_id, current_version)
+            if result:
+                result.update(status='ok', device_id=device_id)
+                return _device_response(result), 200
+
+            db.session.close()  # don't hold a pooled connection while idle
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not changed.wait(remaining):
+                return '', 204
+            changed.clear()
+
+            firmware_registry.refresh()
+            config_profiles.refresh()
+            device = db.session.get(Device, device_id, options=[defer(Device.config_json)])
+            if device is None:
+                return jsonify({'error': 'Device not found'}), 404
+
+
 @api_bp.route('/gauge', methods=['GET'])
 @require_device_token
 def get_gauge(device, token):
-    if not device.assigned_post_id:
-        return jsonify({'post_id': None, 'data': None}), 200
+    post = None
+    if device.assigned_post_id:
+        post = db.session.get(Post, device.assigned_post_id, options=[defer(Post.data)])
 
-    post = Post.query.get(device.assigned_post_id)
-    if not post:
-        return jsonify({'post_id': None, 'data': None}), 200
+    mimetype = _device_format()
+    etag = _format_etag(_gauge_hash(post), mimetype)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
 
-    try:
-        gauge_data = json.loads(post.data)
-    except (json.JSONDecodeError, TypeError):
-        gauge_data = post.data
+    if not post:
+        return _device_response(_gauge_payload(post), etag), 200
 
-    return jsonify({
-        'post_id': post.id,
-        'title': post.title,
-        'gauge_type': post.gauge_type,
-        'data': gauge_data
-    }), 200
+    payload = gauge_payload_cache.get(
+        post, lambda: device_encoding.encode(_gauge_payload(post), mimetype), mimetype)
+    if payload.gzipped and 'gzip' in request.accept_encodings:
+        response = _encoded_response(payload.gzipped, mimetype, etag)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = _encoded_response(payload.body, mimetype, etag)
+    response.vary.add('Accept-Encoding')
+    return response, 200
 
 
 @api_bp.route('/firmware/check', methods=['GET'])
 @require_device_token
 def firmware_check(device, token):
     current_version = request.args.get('current_version', '0.0.0')
+    return _device_response(_firmware_update(firmware_registry.active(), current_version, device)), 200
 
-    active_firmware = Firmware.query.filter_by(is_active=True).first()
-    if not active_firmware:
-        return jsonify({'update_available': False, 'version': current_version}), 200
 
-    def parse_version(v):
-        try:
-            return tuple(int(x) for x in v.split('.'))
-        except (ValueError, AttributeError):
-            return (0, 0, 0)
+def _send_firmware_file(filename, headers):
+    """Firmware image response with Range support, or an nginx X-Accel-Redirect."""
+    firmware_dir = current_app.config['FIRMWARE_UPLOAD_DIR']
+    if not os.path.exists(os.path.join(firmware_dir, filename)):
+        return jsonify({'error': 'Firmware file not found'}), 404
 
-    if parse_version(active_firmware.version) > parse_version(current_version):
-        return jsonify({
-            'update_available': True,
-            'version': active_firmware.version,
-            'file_size': active_firmware.file_size,
-            'checksum': active_firmware.checksum,
-            'download_url': '/api/v1/firmware/download'
-        }), 200
+    accel_prefix = current_app.config.get('FIRMWARE_ACCEL_REDIRECT')
+    if accel_prefix:
+        # nginx streams the file (and handles Range) from its internal location
+        response = current_app.response_class(mimetype='application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{filename}"
+    else:
+        # conditional=True lets werkzeug answer Range / If-Range with 206 so
+        # interrupted OTA downloads can resume
+        response = send_from_directory(
+            firmware_dir,
+            filename,
+            mimetype='application/octet-stream',
+            conditional=True
+        )
 
-    return jsonify({'update_available': False, 'version': current_version}), 200
+    response.headers.update(headers)
+    return response
+
+
+@api_bp.route('/firmware/report', methods=['POST'])
+@require_device_token
+def firmware_report(device, token):
+    """OTA outcome from a device: {"version": "3.0.1", "status": "success" | "failure", "error": "..."}"""
+    data = request.get_json(silent=True) or {}
+    version = data.get('version')
+    status = data.get('status')
+    if not isinstance(version, str) or not version or status not in ('success', 'failure'):
+        return jsonify({'error': 'version and status (success|failure) required'}), 400
+
+    firmware = Firmware.query.filter_by(version=version).first()
+    if not firmware:
+        return jsonify({'error': 'Unknown firmware version', 'version': version}), 404
+
+    if status == 'success':
+        presence.record(device.id, version)
+    else:
+        current_app.logger.warning('OTA to %s failed on device %s: %s', version, device.id, data.get('error'))
+
+    rollout = active_rollout(firmware.id)
+    if rollout:
+        report_result(rollout, device, status == 'success')
+
+    return jsonify({'status': 'ok'}), 200
 
 
 @api_bp.route('/firmware/download', methods=['GET'])
 @require_device_token
 def firmware_download(device, token):
-    active_firmware = Firmware.query.filter_by(is_active=True).first()
-    if not active_firmware:
+    release = firmware_registry.active()
+    if not release:
         return jsonify({'error': 'No active firmware'}), 404
 
-    firmware_dir = current_app.config['FIRMWARE_UPLOAD_DIR']
-    filepath = os.path.join(firmware_dir, active_firmware.filename)
+    return _send_firmware_file(release.filename, {'X-Firmware-Version': release.version})
 
-    if not os.path.exists(filepath):
-        return jsonify({'error': 'Firmware file not found'}), 404
 
-    response = send_from_directory(
-        firmware_dir,
-        active_firmware.filename,
-        mimetype='application/octet-stream'
-    )
-    response.headers['X-Firmware-Version'] = active_firmware.version
-    response.headers['Content-Length'] = active_firmware.file_size
-    return response
+@api_bp.route('/firmware/delta', methods=['GET'])
+@require_device_token
+def firmware_delta_download(device, token):
+    from_version = request.args.get('from', '')
 
+    release = firmware_registry.active()
+    if not release:
+        return jsonify({'error': 'No active firmware'}), 404
 
-@api_bp.route('/config', methods=['GET'])
+    delta = release.deltas.get(from_version)
+    if not delta:
+        return jsonify({'error': 'No delta available', 'from_version': from_version}), 404
+
+    return _send_firmware_file(delta.filename, {
+        'X-Firmware-Version': release.version,
+        'X-Firmware-Delta-From': from_version
+    })
+
+
+@api_bp.route('/telemetry', methods=['POST'])
 @require_device_token
-def get_config(device, token):
-    if not device.config_json:
-        return jsonify({'config': None}), 200
+def ingest_telemetry(device, token):
+    """Batched samples: {"samples": [{"t": unix seconds, "rpm": .., "volt": .., "speed": .., "tilt": ..}]}.
+
+    JSON or CBOR. "t" defaults to the time of receipt; samples outside the
+    retention window or more than 5 minutes ahead are rejected. Samples are
+    buffered and written asynchronously, hence 202.
+    """
+    data = device_encoding.decode(request.get_data(), request.mimetype)
+    samples = data.get('samples') if isinstance(data, dict) else None
+    if not isinstance(samples, list):
+        return jsonify({'error': 'samples list required'}), 400
+    if len(samples) > current_app.config['TELEMETRY_MAX_BATCH']:
+        return jsonify({'error': 'Too many samples', 'max': current_app.config['TELEMETRY_MAX_BATCH']}), 413
+
+    now = time.time()
+    oldest = now - current_app.config['TELEMETRY_RETENTION_DAYS'] * 86400
+    rows = []
+    for sample in samples:
+        if not isinstance(sample, dict):
+            continue
+        t = sample.get('t', now)
+        if isinstance(t, bool) or not isinstance(t, (int, float)) or not oldest <= t <= now + 300:
+            continue
+        values = [_sample_value(sample.get(metric)) for metric in METRICS]
+        if any(v is not None for v in values):
+            rows.append((device.id, int(t * 1000), *values))
 
     try:
-        config_data = json.loads(device.config_json)
-    except (json.JSONDecodeError, TypeError):
-        return jsonify({'config': None}), 200
+        telemetry.ingest(rows)
+    except TelemetryBufferFull:
+        response = jsonify({'error': 'Telemetry buffer full, retry later'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    presence.record(device.id)
+    return jsonify({'status': 'ok', 'accepted': len(rows), 'rejected': len(samples) - len(rows)}), 202
+
+
+def _sample_value(value):
+    """A metric as a finite float, or None (missing, not a number, NaN/inf, or too big for a float)."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    try:
+        value = float(value)
+    except OverflowError:  # JSON or CBOR bignums
+        return None
+    return value if math.isfinite(value) else None
 
-    return jsonify({'config': config_data}), 200
+
+@api_bp.route('/config', methods=['GET'])
+@require_device_token
+def get_config(device, token):
+    mimetype = _device_format()
+    etag = _format_etag(config_profiles.etag(device), mimetype)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    body = config_profiles.encoded(device, mimetype,
+                                   lambda config: device_encoding.encode({'config': config}, mimetype))
+    return _encoded_response(body, mimetype, etag), 200
 
 
 @api_bp.route('/status', methods=['GET'])
@@ -152,11 +479,11 @@ def device_status(device, token):
         post = Post.query.get(device.assigned_post_id)
         gauge_title = post.title if post else None
 
-    return jsonify({
+    return _device_response({
         'device_id': device.id,
         'hardware_id': device.hardware_id,
         'name': device.name,
-        'firmware_version': device.firmware_version,
+        'firmware_version': device.current_firmware(),
         'assigned_gauge': gauge_title,
         'assigned_post_id': device.assigned_post_id
     }), 200
@@ -166,52 +493,72 @@ def device_status(device, token):
 
 @api_bp.before_request
 def _log_all_requests():
-    """Log every request hitting /api/v1/ for debug purposes."""
-    entry = {
+    """Capture a sample of /api/v1/ requests for the debug page."""
+    if not debug_capture.should_sample():
+        return
+
+    if request.content_length and request.content_length > _DEBUG_BODY_MAX:
+        body = f'<{request.content_length} bytes>'
+    else:
+        body = request.get_data(as_text=True)[:_DEBUG_BODY_MAX]
+
+    debug_capture.record({
         'time': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC'),
         'method': request.method,
         'path': request.full_path,
         'remote': request.remote_addr,
-        'headers': {k: v for k, v in request.headers if k in (
+        'headers': {k: _redact(k, v) for k, v in request.headers if k in (
             'Authorization', 'Content-Type', 'User-Agent', 'Host')},
-        'body': request.get_data(as_text=True)[:2000],
-    }
-    _debug_log.append(entry)
-    if len(_debug_log) > _DEBUG_MAX:
-        _debug_log.pop(0)
+        'body': body,
+    })
+
+
+def _redact(header, value):
+    """Keep bearer tokens out of the capture file; the page only needs to see one was sent."""
+    if header == 'Authorization':
+        scheme = value.split(' ', 1)[0]
+        return f'{scheme} <redacted>' if ' ' in value else '<redacted>'
+    return value
 
 
 @api_bp.route('/debug', methods=['GET'])
 def debug_page():
-    """Raw HTML page showing all recent API requests."""
-    devices = Device.query.all()
-    tokens = DeviceToken.query.all()
-
-    rows = ''
-    for e in reversed(_debug_log):
-        rows += (
-            f'<tr><td>{e["time"]}</td><td>{e["method"]}</td>'
-            f'<td>{e["path"]}</td><td>{e["remote"]}</td>'
-            f'<td style="font-size:11px">{e["headers"]}</td>'
-            f'<td style="max-width:400px;word-break:break-all;font-size:11px">{e["body"]}</td></tr>'
-        )
+    """Raw HTML page showing recent API requests, devices and tokens (50 per page)."""
+    search = request.args.get('q', '').strip()
+    devices = keyset_paginate(Device.filtered(search=search), [SortKey(Device.id)],
+                              request.args.get('devices'), _DEBUG_PAGE_SIZE)
+    tokens = keyset_paginate(DeviceToken.query, [SortKey(DeviceToken.id)],
+                             request.args.get('tokens'), _DEBUG_PAGE_SIZE)
+    debug_log = debug_capture.recent(50)
+
+    rows = ''.join(
+        f'<tr><td>{escape(e["time"])}</td><td>{escape(e["method"])}</td>'
+        f'<td>{escape(e["path"])}</td><td>{escape(e["remote"])}</td>'
+        f'<td style="font-size:11px">{escape(e["headers"])}</td>'
+        f'<td style="max-width:400px;word-break:break-all;font-size:11px">{escape(e["body"])}</td></tr>'
+        for e in debug_log
+    )
 
-    dev_rows = ''
-    for d in devices:
-        dev_rows += (
-            f'<tr><td>{d.id}</td><td>{d.hardware_id}</td><td>{d.name}</td>'
-            f'<td>{d.firmware_version or "—"}</td>'
-            f'<td>{d.last_seen_at or "Never"}</td>'
-            f'<td>{"ONLINE" if d.is_online() else "offline"}</td></tr>'
-        )
+    dev_rows = ''.join(
+        f'<tr><td>{d.id}</td><td>{escape(d.hardware_id)}</td><td>{escape(d.name)}</td>'
+        f'<td>{escape(d.current_firmware() or "—")}</td>'
+        f'<td>{d.last_seen() or "Never"}</td>'
+        f'<td>{"ONLINE" if d.is_online() else "offline"}</td></tr>'
+        for d in devices.items
+    )
 
-    tok_rows = ''
-    for t in tokens:
-        tok_rows += (
-            f'<tr><td>{t.device_id}</td>'
-            f'<td style="font-size:10px;word-break:break-all">{t.token[:16]}...{t.token[-8:]}</td>'
-            f'<td>{"active" if t.is_active else "revoked"}</td></tr>'
-        )
+    tok_rows = ''.join(
+        f'<tr><td>{t.device_id}</td>'
+        f'<td style="font-size:10px;word-break:break-all">{t.token[:16]}...{t.token[-8:]}</td>'
+        f'<td>{"active" if t.is_active else "revoked"}</td></tr>'
+        for t in tokens.items
+    )
+
+    def next_link(param, cursor):
+        if not cursor:
+            return ''
+        args = {k: v for k, v in request.args.items() if k != param}
+        return f'<p><a style="color:#4CAF50" href="{escape(url_for("api.debug_page", **args, **{param: cursor}))}">Page suivante &raquo;</a></p>'
 
     html = f'''<!DOCTYPE html><html><head><title>API Debug</title>
 <meta http-equiv="refresh" content="10">
@@ -220,17 +567,20 @@ table{{border-collapse:collapse;width:100%;margin-bottom:30px}}
 th,td{{border:1px solid #444;padding:6px 10px;text-align:left;font-size:13px}}
 th{{background:#222}}h2{{color:#4CAF50}}</style></head><body>
 <h1>API Debug - dezzip.fr</h1>
-<p>Auto-refresh toutes les 10s. {len(_debug_log)} requetes en memoire.</p>
+<p>Auto-refresh toutes les 10s. {len(debug_log)} requetes capturees (tous workers).</p>
 
 <h2>Devices en DB</h2>
+<form method="GET"><input name="q" value="{escape(search)}" placeholder="Nom ou HW ID"> <button>Filtrer</button></form>
 <table><tr><th>ID</th><th>HW ID</th><th>Name</th><th>FW</th><th>Last Seen</th><th>Status</th></tr>
 {dev_rows}</table>
+{next_link('devices', devices.next_cursor)}
 
 <h2>Tokens</h2>
 <table><tr><th>Device ID</th><th>Token (tronque)</th><th>Status</th></tr>
 {tok_rows}</table>
+{next_link('tokens', tokens.next_cursor)}
 
-<h2>Dernières requetes API ({len(_debug_log)})</h2>
+<h2>Dernières requetes API ({len(debug_log)})</h2>
 <table><tr><th>Time</th><th>Method</th><th>Path</th><th>Remote IP</th><th>Headers</th><th>Body</th></tr>
 {rows}</table>
 
@@ -255,7 +605,7 @@ def debug_ping():
 @api_bp.route('/ping', methods=['POST'])
 def device_ping():
     """Open endpoint — ESP32 authenticates by MAC address (hardware_id).
-    Updates last_seen_at and firmware_version for the matching device."""
+    Records presence (last_seen_at, firmware_version) for the matching device."""
     data = request.get_json(silent=True) or {}
 
     mac = data.get('mac', '').upper().strip()
@@ -266,10 +616,7 @@ def device_ping():
     if not device:
         return jsonify({'error': 'unknown device', 'mac': mac}), 404
 
-    device.last_seen_at = datetime.utcnow()
-    if 'firmware_version' in data:
-        device.firmware_version = data['firmware_version']
-    db.session.commit()
+    presence.record(device.id, _reported_version(data.get('firmware_version')))
 
     return jsonify({
         'status': 'ok',
@@ -1,23 +1,24 @@
 import json
 import secrets
+from datetime import datetime, timedelta
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
-from models import db, Device, DeviceToken, Post, Firmware
+from models import db, Device, DeviceToken, Post, diff_patch
+from services import token_cache, firmware_registry, bulk_update_devices, BULK_ACTIONS, config_profiles, \
+    device_changes, telemetry, METRICS
 
 devices_bp = Blueprint('devices', __name__)
 
+ALLOWED_TAGS = ['production', 'test', 'vehicle', 'lab']
+BULK_FILTERS = ('country', 'fw', 'status', 'q', 'tag')  # Device.filtered() arguments, in order
+
 
 @devices_bp.route('/devices')
 @login_required
 def my_devices():
     devices = Device.query.filter_by(user_id=current_user.id).all()
-    # Get latest active firmware version for check-update
-    active_fw = Firmware.query.filter_by(is_active=True).first()
-    latest_fw = active_fw.version if active_fw else None
-    if not latest_fw:
-        # Fallback: get the newest firmware by version
-        newest = Firmware.query.order_by(Firmware.uploaded_at.desc()).first()
-        latest_fw = newest.version if newest else None
+    # Active firmware version (or newest upload) for check-update
+    latest_fw = firmware_registry.latest_version()
     return render_template('devices.html', devices=devices, latest_firmware=latest_fw)
 
 
@@ -50,22 +51,18 @@ def register_device():
             tag=request.form.get('usage', '').strip() or None,
         )
 
-        # Store car info in config_json
+        # Store car info as an override on top of the default profile
         car_brand = request.form.get('car_brand', '').strip()
         car_model = request.form.get('car_model', '').strip()
         car_year = request.form.get('car_year', '').strip()
         usage = request.form.get('usage', '').strip()
         if car_brand or car_model or car_year or usage:
-            import json as _json
             extra = {}
             if car_brand: extra['car_brand'] = car_brand
             if car_model: extra['car_model'] = car_model
             if car_year: extra['car_year'] = car_year
             if usage: extra['usage'] = usage
-            # Merge with default config
-            config = DEFAULT_ESP_CONFIG.copy()
-            config['vehicle'] = extra
-            device.config_json = _json.dumps(config)
+            device.config_json = json.dumps({'vehicle': extra})
 
         db.session.add(device)
         db.session.flush()
@@ -121,6 +118,7 @@ def assign_gauge(device_id):
             device.assigned_post_id = None
 
         db.session.commit()
+        device_changes.notify([device.id])
         flash('Gauge assignment updated!', 'success')
         return redirect(url_for('devices.my_devices'))
 
@@ -146,6 +144,7 @@ def regenerate_token(device_id):
     )
     db.session.add(new_token)
     db.session.commit()
+    token_cache.invalidate_device(device.id)
 
     flash('New token generated. Update your ESP32 with the new token.', 'success')
     return render_template('device_registered.html', device=device, token=token_str)
@@ -179,8 +178,7 @@ def update_device_tag(device_id):
     if not data or 'tag' not in data:
         return jsonify({'error': 'Missing tag'}), 400
 
-    allowed = ['production', 'test', 'vehicle', 'lab']
-    if data['tag'] not in allowed:
+    if data['tag'] not in ALLOWED_TAGS:
         return jsonify({'error': 'Invalid tag'}), 400
 
     device.tag = data['tag']
@@ -196,52 +194,106 @@ def delete_device(device_id):
         flash('You do not own this device.', 'danger')
         return redirect(url_for('devices.my_devices'))
 
-    DeviceToken.query.filter_by(device_id=device.id).update({'is_active': False})
+    # Tokens reference the device (NOT NULL), so they go with it
+    DeviceToken.query.filter_by(device_id=device.id).delete()
     db.session.delete(device)
     db.session.commit()
+    token_cache.invalidate_device(device_id)
 
     flash('Device removed.', 'success')
     return redirect(url_for('devices.my_devices'))
 
 
-# --- Default ESP32 config (matches dash_config_t defaults) ---
-DEFAULT_ESP_CONFIG = {
-    "speed_unit": 0,
-    "speed_number_color": {"r": 255, "g": 255, "b": 255},
-    "speed_unit_color": {"r": 150, "g": 150, "b": 150},
-    "speed_grid_color": {"r": 0, "g": 60, "b": 140},
-    "speed_car_color": {"r": 255, "g": 255, "b": 255},
-    "speed_shadow_color": {"r": 120, "g": 120, "b": 120},
-    "tilt_angle_color": {"r": 255, "g": 80, "b": 80},
-    "tilt_unit_color": {"r": 130, "g": 130, "b": 130},
-    "tilt_warning_deg": 25,
-    "danger_color": {"r": 200, "g": 0, "b": 0},
-    "tilt_speed": 1.0,
-    "data_circle_color": {"r": 0, "g": 212, "b": 255},
-    "data_circle_dim_color": {"r": 0, "g": 100, "b": 120},
-    "data_circle_inner_color": {"r": 0, "g": 60, "b": 140},
-    "data_bar_color": {"r": 0, "g": 212, "b": 255},
-    "data_center_color": {"r": 0, "g": 212, "b": 255},
-    "volt_gauge_color": {"r": 255, "g": 149, "b": 0},
-    "volt_warning_color": {"r": 255, "g": 0, "b": 0},
-    "volt_warning_low": 11.7,
-    "volt_warning_high": 13.5,
-    "volt_sim_enabled": True,
-    "volt_sim_value": 12.8,
-    "rpm_sim_enabled": True,
-    "rpm_sim_value": 3500.0,
-    "imu_filter_tau": 0.35,
-    "speed_sim_enabled": True,
-    "speed_sim_max": 200,
-    "speed_sim_accel": 40,
-    "speed_sim_decel": 50,
-    "language": 0,
-    "brightness": 80,
-    "welcome_word": "utilisateurs",
-    "wifi_ssid": "GaugeCluster",
-    "wifi_password": "12345678",
-    "wifi_channel": 1
-}
+@devices_bp.route('/devices/<int:device_id>/telemetry')
+@login_required
+def device_telemetry(device_id):
+    """Per-minute min/max/avg of one metric, from the precomputed rollups."""
+    device = Device.query.get_or_404(device_id)
+    if device.user_id != current_user.id and not current_user.is_moderator():
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    metric = request.args.get('metric', 'volt')
+    if metric not in METRICS:
+        return jsonify({'error': f'metric must be one of {", ".join(METRICS)}'}), 400
+    minutes = min(request.args.get('minutes', 60, type=int), 7 * 24 * 60)
+
+    end = datetime.utcnow() + timedelta(minutes=1)  # include the current, partial minute
+    rollups = telemetry.minute_rollups(metric, end - timedelta(minutes=minutes), end, [device.id])
+    return jsonify({
+        'device_id': device.id,
+        'metric': metric,
+        'minutes': [{'t': r.minute.isoformat(), 'count': r.count, 'min': r.min, 'max': r.max, 'avg': r.avg}
+                    for r in rollups],
+    }), 200
+
+
+@devices_bp.route('/devices/bulk', methods=['POST'])
+@login_required
+def bulk_update():
+    """Apply a config patch, config profile, gauge assignment or tag to many devices in one transaction.
+
+    Devices are selected by `device_ids` or by `filter` (country, fw, status,
+    q, tag). Owners can only reach their own devices; moderators the whole fleet.
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
+        return jsonify({'error': 'Invalid JSON'}), 400
+
+    action = data.get('action')
+    if action not in BULK_ACTIONS:
+        return jsonify({'error': f'action must be one of {", ".join(BULK_ACTIONS)}'}), 400
+
+    if action == 'config':
+        value = data.get('config')
+        if not isinstance(value, dict) or not value:
+            return jsonify({'error': 'config must be a non-empty object'}), 400
+    elif action == 'assign_gauge':
+        value = data.get('post_id')
+        if value is not None and (not isinstance(value, int) or not db.session.get(Post, value)):
+            return jsonify({'error': 'Gauge face not found'}), 404
+    elif action == 'profile':
+        name = data.get('profile')
+        if not isinstance(name, str):
+            return jsonify({'error': 'profile must be a string'}), 400
+        profile = config_profiles.profile_by_name(name)
+        if name != 'default' and not profile:
+            return jsonify({'error': 'Config profile not found'}), 404
+        value = None if name == 'default' else profile.id
+    else:
+        value = data.get('tag')
+        if value not in ALLOWED_TAGS:
+            return jsonify({'error': 'Invalid tag'}), 400
+
+    requested = None
+    if 'device_ids' in data:
+        requested = data['device_ids']
+        if not isinstance(requested, list) or not all(isinstance(i, int) for i in requested):
+            return jsonify({'error': 'device_ids must be a list of integers'}), 400
+        query = Device.query.filter(Device.id.in_(requested))
+    elif isinstance(data.get('filter'), dict):
+        f = data['filter']
+        if any(f.get(field) is not None and not isinstance(f[field], str) for field in BULK_FILTERS):
+            return jsonify({'error': 'filter values must be strings'}), 400
+        query = Device.filtered(*(f.get(field) for field in BULK_FILTERS))
+    else:
+        return jsonify({'error': 'device_ids or filter is required'}), 400
+
+    if not current_user.is_moderator():
+        query = query.filter(Device.user_id == current_user.id)
+
+    matched = [device_id for (device_id,) in query.with_entities(Device.id).order_by(Device.id)]
+    updated = bulk_update_devices(matched, action, value)
+    db.session.commit()
+    if action != 'tag':
+        device_changes.notify(matched)
+
+    results = [{'device_id': device_id, 'status': 'updated'} for device_id in matched]
+    if requested is not None:
+        found = set(matched)
+        results += [{'device_id': device_id, 'status': 'not_found'}
+                    for device_id in dict.fromkeys(requested) if device_id not in found]
+
+    return jsonify({'status': 'ok', 'action': action, 'updated': updated, 'results': results}), 200
 
 
 @devices_bp.route('/devices/<int:device_id>/configure')
@@ -252,15 +304,10 @@ def configure_device(device_id):
         flash('You do not own this device.', 'danger')
         return redirect(url_for('devices.my_devices'))
 
-    if device.config_json:
-        try:
-            config = json.loads(device.config_json)
-        except (json.JSONDecodeError, TypeError):
-            config = DEFAULT_ESP_CONFIG.copy()
-    else:
-        config = DEFAULT_ESP_CONFIG.copy()
+    config = config_profiles.effective(device)
+    defaults = config_profiles.profile(device.profile_id).config
 
-    return render_template('device_configure.html', device=device, config=config, defaults=DEFAULT_ESP_CONFIG)
+    return render_template('device_configure.html', device=device, config=config, defaults=defaults)
 
 
 @devices_bp.route('/devices/<int:device_id>/configure/save', methods=['POST'])
@@ -274,10 +321,15 @@ def save_device_config(device_id):
     if not data:
         return jsonify({'error': 'Invalid JSON'}), 400
 
-    device.config_json = json.dumps(data)
+    # Keys the form doesn't send (vehicle info, ...) are kept; only the diff
+    # against the device's profile is stored
+    config = {**config_profiles.effective(device), **data}
+    overrides = diff_patch(config_profiles.profile(device.profile_id).config, config)
+    device.config_json = json.dumps(overrides) if overrides else None
     db.session.commit()
+    device_changes.notify([device.id])
 
-    return jsonify({'status': 'ok', 'config': data}), 200
+    return jsonify({'status': 'ok', 'config': config}), 200
 
 
 @devices_bp.route('/devices/<int:device_id>/configure/reset', methods=['POST'])
@@ -287,7 +339,8 @@ def reset_device_config(device_id):
     if device.user_id != current_user.id:
         return jsonify({'error': 'Unauthorized'}), 403
 
-    device.config_json = json.dumps(DEFAULT_ESP_CONFIG)
+    device.config_json = None
     db.session.commit()
+    device_changes.notify([device.id])
 
-    return jsonify({'status': 'ok', 'config': DEFAULT_ESP_CONFIG}), 200
+    return jsonify({'status': 'ok', 'config': config_profiles.profile(device.profile_id).config}), 200
@@ -1,32 +1,40 @@
 from flask import Blueprint, request, render_template
-from models import User, Post
+from flask_login import current_user
+from models import db, User, Post
+from services import keyset_paginate, SortKey
 
 users_bp = Blueprint('users', __name__)
 
+PROFILE_POSTS_PER_PAGE = 8
+
 # User Profile page route
 @users_bp.route("/user/<int:user_id>")
 def user(user_id):
-    page = request.args.get('page', 1, type=int)
-
     # Fetch the user
     user = User.query.get(int(user_id))
 
     if user:
-        # Fetch only the first 4 posts by the user
-        user_posts = Post.query.filter_by(posted_by=user_id).order_by(Post.posted_at.desc()).limit(4).all()
-
-        # Total number of posts (for display)
-        post_count = Post.query.filter_by(posted_by=user_id).count()
+        # One page of the user's posts, newest first (cursor pagination on posted_by, posted_at, id)
+        page = keyset_paginate(
+            Post.query.filter_by(posted_by=user_id),
+            [SortKey(Post.posted_at, nullable=True), SortKey(Post.id)],
+            request.args.get('cursor'),
+            PROFILE_POSTS_PER_PAGE
+        )
+        Post.preload_listing(page.items, current_user)
 
-        # Calculate total likes for those posts
-        total_likes = sum(len(post.likes) for post in user_posts)
+        # Post count and likes across all of the user's posts, in one aggregate over the counters
+        post_count, total_likes = db.session.query(
+            db.func.count(Post.id), db.func.coalesce(db.func.sum(Post.like_count), 0)
+        ).filter(Post.posted_by == user_id).one()
 
         return render_template(
             'user.html',
-            user_posts=user_posts,
+            user_posts=page.items,
+            next_cursor=page.next_cursor,
             user=user,
             total_likes=total_likes,
             post_count=post_count
         )
     else:
-        return "User not found!", 404
\ No newline at end of file
+        return "User not found!", 404
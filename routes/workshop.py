@@ -1,21 +1,34 @@
-from flask import Blueprint, request, render_template, redirect, url_for, jsonify, flash, current_app
+from flask import Blueprint, request, render_template, redirect, url_for, jsonify, flash, current_app, \
+    get_template_attribute
 from flask_login import login_required, current_user
-from models import db, Post, User, PostComment, PostFeature
+from sqlalchemy.orm import joinedload
+from models import db, Post, User, PostComment, PostFeature, post_search
+from services import keyset_paginate, SortKey, KeysetPage
 
 workshop_bp = Blueprint('workshop', __name__)
 
 POSTS_PER_PAGE = 12
+COMMENTS_PER_PAGE = 20
 
-# Workshop route
-@workshop_bp.route("/workshop/")
-def workshop():
+# Keyset orderings, each backed by a (column, id) index on posts
+SORT_KEYS = {
+    'most_downloaded': [SortKey(Post.downloads), SortKey(Post.id)],
+    'top': [SortKey(Post.like_count), SortKey(Post.id)],
+    'trending': [SortKey(Post.trending_score, nullable=True), SortKey(Post.id)],
+    'recent': [SortKey(Post.posted_at, nullable=True), SortKey(Post.id)],
+}
+
+COMMENT_KEYS = [SortKey(PostComment.created_at, nullable=True), SortKey(PostComment.id)]
+
+
+def _workshop_page():
+    """One page of the workshop grid for the request's filters, sort and cursor."""
     # Get the sort option from the query parameters (default is 'recent')
     sort_option = request.args.get('sort', 'recent')
     gauge_type_option = request.args.get('type', 'all')
     featured = request.args.get('featured', 'false') == 'true'
     user_id = request.args.get('user', type=int)
-
-    page = request.args.get('page', 1, type=int)
+    search = request.args.get('q', '').strip()
 
     query = Post.query
 
@@ -28,45 +41,67 @@ def workshop():
 
     # Apply 'featured' filter
     if featured:
-        query = query.filter(Post.features.any())
+        query = query.filter(Post.feature_count > 0)
 
     if user_id is not None:
         query = query.filter(Post.posted_by == user_id)
 
+    # SEARCH: full-text (FTS5) ranked by bm25 blended with trending, within the filters above.
+    # Results come from a bounded candidate set, so the cursor is a plain offset into it.
+    if search:
+        offset = max(request.args.get('cursor', 0, type=int), 0)
+        posts = post_search.search(search, query, POSTS_PER_PAGE + 1, offset)
+        page = KeysetPage(posts[:POSTS_PER_PAGE],
+                          str(offset + POSTS_PER_PAGE) if len(posts) > POSTS_PER_PAGE else None)
+        Post.preload_listing(page.items, current_user)
+        return page, 'relevance'
+
     # SORTING
 
-    # Sort by most downloaded: order by number of downloads in descending order
-    if sort_option == 'most_downloaded':
-        query = query.order_by(Post.downloads.desc())
+    # most_downloaded: downloads; top: likes; trending: engagement decayed by age,
+    # precomputed (models/trending.py); default 'recent': posted_at. All newest-id first on ties.
+    if sort_option not in SORT_KEYS:
+        sort_option = 'recent'
 
-    # Sort by top: order by number of likes in descending order
-    elif sort_option == 'top':
-        query = query.outerjoin(Post.likes).group_by(Post.id).order_by(db.func.count(Post.likes).desc())
+    # Cursor pagination: each page seeks past the last post of the previous one
+    page = keyset_paginate(query, SORT_KEYS[sort_option], request.args.get('cursor'), POSTS_PER_PAGE)
+
+    # Authors, like/feature counts and the viewer's like/favorite state, batched
+    Post.preload_listing(page.items, current_user)
+    return page, sort_option
 
-    elif sort_option == 'trending':
-        query = query.outerjoin(Post.likes).group_by(Post.id).order_by(
-            db.func.count(Post.likes).desc(),
-            Post.posted_at.desc()
-        )
 
-    # Sort by new: order by posted_at in descending order
-    else:  # Default to 'new'
-        query = query.order_by(Post.posted_at.desc())
+# Workshop route
+@workshop_bp.route("/workshop/")
+def workshop():
+    page, sort_option = _workshop_page()
+    filter_args = {k: request.args.get(k) for k in ('type', 'featured', 'user', 'q') if request.args.get(k)}
+    return render_template('workshop.html', posts=page.items, next_cursor=page.next_cursor,
+                           sort_option=sort_option, filter_args=filter_args)
 
-    pagination = query.paginate(page=page, per_page=POSTS_PER_PAGE, error_out=False)
-    posts = pagination.items
 
-    # For each post, add the like count
-    for post in posts:
-        user = User.query.get(int(post.posted_by))
-        post.user_username = user.username
-        post.liked = False
-        post.favorited = False
-        if current_user.is_authenticated:
-            post.liked = current_user.liked_post(post)
-            post.favorited = current_user.favorited_post(post)
-    
-    return render_template('workshop.html', posts=posts, pagination=pagination, sort_option=sort_option)
+# Infinite scroll: the next page of the grid, as post summaries plus the rendered cards
+@workshop_bp.route("/workshop/feed")
+def workshop_feed():
+    page, sort_option = _workshop_page()
+    render_post = get_template_attribute('macros/post_card.html', 'render_post')
+    return jsonify({
+        'posts': [{
+            'id': post.id,
+            'title': post.title,
+            'username': post.user_username,
+            'gauge_type': post.gauge_type,
+            'posted_at': post.posted_at.isoformat() if post.posted_at else None,
+            'likes': post.like_count,
+            'favorites': post.favorite_count,
+            'downloads': post.downloads,
+            'featured': post.is_featured(),
+            'liked': post.liked,
+            'favorited': post.favorited,
+        } for post in page.items],
+        'html': ''.join(str(render_post(post, show_user=True, show_feature_star=True)) for post in page.items),
+        'next_cursor': page.next_cursor,
+    })
 
 # Workshop post upload route
 @workshop_bp.route("/workshop/upload", methods=['GET', 'POST'])
@@ -115,21 +150,24 @@ def view_post(post_id):
     user = User.query.get(post.posted_by)
 
     if post:
-        # Fetch the likes
-        likes = len(post.likes)
-
-        # Fetch the favorites
-        favorites = len(post.favorites)
-
-        # Fetch the comments
-        comments = PostComment.query.filter_by(post_id=post_id).order_by(PostComment.created_at.desc()).all()
+        # Counts are stored on the post
+        likes = post.like_count
+        favorites = post.favorite_count
+
+        # Fetch one page of comments (newest first) with their authors
+        comments = keyset_paginate(
+            PostComment.query.filter_by(post_id=post_id).options(joinedload(PostComment.user)),
+            COMMENT_KEYS,
+            request.args.get('comments_cursor'),
+            COMMENTS_PER_PAGE
+        )
 
         # Check if current_user has liked or favorited this post
         liked = False
         favorited = False
 
         if current_user.is_authenticated:
-            liked = any(like.user_id == current_user.id for like in post.likes)
+            liked = current_user.liked_post(post)
             favorited = current_user.favorited_post(post)
 
         return render_template(
@@ -138,7 +176,8 @@ def view_post(post_id):
             posted_by_username=user.username,
             likes=likes,
             favorites=favorites,
-            comments=comments,
+            comments=comments.items,
+            comments_next_cursor=comments.next_cursor,
             has_liked=liked,
             has_favorited=favorited
         )
@@ -153,12 +192,12 @@ def download_gauge(post_id):
     post = Post.query.get(post_id)
 
     if post:
-        post.downloads += 1  # Increment the download count
+        Post.increment(post.id, downloads=1)  # Increment the download count (and trending score)
         db.session.commit()
 
         # Set up the file response to download the JSON data
         response = current_app.response_class(
-            response=post.gauge,  # The raw JSON data
+            response=post.data,  # The raw JSON data
             status=200,
             mimetype='application/json',
             headers={
@@ -180,8 +219,8 @@ def toggle_like_post(post_id):
     # Use the `toggle_like_post` method from the User model to toggle the like
     liked = current_user.toggle_like_post(post)
 
-    # Fetch the updated like count using SQLAlchemy
-    total_likes = len(post.likes)
+    # Updated like count (the post was refreshed by the commit)
+    total_likes = post.like_count
     
     return jsonify({
         'total_likes': total_likes,
@@ -198,8 +237,8 @@ def toggle_favorite_post(post_id):
     # Use the `toggle_like_post` method from the User model to toggle the like
     favorited = current_user.toggle_favorite_post(post)
 
-    # Fetch the updated like count using SQLAlchemy
-    total_favorites = len(post.favorites)
+    # Updated favorite count (the post was refreshed by the commit)
+    total_favorites = post.favorite_count
     
     return jsonify({
         'total_favorites': total_favorites,
@@ -225,12 +264,14 @@ def toggle_feature_post(post_id):
         print("Post is already featured")
         # If already featured, unfeature it
         db.session.delete(existing_feature)
+        Post.increment(post_id, feature_count=-1)
 
     else:
         print("Post is not featured")
         # If not featured, feature it
         new_feature = PostFeature(post_id=post_id, moderator_id=current_user.id)
         db.session.add(new_feature)
+        Post.increment(post_id, feature_count=1)
         featured = True
     
     db.session.commit()
@@ -250,6 +291,7 @@ def comment_on_gauge(post_id):
     # Insert the comment into the database using SQLAlchemy
     new_comment = PostComment(post_id=post_id, user_id=user_id, content=content)
     db.session.add(new_comment)
+    Post.increment(post_id, comment_count=1)
     db.session.commit()
     
     return redirect(url_for('workshop.view_post', post_id=post_id))
\ No newline at end of file
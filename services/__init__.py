@@ -0,0 +1,18 @@
+from .generation import SharedGeneration
+from .lru import LRUCache
+from .token_cache import token_cache, CachedToken
+from . import fleet_stats
+from .presence import presence
+from .config_profiles import config_profiles, parse_overrides
+from .fleet_ops import bulk_update_devices, BULK_ACTIONS
+from .payload_cache import gauge_payload_cache, payload_version
+from .firmware_delta import build_deltas, build_lock, start_build, delete_deltas
+from .rollout import active_rollout, offer_update, report_result, delete_rollouts
+from .firmware_registry import firmware_registry, parse_version
+from .debug_capture import debug_capture
+from .change_feed import device_changes, can_block
+from . import device_encoding
+from .telemetry import telemetry, TelemetryBufferFull, METRICS
+from .fleet_analytics import fleet_analytics
+from . import device_map
+from .pagination import keyset_paginate, KeysetPage, SortKey
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_ALL = '*'
+
+
+def can_block(environ):
+    """True when an idle request doesn't pin a whole worker (threads or gevent)."""
+    if environ.get('wsgi.multithread'):
+        return True
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+class DeviceChangeFeed:
+    """Wakes long-polling devices when their config, gauge or firmware may have changed.
+
+    Writers call `notify(device_ids)` or `notify_all()` after committing.
+    Each call appends a line per device to a log in SHARED_STATE_DIR, so
+    every worker hears about it; one watcher thread per process tails the
+    log and sets the events of the waiters registered for those devices.
+    Waiters re-check the database when woken, so a spurious wake-up costs a
+    query and a lost one costs at most the wait timeout.
+
+    Under gevent workers the watcher and the events are gevent's (threading
+    is patched), which is what waiting greenlets need: a native thread
+    could not set their events safely. The watcher only stats and reads a
+    small file, so it never holds the hub for long.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.poll_interval = 0.5
+        self.max_log_bytes = 1024 * 1024
+        self._waiters = {}  # device_id -> set of threading.Event
+        self._lock = threading.Lock()
+        self._watcher_pid = None
+        self._position = None  # (inode, offset) read so far
+
+    def init_app(self, app):
+        os.makedirs(app.config['SHARED_STATE_DIR'], exist_ok=True)
+        self.path = os.path.join(app.config['SHARED_STATE_DIR'], 'device_changes.log')
+        self.poll_interval = app.config['DEVICE_WAIT_POLL_INTERVAL']
+
+    def notify(self, device_ids):
+        device_ids = list(device_ids)
+        if device_ids:
+            self._append([str(device_id) for device_id in device_ids])
+
+    def notify_all(self):
+        self._append([_ALL])
+
+    @contextmanager
+    def listen(self, device_id):
+        """Register for changes to `device_id` for the duration of the block; yields the Event.
+
+        Register before reading the current state, so a change committed in
+        between still sets the event.
+        """
+        self._ensure_watcher()
+        event = threading.Event()
+        with self._lock:
+            self._waiters.setdefault(device_id, set()).add(event)
+        try:
+            yield event
+        finally:
+            with self._lock:
+                events = self._waiters.get(device_id)
+                events.discard(event)
+                if not events:
+                    del self._waiters[device_id]
+
+    def _append(self, keys):
+        data = ''.join(f'{key}\n' for key in keys).encode('ascii')
+        try:
+            if os.path.getsize(self.path) > self.max_log_bytes:
+                tmp = f'{self.path}.{os.getpid()}.tmp'
+                open(tmp, 'wb').close()
+                os.replace(tmp, self.path)
+        except OSError:
+            pass
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        self._wake(keys)  # local waiters need not wait for the watcher
+
+    def _wake(self, keys):
+        with self._lock:
+            if _ALL in keys:
+                events = [e for waiting in self._waiters.values() for e in waiting]
+            else:
+                events = [e for key in set(keys) for e in self._waiters.get(int(key), ())]
+        for event in events:
+            event.set()
+
+    def _ensure_watcher(self):
+        if self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+            self._position = None
+            threading.Thread(target=self._watch, name='device-change-feed', daemon=True).start()
+
+    def _watch(self):
+        while True:
+            try:
+                self._poll()
+            except (OSError, ValueError):
+                pass
+            time.sleep(self.poll_interval)
+
+    def _poll(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._position = (None, 0)  # whatever creates it is news: read it from the start
+            return
+        inode, offset = self._position or (stat.st_ino, stat.st_size)
+        if inode is None:
+            inode = stat.st_ino
+        if inode != stat.st_ino or stat.st_size < offset:
+            # Log was rotated: whatever was appended before the switch is lost, so wake everyone
+            self._position = (stat.st_ino, 0)
+            self._wake([_ALL])
+            return self._poll()
+        if stat.st_size == offset:
+            self._position = (inode, offset)
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(stat.st_size - offset)
+        complete = data.rfind(b'\n') + 1  # leave a partially written line for the next pass
+        self._position = (inode, offset + complete)
+        if self._waiters and complete:
+            self._wake(data[:complete].decode('ascii').split())
+
+
+device_changes = DeviceChangeFeed()
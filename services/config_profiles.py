@@ -0,0 +1,111 @@
+import json
+import threading
+from collections import namedtuple
+
+from models import ConfigProfile, DEFAULT_ESP_CONFIG, merge_patch
+from .generation import SharedGeneration
+from .lru import LRUCache
+
+ResolvedProfile = namedtuple('ResolvedProfile', ['id', 'name', 'version', 'config'])
+
+BUILTIN_DEFAULT = ResolvedProfile(None, 'default', 0, DEFAULT_ESP_CONFIG)
+
+
+def parse_overrides(text):
+    """Device overrides as a dict ({} when missing or unreadable)."""
+    if not text:
+        return {}
+    try:
+        overrides = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+    return overrides if isinstance(overrides, dict) else {}
+
+
+class ConfigProfileRegistry:
+    """Config profiles held in process, plus resolved per-device configs.
+
+    A device's effective config is its profile with the device overrides
+    merged on top. Results are cached by (profile id, profile version,
+    override hash), so devices sharing a profile and the same overrides share
+    one entry and a cache hit never loads or parses Device.config_json.
+    Profile edits call `invalidate()`, which bumps a shared generation so
+    every worker reloads the (small) profile table.
+    """
+
+    def __init__(self):
+        self._generation = SharedGeneration('config_profiles')
+        self._seen_generation = None
+        self._profiles = None  # {id: ResolvedProfile}, plus the default under None
+        self._lock = threading.Lock()
+        self._effective = LRUCache(max_entries=4096)
+        self._encoded = LRUCache(max_entries=4096)
+
+    def init_app(self, app):
+        self._generation.init_app(app)
+        self._effective.configure(max_entries=app.config['EFFECTIVE_CONFIG_CACHE_SIZE'])
+        self._encoded.configure(max_entries=app.config['EFFECTIVE_CONFIG_CACHE_SIZE'])
+
+    def profile(self, profile_id=None):
+        """ResolvedProfile for `profile_id`, or the default profile."""
+        profiles = self._snapshot()
+        return profiles.get(profile_id) or profiles[None]
+
+    def profile_by_name(self, name):
+        return next((p for p in self._snapshot().values() if p.name == name), None)
+
+    def etag(self, device):
+        """Changes whenever the device's effective config can have changed."""
+        profile = self.profile(device.profile_id)
+        return f'{profile.id or 0}.{profile.version}.{device.config_hash or 0}'
+
+    def effective(self, device):
+        """Resolved config dict for `device`. Shared between callers: do not mutate."""
+        profile = self.profile(device.profile_id)
+        key = (profile.id, profile.version, device.config_hash)
+        config = self._effective.get(key)
+        if config is None:
+            config = merge_patch(profile.config, parse_overrides(device.config_json))
+            self._effective.set(key, config)
+        return config
+
+    def encoded(self, device, mimetype, encode):
+        """Response body for the effective config in `mimetype`, cached with the resolved config.
+
+        `encode(config)` -> bytes is only called on a miss.
+        """
+        profile = self.profile(device.profile_id)
+        key = (profile.id, profile.version, device.config_hash, mimetype)
+        body = self._encoded.get(key)
+        if body is None:
+            body = encode(self.effective(device))
+            self._encoded.set(key, body)
+        return body
+
+    def refresh(self):
+        """Check for changes from other workers now rather than within the next few seconds."""
+        self._generation.expire()
+
+    def invalidate(self):
+        with self._lock:
+            self._profiles = None
+        self._generation.bump()
+
+    def _snapshot(self):
+        generation = self._generation.current()
+        with self._lock:
+            if self._profiles is not None and generation == self._seen_generation:
+                return self._profiles
+
+        profiles = {}
+        for row in ConfigProfile.query.all():
+            profiles[row.id] = ResolvedProfile(row.id, row.name, row.version, json.loads(row.config_json))
+        profiles[None] = next((p for p in profiles.values() if p.name == 'default'), BUILTIN_DEFAULT)
+
+        with self._lock:
+            self._profiles = profiles
+            self._seen_generation = generation
+        return profiles
+
+
+config_profiles = ConfigProfileRegistry()
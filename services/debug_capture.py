@@ -0,0 +1,131 @@
+import fcntl
+import json
+import mmap
+import os
+import random
+import struct
+import threading
+import zlib
+
+_MAGIC = b'MGDBGRB1'
+_HEADER = struct.Struct('<8sQ')     # magic, write counter
+_SLOT_HEADER = struct.Struct('<QII')  # sequence (0 while writing), payload length, crc32
+_SLOT_SIZE = 4096
+_PAYLOAD_MAX = _SLOT_SIZE - _SLOT_HEADER.size
+
+
+class DebugCapture:
+    """Sampled capture of /api/v1 requests in a memory-mapped ring buffer.
+
+    Every gunicorn worker maps the same file, so /api/v1/debug shows traffic
+    from all of them. Writers claim a slot by bumping the header counter
+    under an flock; the slot itself is written without a lock, marked with
+    sequence 0 meanwhile and carrying a CRC32. Readers take no lock and skip
+    any slot that is torn or changes while they read it.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.slots = 256
+        self.path = None
+        self._map = None
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()  # flock doesn't exclude threads sharing the fd
+
+    def init_app(self, app):
+        self.enabled = app.config['API_DEBUG_CAPTURE']
+        self.sample_rate = app.config['API_DEBUG_SAMPLE_RATE']
+        self.slots = app.config['API_DEBUG_SLOTS']
+        os.makedirs(app.config['SHARED_STATE_DIR'], exist_ok=True)
+        self.path = os.path.join(app.config['SHARED_STATE_DIR'], 'api_debug.ring')
+
+    def should_sample(self):
+        return self.enabled and (self.sample_rate >= 1.0 or random.random() < self.sample_rate)
+
+    def record(self, entry):
+        """Store `entry` (a JSON-able dict); its 'body' is shortened to fit a slot."""
+        payload = _fit(entry)
+        if payload is None:
+            return
+        buf = self._buffer()
+
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                _, counter = _HEADER.unpack_from(buf, 0)
+                seq = counter + 1
+                _HEADER.pack_into(buf, 0, _MAGIC, seq)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        offset = _HEADER.size + (seq % self.slots) * _SLOT_SIZE
+        _SLOT_HEADER.pack_into(buf, offset, 0, 0, 0)
+        start = offset + _SLOT_HEADER.size
+        buf[start:start + len(payload)] = payload
+        _SLOT_HEADER.pack_into(buf, offset, seq, len(payload), zlib.crc32(payload))
+
+    def recent(self, limit=50):
+        """Most recent captured entries, newest first."""
+        if not os.path.exists(self.path):
+            return []
+        buf = self._buffer()
+
+        entries = []
+        for slot in range(self.slots):
+            offset = _HEADER.size + slot * _SLOT_SIZE
+            seq, length, crc = _SLOT_HEADER.unpack_from(buf, offset)
+            if not seq or length > _PAYLOAD_MAX:
+                continue
+            start = offset + _SLOT_HEADER.size
+            payload = bytes(buf[start:start + length])
+            if zlib.crc32(payload) != crc or _SLOT_HEADER.unpack_from(buf, offset)[0] != seq:
+                continue
+            try:
+                entries.append((seq, json.loads(payload)))
+            except ValueError:
+                continue
+
+        entries.sort(key=lambda e: e[0], reverse=True)
+        return [entry for _, entry in entries[:limit]]
+
+    def _buffer(self):
+        if self._map is None or self._pid != os.getpid():
+            size = _HEADER.size + self.slots * _SLOT_SIZE
+            # Kept open after mapping: its flock serialises slot claims (and a forked worker opens its own)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size != size:
+                    os.ftruncate(fd, size)
+                self._map = mmap.mmap(fd, size)
+                if self._map[:len(_MAGIC)] != _MAGIC:
+                    _HEADER.pack_into(self._map, 0, _MAGIC, 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._fd = fd
+            self._pid = os.getpid()
+        return self._map
+
+
+def _fit(entry):
+    """`entry` as JSON bytes no longer than a slot, cutting its body; None if even an empty body is too long."""
+    payload = json.dumps(entry).encode('utf-8')
+    if len(payload) <= _PAYLOAD_MAX:
+        return payload
+
+    # Longest body prefix that fits (escaping makes the encoded length non-linear, so bisect)
+    body = entry.get('body') or ''
+    low, high, best = 0, len(body), None
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = json.dumps(dict(entry, body=body[:middle] + '...')).encode('utf-8')
+        if len(candidate) <= _PAYLOAD_MAX:
+            low, best = middle + 1, candidate
+        else:
+            high = middle - 1
+    return best
+
+
+debug_capture = DebugCapture()
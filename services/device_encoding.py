@@ -0,0 +1,68 @@
+import json
+import re
+
+import cbor2
+from flask import current_app
+
+from models import DEFAULT_ESP_CONFIG
+
+JSON = 'application/json'
+CBOR = 'application/cbor'
+DEVICE_FORMATS = (JSON, CBOR)  # JSON first: it wins for Accept: */* and missing headers
+
+_HEX_COLOUR = re.compile(r'^#[0-9a-fA-F]{6}$')
+_RGB_KEYS = {'r', 'g', 'b'}
+# Where colours live: {"r", "g", "b"} under these config keys, "#rrggbb" under a
+# gauge face StaticColor's "color" (see static/js/core/colors/StaticColor.js)
+CONFIG_COLOUR_KEYS = frozenset(key for key in DEFAULT_ESP_CONFIG if key.endswith('_color'))
+
+
+def negotiate(accept_mimetypes):
+    """Response format for a device request, from its Accept header."""
+    return accept_mimetypes.best_match(DEVICE_FORMATS, default=JSON)
+
+
+def pack_colours(value):
+    """Binary schema: every colour becomes a 0xRRGGBB int.
+
+    Only known colour fields are packed: the config's CONFIG_COLOUR_KEYS
+    objects and the "#rrggbb" of gauge face StaticColors. A label or text
+    value that merely looks like a colour is left as is.
+    """
+    if isinstance(value, dict):
+        static_colour = value.get('type') == 'StaticColor'
+        packed = {}
+        for key, item in value.items():
+            if key in CONFIG_COLOUR_KEYS and _is_rgb(item):
+                packed[key] = (item['r'] << 16) | (item['g'] << 8) | item['b']
+            elif static_colour and key == 'color' and isinstance(item, str) and _HEX_COLOUR.match(item):
+                packed[key] = int(item[1:], 16)
+            else:
+                packed[key] = pack_colours(item)
+        return packed
+    if isinstance(value, list):
+        return [pack_colours(item) for item in value]
+    return value
+
+
+def _is_rgb(value):
+    return (isinstance(value, dict) and value.keys() == _RGB_KEYS
+            and all(isinstance(value[k], int) and 0 <= value[k] <= 255 for k in 'rgb'))
+
+
+def decode(body, mimetype):
+    """Request body sent by a device as JSON or CBOR; None if it can't be parsed."""
+    try:
+        if mimetype == CBOR:
+            return cbor2.loads(body)
+        return json.loads(body)
+    except (ValueError, cbor2.CBORDecodeError):
+        return None
+
+
+def encode(payload, mimetype):
+    """Response body bytes for `payload` in `mimetype`."""
+    if mimetype == CBOR:
+        # canonical: shortest lossless float widths, sorted keys
+        return cbor2.dumps(pack_colours(payload), canonical=True)
+    return current_app.json.dumps(payload).encode('utf-8')
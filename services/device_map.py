@@ -0,0 +1,41 @@
+from sqlalchemy import func
+
+from models import Device
+from models import geohash as geo
+
+CLUSTER_CELLS = 64  # roughly an 8x8 grid of markers over the visible box
+
+
+def clusters(south, west, north, east, query=None):
+    """Devices in the box aggregated by geohash cell, computed in SQL.
+
+    The cell size is the longest geohash precision that covers the box in
+    about CLUSTER_CELLS cells, so the marker count stays bounded whatever the
+    zoom level and fleet size. Each cluster is placed at its devices'
+    centroid; a cluster of one carries that device's id and name.
+    """
+    if west > east:
+        precision = min(geo.cover_precision(south, west, north, 180.0, CLUSTER_CELLS // 2),
+                        geo.cover_precision(south, -180.0, north, east, CLUSTER_CELLS // 2))
+    else:
+        precision = geo.cover_precision(south, west, north, east, CLUSTER_CELLS)
+
+    cell = func.substr(Device.geohash, 1, precision)
+    inside = Device.within(south, west, north, east, query=query).order_by(None)
+    rows = inside.with_entities(cell, func.count(), func.avg(Device.latitude), func.avg(Device.longitude),
+                                func.min(Device.id), func.min(Device.name)).group_by(cell).all()
+
+    result = []
+    for geohash, count, lat, lon, device_id, name in rows:
+        cluster = {'geohash': geohash, 'count': count, 'lat': round(lat, 6), 'lon': round(lon, 6)}
+        if count == 1:
+            cluster['device'] = {'id': device_id, 'name': name}
+        result.append(cluster)
+    return {'precision': precision, 'total': sum(c['count'] for c in result), 'clusters': result}
+
+
+def nearest(lat, lon, k=10, query=None):
+    """JSON-ready k-nearest devices for support lookups."""
+    return [{'id': device.id, 'name': device.name, 'hardware_id': device.hardware_id,
+             'lat': device.latitude, 'lon': device.longitude, 'distance_km': round(distance, 3)}
+            for device, distance in Device.nearest(lat, lon, k, query=query)]
@@ -0,0 +1,102 @@
+import fcntl
+import hashlib
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+
+import bsdiff4
+from flask import current_app
+
+from models import db, Device, Firmware, FirmwareDelta
+
+
+def delta_filename(source, target):
+    # Versions are free text typed by an admin; ids are safe to put on disk
+    return f'firmware_{source.id}_to_{target.id}.bsdiff'
+
+
+def build_deltas(target):
+    """Build bsdiff4 patches to `target` from every firmware still reported by the fleet.
+
+    CPU-bound (about a second per MB of image and source version), so it
+    runs from the `build-firmware-deltas` command, never in a request;
+    activating a firmware starts that command with `start_build()`.
+    Patches that already exist, whose source image is missing, or that would
+    not be smaller than the full image are skipped. Returns the new
+    FirmwareDelta rows (added to the session, not committed).
+    """
+    firmware_dir = current_app.config['FIRMWARE_UPLOAD_DIR']
+    target_path = os.path.join(firmware_dir, target.filename)
+    if not os.path.exists(target_path):
+        return []
+
+    fleet_versions = db.session.query(Device.firmware_version) \
+        .filter(Device.firmware_version.isnot(None), Device.firmware_version != target.version) \
+        .distinct()
+    existing = {d.from_firmware_id for d in FirmwareDelta.query.filter_by(to_firmware_id=target.id)}
+    sources = [fw for fw in Firmware.query.filter(Firmware.version.in_(fleet_versions)).all()
+               if fw.id not in existing]
+    if not sources:
+        return []
+
+    with open(target_path, 'rb') as f:
+        target_data = f.read()
+
+    created = []
+    for source in sources:
+        source_path = os.path.join(firmware_dir, source.filename)
+        if not os.path.exists(source_path):
+            continue
+        with open(source_path, 'rb') as f:
+            patch = bsdiff4.diff(f.read(), target_data)
+        if len(patch) >= len(target_data):
+            continue
+
+        filename = delta_filename(source, target)
+        with open(os.path.join(firmware_dir, filename), 'wb') as f:
+            f.write(patch)
+
+        delta = FirmwareDelta(
+            from_firmware_id=source.id,
+            to_firmware_id=target.id,
+            filename=filename,
+            file_size=len(patch),
+            checksum=hashlib.sha256(patch).hexdigest()
+        )
+        db.session.add(delta)
+        created.append(delta)
+
+    return created
+
+
+def start_build(app):
+    """Run `flask build-firmware-deltas` in a detached process and return at once.
+
+    A thread would be a greenlet under gevent workers, and bsdiff never
+    yields, so every request on the worker would wait for the build.
+    """
+    subprocess.Popen([sys.executable, '-m', 'flask', '--app', app.import_name, 'build-firmware-deltas'],
+                     cwd=app.root_path, stdin=subprocess.DEVNULL, start_new_session=True)
+
+
+@contextmanager
+def build_lock():
+    """Serialise builds, so back-to-back activations don't write the same patch twice."""
+    os.makedirs(current_app.config['SHARED_STATE_DIR'], exist_ok=True)
+    with open(os.path.join(current_app.config['SHARED_STATE_DIR'], 'firmware_deltas.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def delete_deltas(firmware):
+    """Remove every patch from or to `firmware`, files included (not committed)."""
+    firmware_dir = current_app.config['FIRMWARE_UPLOAD_DIR']
+    deltas = FirmwareDelta.query.filter(
+        (FirmwareDelta.from_firmware_id == firmware.id) | (FirmwareDelta.to_firmware_id == firmware.id)
+    ).all()
+    for delta in deltas:
+        path = os.path.join(firmware_dir, delta.filename)
+        if os.path.exists(path):
+            os.remove(path)
+        db.session.delete(delta)
@@ -0,0 +1,91 @@
+import threading
+from collections import namedtuple
+
+from models import db, Firmware, FirmwareDelta, FirmwareRollout
+from .generation import SharedGeneration
+
+ActiveRelease = namedtuple('ActiveRelease', [
+    'id', 'version', 'version_tuple', 'filename', 'file_size', 'checksum',
+    'rollout_id',  # gating FirmwareRollout id, None when offered to every device
+    'deltas',      # {from_version: DeltaImage}
+])
+DeltaImage = namedtuple('DeltaImage', ['filename', 'file_size', 'checksum'])
+
+
+def parse_version(v):
+    try:
+        return tuple(int(x) for x in v.split('.'))
+    except (ValueError, AttributeError):
+        return (0, 0, 0)
+
+
+class FirmwareRegistry:
+    """In-process snapshot of the active firmware release.
+
+    Holds what firmware_check, firmware_download and the devices page need
+    (parsed version, size, checksum, patches, gating rollout) so those paths
+    run no firmware queries. Admin changes call `invalidate()`, which bumps a
+    shared generation so every worker reloads.
+    """
+
+    def __init__(self):
+        self._generation = SharedGeneration('firmware')
+        self._seen_generation = None
+        self._state = None  # (ActiveRelease or None, latest uploaded version or None)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._generation.init_app(app)
+
+    def active(self):
+        """The active ActiveRelease, or None."""
+        return self._snapshot()[0]
+
+    def latest_version(self):
+        """Active version, falling back to the newest uploaded firmware."""
+        return self._snapshot()[1]
+
+    def refresh(self):
+        """Check for changes from other workers now rather than within the next few seconds."""
+        self._generation.expire()
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+        self._generation.bump()
+
+    def _snapshot(self):
+        generation = self._generation.current()
+        with self._lock:
+            if self._state is not None and generation == self._seen_generation:
+                return self._state
+
+        state = self._load()
+        with self._lock:
+            self._state = state
+            self._seen_generation = generation
+        return state
+
+    def _load(self):
+        fw = Firmware.query.filter_by(is_active=True).first()
+        if not fw:
+            newest = Firmware.query.order_by(Firmware.uploaded_at.desc()).first()
+            return None, newest.version if newest else None
+
+        deltas = {
+            version: DeltaImage(delta.filename, delta.file_size, delta.checksum)
+            for delta, version in db.session.query(FirmwareDelta, Firmware.version)
+            .join(Firmware, Firmware.id == FirmwareDelta.from_firmware_id)
+            .filter(FirmwareDelta.to_firmware_id == fw.id)
+        }
+        rollout_id = db.session.query(FirmwareRollout.id) \
+            .filter(FirmwareRollout.firmware_id == fw.id, FirmwareRollout.status != 'completed') \
+            .order_by(FirmwareRollout.id.desc()) \
+            .scalar()
+
+        release = ActiveRelease(fw.id, fw.version, parse_version(fw.version), fw.filename,
+                                fw.file_size, fw.checksum, rollout_id, deltas)
+        return release, fw.version
+
+
+firmware_registry = FirmwareRegistry()
@@ -0,0 +1,194 @@
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select
+
+from models import db, Device
+from .config_profiles import config_profiles
+from .lru import LRUCache
+from .telemetry import telemetry
+
+VOLT_BINS = np.round(np.arange(9.0, 16.01, 0.25), 2)  # histogram edges; outliers land in the end bins
+PERCENTILES = (5, 25, 50, 75, 95)
+
+_EPOCH = datetime(1970, 1, 1)
+_DEFAULT_COUNTRY = 'FR'  # what the device templates show for NULL, as in fleet_stats
+
+# Columns of one metric's minute rollups, one entry per (device, minute), ordered by device
+_Window = namedtuple('_Window', ['device', 'n', 'min', 'max', 'avg', 'sum'])
+
+
+def _load(metric, start, end):
+    cols = np.array(telemetry.rollup_rows(metric, start, end), dtype=np.float64).reshape(-1, 6)
+    n = cols[:, 2]
+    return _Window(cols[:, 0].astype(np.int64), n, cols[:, 3], cols[:, 4], cols[:, 5] / np.maximum(n, 1), cols[:, 5])
+
+
+def _threshold(config, key):
+    value = config.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return math.nan  # never crossed
+    return float(value)
+
+
+def _device_starts(window):
+    """Index of each device's first row (rows are ordered by device)."""
+    if not len(window.device):
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(np.r_[True, window.device[1:] != window.device[:-1]])
+
+
+def _split_by_group(values, groups, ngroups):
+    """`values` sorted within each group, as a list of ngroups arrays."""
+    order = np.lexsort((values, groups))
+    bounds = np.searchsorted(groups[order], np.arange(1, ngroups))
+    return np.split(values[order], bounds)
+
+
+def _percentiles(values):
+    if not len(values):
+        return None
+    return {f'p{p}': round(float(v), 3) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def _ratio(part, whole):
+    return round(float(part) / float(whole), 4) if whole else None
+
+
+class FleetAnalytics:
+    """Fleet-wide telemetry statistics, computed over NumPy arrays.
+
+    A window is the last `minutes` ending on a FLEET_ANALYTICS_BUCKET_MINUTES
+    boundary, so its result is final once computed and is cached by
+    (minutes, bucket end): dashboard refreshes within a bucket are free and
+    each worker computes a window at most once per bucket.
+
+    The per-minute rollups of a metric are fetched into columns in one query.
+    Each device then gets a country code and its own volt_warning_low /
+    tilt_warning_deg from its effective config; histograms, percentiles and
+    threshold counts are array operations grouped by country.
+    """
+
+    def __init__(self):
+        self.bucket_minutes = 5
+        self._cache = LRUCache(max_entries=64)
+
+    def init_app(self, app):
+        self.bucket_minutes = app.config['FLEET_ANALYTICS_BUCKET_MINUTES']
+
+    def summary(self, minutes=60, now=None):
+        """Per-country and fleet-wide volt/tilt statistics for the last `minutes`."""
+        step = timedelta(minutes=self.bucket_minutes)
+        end = _EPOCH + ((now or datetime.utcnow()) - _EPOCH) // step * step
+        key = (minutes, end)
+        result = self._cache.get(key)
+        if result is None:
+            result = self._compute(end - timedelta(minutes=minutes), end)
+            self._cache.set(key, result)
+        return result
+
+    def _compute(self, start, end):
+        volt = _load('volt', start, end)
+        tilt = _load('tilt', start, end)
+        device_ids = np.union1d(volt.device, tilt.device)
+        country, volt_low, tilt_deg = self._device_attributes(device_ids)
+        names, codes = np.unique(country, return_inverse=True)
+        codes = codes.astype(np.intp)
+
+        # No telemetry in the window (fresh install, quiet hour): no countries, and a fleet of zeros
+        by_country = self._summarize(volt, tilt, device_ids, codes, len(names), volt_low, tilt_deg) \
+            if len(device_ids) else []
+        fleet = self._summarize(volt, tilt, device_ids, np.zeros(len(device_ids), dtype=np.intp), 1,
+                                volt_low, tilt_deg)[0]
+        return {
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'volt_bins': VOLT_BINS.tolist(),
+            'fleet': fleet,
+            'countries': dict(zip(names.tolist(), by_country)),
+        }
+
+    def _device_attributes(self, device_ids):
+        """Country, volt_warning_low and tilt_warning_deg arrays aligned with the sorted `device_ids`."""
+        default = config_profiles.profile(None).config
+        country = np.full(len(device_ids), 'unknown', dtype=object)  # deleted since reporting
+        volt_low = np.full(len(device_ids), _threshold(default, 'volt_warning_low'))
+        tilt_deg = np.full(len(device_ids), _threshold(default, 'tilt_warning_deg'))
+
+        thresholds = {}  # devices sharing a profile and overrides share thresholds
+        ids = device_ids.tolist()
+        for chunk in range(0, len(ids), 500):
+            rows = db.session.execute(
+                select(Device.id, Device.country, Device.profile_id, Device.config_hash, Device.config_json)
+                .where(Device.id.in_(ids[chunk:chunk + 500])))
+            for row in rows:
+                key = (row.profile_id, row.config_hash)
+                if key not in thresholds:
+                    config = config_profiles.effective(row)
+                    thresholds[key] = (_threshold(config, 'volt_warning_low'), _threshold(config, 'tilt_warning_deg'))
+                i = np.searchsorted(device_ids, row.id)
+                country[i] = row.country or _DEFAULT_COUNTRY
+                volt_low[i], tilt_deg[i] = thresholds[key]
+        return country.astype(str), volt_low, tilt_deg
+
+    def _summarize(self, volt, tilt, device_ids, group, ngroups, volt_low, tilt_deg):
+        """One stats dict per group; `group` holds each device's group index."""
+        results = [{'devices': int(n)} for n in np.bincount(group, minlength=ngroups)]
+
+        # --- Voltage: distribution of per-minute averages, minutes and devices under volt_warning_low ---
+        row_device = np.searchsorted(device_ids, volt.device)
+        row_group = group[row_device]
+        samples = np.bincount(row_group, weights=volt.n, minlength=ngroups)
+        totals = np.bincount(row_group, weights=volt.sum, minlength=ngroups)
+        histograms = np.histogram2d(row_group, np.clip(volt.avg, VOLT_BINS[0], VOLT_BINS[-1]),
+                                    bins=[np.arange(ngroups + 1), VOLT_BINS])[0].astype(int)
+        minutes = np.bincount(row_group, minlength=ngroups)
+        minutes_low = np.bincount(row_group, weights=volt.min < volt_low[row_device], minlength=ngroups)
+
+        starts = _device_starts(volt)
+        reporting = row_device[starts]
+        low = np.minimum.reduceat(volt.min, starts) < volt_low[reporting] if len(starts) else np.empty(0, bool)
+        devices = np.bincount(group[reporting], minlength=ngroups)
+        devices_low = np.bincount(group[reporting], weights=low, minlength=ngroups)
+
+        for i, values in enumerate(_split_by_group(volt.avg, row_group, ngroups)):
+            results[i]['volt'] = {
+                'devices': int(devices[i]),
+                'samples': int(samples[i]),
+                'mean': round(float(totals[i] / samples[i]), 3) if samples[i] else None,
+                'percentiles': _percentiles(values),
+                'histogram': histograms[i].tolist(),
+                'devices_below_low': int(devices_low[i]),
+                'devices_below_low_ratio': _ratio(devices_low[i], devices[i]),
+                'minutes_below_low': int(minutes_low[i]),
+                'minutes_below_low_ratio': _ratio(minutes_low[i], minutes[i]),
+            }
+
+        # --- Tilt: peak angle either way against tilt_warning_deg ---
+        row_device = np.searchsorted(device_ids, tilt.device)
+        row_group = group[row_device]
+        peak = np.maximum(np.abs(tilt.min), np.abs(tilt.max))
+        minutes = np.bincount(row_group, minlength=ngroups)
+        minutes_over = np.bincount(row_group, weights=peak > tilt_deg[row_device], minlength=ngroups)
+
+        starts = _device_starts(tilt)
+        reporting = row_device[starts]
+        over = np.maximum.reduceat(peak, starts) > tilt_deg[reporting] if len(starts) else np.empty(0, bool)
+        devices = np.bincount(group[reporting], minlength=ngroups)
+        devices_over = np.bincount(group[reporting], weights=over, minlength=ngroups)
+
+        for i, values in enumerate(_split_by_group(peak, row_group, ngroups)):
+            results[i]['tilt'] = {
+                'devices': int(devices[i]),
+                'peak_percentiles': _percentiles(values),
+                'devices_over_warning': int(devices_over[i]),
+                'devices_over_warning_ratio': _ratio(devices_over[i], devices[i]),
+                'minutes_over_warning': int(minutes_over[i]),
+                'minutes_over_warning_ratio': _ratio(minutes_over[i], minutes[i]),
+            }
+        return results
+
+
+fleet_analytics = FleetAnalytics()
@@ -0,0 +1,45 @@
+import json
+
+from sqlalchemy import case, func, literal
+
+from models import db, Device
+from .fleet_stats import apply_changes, column_set_changes, lock_for_write
+
+BULK_ACTIONS = ('config', 'profile', 'assign_gauge', 'tag')
+
+
+def bulk_update_devices(device_ids, action, value):
+    """Apply one fleet action to every device in `device_ids` with a single UPDATE.
+
+    'config' merges `value` into each device's overrides with SQLite's
+    json_patch (RFC 7396: a null drops the override, so the profile value
+    applies again). Runs on the session's connection; the caller commits.
+    Returns the number of rows updated.
+    """
+    if not device_ids:
+        return 0
+
+    devices = Device.__table__
+    conn = db.session.connection()
+    stmt = devices.update().where(devices.c.id.in_(device_ids))
+
+    if action == 'config':
+        base = case((func.json_valid(devices.c.config_json), devices.c.config_json), else_=literal('{}'))
+        merged = func.nullif(func.json_patch(base, json.dumps(value)), '{}')
+        stmt = stmt.values(config_json=merged, config_hash=func.content_hash(merged))
+    elif action == 'profile':
+        stmt = stmt.values(profile_id=value)
+    elif action == 'assign_gauge':
+        stmt = stmt.values(assigned_post_id=value)
+    elif action == 'tag':
+        lock_for_write(conn)
+        apply_changes(conn, column_set_changes(conn, 'tag', value, device_ids))
+        stmt = stmt.values(tag=value)
+    elif action == 'firmware':
+        lock_for_write(conn)
+        apply_changes(conn, column_set_changes(conn, 'firmware_version', value, device_ids))
+        stmt = stmt.values(firmware_version=value)
+    else:
+        raise ValueError(f'Unknown bulk action: {action}')
+
+    return conn.execute(stmt).rowcount
@@ -0,0 +1,225 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, Device, FleetStat
+
+ONLINE_WINDOW_MINUTES = 10  # same window as Device.is_online(), to the minute
+SEEN_BUCKET_RETENTION = timedelta(hours=1)
+
+# Device column -> stats dimension
+TRACKED_COLUMNS = {
+    'firmware_version': 'firmware',
+    'country': 'country',
+    'module_type': 'module_type',
+    'tag': 'tag',
+}
+# Column defaults the templates show for NULLs, so counts line up with the device table
+_DISPLAY_DEFAULTS = {'country': 'FR', 'module_type': 'ESP32-S3'}
+
+
+def _minute(ts):
+    return ts.strftime('%Y-%m-%dT%H:%M') if ts else None
+
+
+def _value(dimension, raw):
+    return raw or _DISPLAY_DEFAULTS.get(dimension, '')
+
+
+def _key(column, raw):
+    """(dimension, value) counter a device column value contributes to, or None."""
+    if column == 'last_seen_at':
+        return ('seen_minute', _minute(raw)) if raw else None
+    dimension = TRACKED_COLUMNS[column]
+    return (dimension, _value(dimension, raw))
+
+
+def _device_keys(values):
+    keys = [('total', '')] + [_key(column, raw) for column, raw in values.items()]
+    return [key for key in keys if key]
+
+
+def lock_for_write(conn):
+    """Start `conn`'s transaction with BEGIN IMMEDIATE, before any counter delta is read.
+
+    pysqlite only begins on the first DML, so a delta computed from a SELECT
+    before it could read a row another worker is about to change, and both
+    would apply their deltas. Taking the write lock first serialises them.
+    No-op if the connection is already in a transaction.
+    """
+    if not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def apply_changes(conn, changes):
+    """Add a Counter of {(dimension, value): delta} to fleet_stats on `conn`.
+
+    Increments upsert; decrements only touch rows that exist, so a device
+    leaving a pruned seen_minute bucket is a no-op rather than a negative row.
+    """
+    table = FleetStat.__table__
+    increments = [{'dimension': d, 'value': v, 'device_count': n} for (d, v), n in changes.items() if n > 0]
+    decrements = [{'b_dimension': d, 'b_value': v, 'b_delta': -n} for (d, v), n in changes.items() if n < 0]
+
+    if increments:
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['dimension', 'value'],
+            set_={'device_count': table.c.device_count + stmt.excluded.device_count})
+        conn.execute(stmt, increments)
+    if decrements:
+        conn.execute(
+            table.update()
+            .where(table.c.dimension == bindparam('b_dimension'), table.c.value == bindparam('b_value'))
+            .values(device_count=table.c.device_count - bindparam('b_delta')),
+            decrements)
+
+
+def presence_changes(conn, updates):
+    """Counter deltas for a presence flush. `updates` maps device_id -> (last_seen_at, firmware or None).
+
+    Call after lock_for_write(conn), and apply in the same transaction.
+    """
+    devices = Device.__table__
+    changes = Counter()
+    ids = list(updates)
+    for start in range(0, len(ids), 500):
+        rows = conn.execute(
+            select(devices.c.id, devices.c.last_seen_at, devices.c.firmware_version)
+            .where(devices.c.id.in_(ids[start:start + 500])))
+        for device_id, old_seen, old_firmware in rows:
+            seen, firmware = updates[device_id]
+            if _minute(old_seen) != _minute(seen):
+                if old_seen:
+                    changes[('seen_minute', _minute(old_seen))] -= 1
+                changes[('seen_minute', _minute(seen))] += 1
+            if firmware is not None and firmware != old_firmware:
+                changes[('firmware', _value('firmware', old_firmware))] -= 1
+                changes[('firmware', _value('firmware', firmware))] += 1
+    return changes
+
+
+def column_set_changes(conn, column, value, device_ids):
+    """Counter deltas for setting a tracked column to `value` on `device_ids` in one UPDATE.
+
+    Call after lock_for_write(conn), and apply in the same transaction.
+    """
+    devices = Device.__table__
+    col = devices.c[column]
+    dimension = TRACKED_COLUMNS[column]
+    changes = Counter()
+    for raw, count in conn.execute(
+            select(col, func.count()).where(devices.c.id.in_(device_ids)).group_by(col)):
+        changes[(dimension, _value(dimension, raw))] -= count
+        changes[(dimension, _value(dimension, value))] += count
+    return changes
+
+
+def prune_seen_buckets(conn):
+    cutoff = _minute(datetime.utcnow() - SEEN_BUCKET_RETENTION)
+    table = FleetStat.__table__
+    conn.execute(table.delete().where(table.c.dimension == 'seen_minute', table.c.value < cutoff))
+
+
+def rebuild(conn=None):
+    """Recompute every counter from the devices table (first run, or reconciliation)."""
+    if conn is None:
+        with db.engine.begin() as conn:
+            return rebuild(conn)
+
+    devices = Device.__table__
+    changes = Counter()
+    # Always written, even as 0: its presence marks the table as built
+    changes[('total', '')] = conn.execute(select(func.count()).select_from(devices)).scalar()
+    for column, dimension in TRACKED_COLUMNS.items():
+        col = devices.c[column]
+        for raw, count in conn.execute(select(col, func.count()).group_by(col)):
+            changes[(dimension, _value(dimension, raw))] += count
+
+    since = datetime.utcnow() - SEEN_BUCKET_RETENTION
+    minute = func.strftime('%Y-%m-%dT%H:%M', devices.c.last_seen_at)
+    for value, count in conn.execute(
+            select(minute, func.count()).where(devices.c.last_seen_at >= since).group_by(minute)):
+        changes[('seen_minute', value)] += count
+
+    table = FleetStat.__table__
+    conn.execute(table.delete())
+    conn.execute(table.insert(), [{'dimension': d, 'value': v, 'device_count': n} for (d, v), n in changes.items()])
+
+
+def snapshot():
+    """Fleet composition in one query: totals, online/offline and per-dimension counts."""
+    table = FleetStat.__table__
+    cutoff = _minute(datetime.utcnow() - timedelta(minutes=ONLINE_WINDOW_MINUTES))
+    query = select(table.c.dimension, table.c.value, table.c.device_count).where(
+        db.or_(table.c.dimension != 'seen_minute', table.c.value > cutoff))
+
+    rows = db.session.execute(query).all()
+    if not any(dimension == 'total' for dimension, _, _ in rows):
+        rebuild()
+        rows = db.session.execute(query).all()
+
+    stats = {dimension: {} for dimension in TRACKED_COLUMNS.values()}
+    total = online = 0
+    for dimension, value, count in rows:
+        if dimension == 'total':
+            total = count
+        elif dimension == 'seen_minute':
+            online += count
+        elif count > 0:
+            stats[dimension][value or 'unknown'] = count
+    stats.update(total=total, online=online, offline=total - online,
+                 online_window_minutes=ONLINE_WINDOW_MINUTES)
+    return stats
+
+
+# --- ORM hooks: register, delete, and admin/owner edits of tracked columns ---
+
+_COLUMNS = list(TRACKED_COLUMNS) + ['last_seen_at']
+
+
+@event.listens_for(Device, 'after_insert')
+def _device_inserted(mapper, connection, device):
+    apply_changes(connection, Counter(_device_keys({c: getattr(device, c) for c in _COLUMNS})))
+
+
+@event.listens_for(Device, 'after_delete')
+def _device_deleted(mapper, connection, device):
+    state = inspect(device)
+    values = {}
+    for column in _COLUMNS:
+        history = state.attrs[column].history
+        values[column] = history.deleted[0] if history.deleted else getattr(device, column)
+    changes = Counter()
+    changes.subtract(_device_keys(values))
+    apply_changes(connection, changes)
+
+
+@event.listens_for(Device, 'after_update')
+def _device_updated(mapper, connection, device):
+    state = inspect(device)
+    changes = Counter()
+    for column in _COLUMNS:
+        history = state.attrs[column].history
+        if not history.has_changes():
+            continue
+        old = _key(column, history.deleted[0] if history.deleted else None)
+        new = _key(column, history.added[0] if history.added else None)
+        if old != new:
+            if old:
+                changes[old] -= 1
+            if new:
+                changes[new] += 1
+    if changes:
+        apply_changes(connection, changes)
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    return value
+
+
+# Have the ORM load the previous value on assignment, so after_update sees it
+for _column in _COLUMNS:
+    event.listen(getattr(Device, _column), 'set', _load_old_value, active_history=True, retval=True)
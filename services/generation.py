@@ -0,0 +1,53 @@
+import os
+import time
+
+
+class SharedGeneration:
+    """A generation marker shared by every gunicorn worker through a file.
+
+    Writers call `bump()` after committing a change; readers compare
+    `current()` with the value they last saw and drop their local caches when
+    it moves. The file is re-read at most once per `check_interval` seconds,
+    which bounds how long a worker can serve stale data.
+    """
+
+    def __init__(self, name, check_interval=2.0):
+        self.name = name
+        self.check_interval = check_interval
+        self.path = None
+        self._value = None
+        self._checked_at = 0.0
+
+    def init_app(self, app):
+        state_dir = app.config['SHARED_STATE_DIR']
+        os.makedirs(state_dir, exist_ok=True)
+        self.path = os.path.join(state_dir, f'{self.name}.gen')
+        self._value = None
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return f.read().strip()
+        except OSError:
+            return ''
+
+    def current(self):
+        now = time.monotonic()
+        if self._value is None or now - self._checked_at >= self.check_interval:
+            self._value = self._read()
+            self._checked_at = now
+        return self._value
+
+    def expire(self):
+        """Make the next `current()` re-read the file."""
+        self._value = None
+
+    def bump(self):
+        value = f'{time.time_ns()}-{os.getpid()}'
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(value)
+        os.replace(tmp, self.path)
+        self._value = value
+        self._checked_at = time.monotonic()
+        return value
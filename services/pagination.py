@@ -0,0 +1,96 @@
+import base64
+import binascii
+import json
+import math
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort
+from sqlalchemy import and_, false, or_
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor'])
+
+
+class SortKey(namedtuple('SortKey', ['column', 'descending', 'nullable'])):
+    """One column of a keyset ordering. The last key must be unique (usually the id)."""
+
+    def __new__(cls, column, descending=True, nullable=False):
+        return super().__new__(cls, column, descending, nullable)
+
+    def order_by(self):
+        return self.column.desc() if self.descending else self.column.asc()
+
+    def after(self, value):
+        """Rows strictly after `value` in this key's order (SQLite sorts NULL lowest)."""
+        if value is None:
+            return None if self.descending else self.column.isnot(None)
+        condition = self.column < value if self.descending else self.column > value
+        if self.nullable and self.descending:
+            condition = or_(condition, self.column.is_(None))
+        return condition
+
+    def equals(self, value):
+        return self.column.is_(None) if value is None else self.column == value
+
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    """Sort key values from `cursor`, or None if there is none. Aborts with 400 if it is malformed."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError('wrong shape')
+        return [_key_value(key, value) for key, value in zip(keys, values)]
+    except (ValueError, OverflowError, binascii.Error):
+        abort(400, description='Invalid cursor')
+
+
+def _key_value(key, value):
+    """`value` as a bound for `key`; ValueError unless it is None or a scalar of the column's type."""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError('not a scalar')
+    try:
+        python_type = key.column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if python_type is float and isinstance(value, (int, float)) and math.isfinite(value):
+        return float(value)
+    if python_type is int and isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:  # SQLite INTEGER range
+        return value
+    if python_type is str and isinstance(value, str):
+        return value
+    raise ValueError(f'not a {python_type.__name__}')
+
+
+def keyset_paginate(query, keys, cursor=None, per_page=50):
+    """Page through `query` ordered by `keys` (SortKey list) without OFFSET or COUNT.
+
+    Each page seeks past the last row of the previous one, so with an index
+    on the key columns deep pages cost the same as the first.
+    """
+    values = decode_cursor(cursor, keys)
+    if values is not None:
+        branches = []
+        for i, key in enumerate(keys):
+            after = key.after(values[i])
+            if after is None:
+                continue
+            branches.append(and_(*[k.equals(v) for k, v in zip(keys[:i], values[:i])], after))
+        query = query.filter(or_(*branches)) if branches else query.filter(false())
+
+    rows = query.order_by(*[key.order_by() for key in keys]).limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows) > per_page:
+        next_cursor = encode_cursor([getattr(items[-1], key.column.key) for key in keys])
+    return KeysetPage(items, next_cursor)
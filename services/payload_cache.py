@@ -0,0 +1,73 @@
+import gzip
+import json
+from collections import namedtuple
+
+from sqlalchemy import event
+
+from models import Post
+from models.hashing import content_hash
+from .generation import SharedGeneration
+from .lru import LRUCache
+
+EncodedPayload = namedtuple('EncodedPayload', ['body', 'gzipped'])
+
+
+def _payload_size(payload):
+    return len(payload.body) + len(payload.gzipped or b'')
+
+
+def payload_version(post):
+    """Hash of every post field in the /api/v1/gauge payload; the cache key and ETag."""
+    return content_hash(json.dumps([post.title, post.gauge_type, post.data_hash]))
+
+
+class GaugePayloadCache:
+    """Final /api/v1/gauge response bodies keyed by (post_id, payload_version, mimetype).
+
+    Devices sharing a gauge get a copy of the same bytes instead of a
+    json.loads/dumps cycle per request. Memory is capped at
+    GAUGE_PAYLOAD_CACHE_BYTES with LRU eviction. An edited post never
+    matches its old key; the old entries are dropped here when the post is
+    updated or deleted, and in the other workers through a shared generation.
+    """
+
+    def __init__(self):
+        self.gzip = True
+        self._entries = LRUCache(max_entries=None, max_bytes=8 * 1024 * 1024, sizeof=_payload_size)
+        self._generation = SharedGeneration('gauge_payloads')
+        self._seen_generation = None
+
+    def init_app(self, app):
+        self._entries.configure(max_bytes=app.config['GAUGE_PAYLOAD_CACHE_BYTES'])
+        self.gzip = app.config['GAUGE_PAYLOAD_CACHE_GZIP']
+        self._generation.init_app(app)
+
+    def get(self, post, encode, mimetype='application/json'):
+        """Return the EncodedPayload for `post` in `mimetype`, calling `encode()` -> bytes on a miss."""
+        generation = self._generation.current()
+        if generation != self._seen_generation:
+            self._entries.clear()
+            self._seen_generation = generation
+
+        key = (post.id, payload_version(post), mimetype)
+        payload = self._entries.get(key)
+        if payload is None:
+            body = encode()
+            payload = EncodedPayload(body, gzip.compress(body) if self.gzip else None)
+            self._entries.set(key, payload)
+        return payload
+
+    def invalidate_post(self, post_id):
+        """Forget `post_id`'s payloads here and in the other workers."""
+        self._entries.discard_where(lambda key, payload: key[0] == post_id)
+        if self._generation.path:
+            self._generation.bump()
+
+
+gauge_payload_cache = GaugePayloadCache()
+
+
+@event.listens_for(Post, 'after_update')
+@event.listens_for(Post, 'after_delete')
+def _invalidate_gauge_payload(mapper, connection, post):
+    gauge_payload_cache.invalidate_post(post.id)
@@ -0,0 +1,130 @@
+import atexit
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.exc import OperationalError
+
+from models import db, Device
+from .fleet_stats import apply_changes, lock_for_write, presence_changes, prune_seen_buckets, rebuild
+
+
+class PresenceTracker:
+    """Write-behind store for device presence.
+
+    API calls record last-seen timestamps and reported firmware versions in
+    memory; `flush()` writes everything pending in one executemany UPDATE at
+    most once per PRESENCE_FLUSH_INTERVAL seconds, after the request that
+    triggered it has been handled, and moves the matching fleet_stats
+    counters. Every FLEET_STATS_RECONCILE_INTERVAL seconds a flush rebuilds
+    the counters instead, repairing any drift. Readers go through
+    `last_seen()` and `firmware_version()` so unflushed values are still
+    visible.
+    """
+
+    def __init__(self):
+        self.flush_interval = 5
+        self.reconcile_interval = 3600
+        self._reconciled_at = time.monotonic()
+        self._pending = {}  # device_id -> (last_seen_at, firmware_version or None)
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def init_app(self, app):
+        self.flush_interval = app.config['PRESENCE_FLUSH_INTERVAL']
+        self.reconcile_interval = app.config['FLEET_STATS_RECONCILE_INTERVAL']
+
+        @app.after_request
+        def _flush_presence(response):
+            self.flush_if_due()
+            return response
+
+        def _flush_on_exit():
+            with app.app_context():
+                self.flush()
+
+        atexit.register(_flush_on_exit)
+
+    def record(self, device_id, firmware_version=None):
+        now = datetime.utcnow()
+        with self._lock:
+            pending = self._pending.get(device_id)
+            if firmware_version is None and pending:
+                firmware_version = pending[1]
+            self._pending[device_id] = (now, firmware_version)
+
+    def last_seen(self, device_id):
+        pending = self._pending.get(device_id)
+        return pending[0] if pending else None
+
+    def firmware_version(self, device_id):
+        pending = self._pending.get(device_id)
+        return pending[1] if pending else None
+
+    def flush_if_due(self):
+        if self._pending and time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write pending presence to the database. Returns the number of devices written."""
+        with self._lock:
+            snapshot = dict(self._pending)
+            self._flushed_at = time.monotonic()
+        if not snapshot:
+            return 0
+
+        written = len(snapshot)
+        try:
+            if self._write(snapshot):
+                self._reconciled_at = time.monotonic()
+        except OperationalError:  # e.g. database is locked
+            current_app.logger.warning('Presence flush of %d devices failed, retrying on the next flush',
+                                       written, exc_info=True)
+            return 0
+        except Exception:
+            current_app.logger.exception('Presence flush of %d devices failed, dropping it', written)
+            written = 0
+
+        # Keep anything recorded while we were writing
+        with self._lock:
+            for device_id, value in snapshot.items():
+                if self._pending.get(device_id) is value:
+                    del self._pending[device_id]
+        return written
+
+    def _write(self, snapshot):
+        """One transaction for presence and the fleet_stats counters. Returns whether it reconciled them."""
+        devices = Device.__table__
+        seen_rows = [{'b_id': device_id, 'b_seen': seen}
+                     for device_id, (seen, firmware) in snapshot.items() if firmware is None]
+        firmware_rows = [{'b_id': device_id, 'b_seen': seen, 'b_fw': firmware}
+                         for device_id, (seen, firmware) in snapshot.items() if firmware is not None]
+
+        reconcile = time.monotonic() - self._reconciled_at >= self.reconcile_interval
+        with db.engine.begin() as conn:
+            # Move fleet_stats online buckets and firmware counts in the same transaction,
+            # holding the write lock from the read of the old values on
+            lock_for_write(conn)
+            if not reconcile:
+                apply_changes(conn, presence_changes(conn, snapshot))
+                prune_seen_buckets(conn)
+            if seen_rows:
+                conn.execute(
+                    devices.update()
+                    .where(devices.c.id == bindparam('b_id'))
+                    .values(last_seen_at=bindparam('b_seen')),
+                    seen_rows)
+            if firmware_rows:
+                conn.execute(
+                    devices.update()
+                    .where(devices.c.id == bindparam('b_id'))
+                    .values(last_seen_at=bindparam('b_seen'), firmware_version=bindparam('b_fw')),
+                    firmware_rows)
+            if reconcile:
+                rebuild(conn)
+        return reconcile
+
+
+presence = PresenceTracker()
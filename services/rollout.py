@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from models import db, FirmwareRollout, FirmwareRolloutDownload
+from .fleet_stats import lock_for_write
+
+
+def active_rollout(firmware_id):
+    """The rollout gating a firmware, or None when every device gets it at once."""
+    return FirmwareRollout.query \
+        .filter(FirmwareRollout.firmware_id == firmware_id, FirmwareRollout.status != 'completed') \
+        .order_by(FirmwareRollout.id.desc()) \
+        .first()
+
+
+def offer_update(rollout, device):
+    """Whether `device` may download the rollout's firmware now.
+
+    The device must be in a selected cohort, and a download slot must be free
+    when the rollout has a max_concurrent budget. Slots are held until the
+    device reports its OTA result, or until ROLLOUT_DOWNLOAD_LEASE seconds
+    have passed. The budget is counted and the slot claimed under the write
+    lock, so concurrent workers can't both take the last slot.
+    """
+    if rollout.status != 'running' or not rollout.matches(device):
+        return False
+
+    now = datetime.utcnow()
+    lease_cutoff = now - timedelta(seconds=current_app.config['ROLLOUT_DOWNLOAD_LEASE'])
+    download = FirmwareRolloutDownload.query.filter_by(rollout_id=rollout.id, device_id=device.id).first()
+    if _holds_slot(download, lease_cutoff):
+        return True
+
+    lock_for_write(db.session.connection())
+    download = FirmwareRolloutDownload.query.filter_by(rollout_id=rollout.id, device_id=device.id) \
+        .populate_existing().first()
+    if _holds_slot(download, lease_cutoff):  # claimed by another worker meanwhile
+        db.session.rollback()
+        return True
+
+    if rollout.max_concurrent is not None:
+        in_flight = FirmwareRolloutDownload.query.filter(
+            FirmwareRolloutDownload.rollout_id == rollout.id,
+            FirmwareRolloutDownload.status == 'downloading',
+            FirmwareRolloutDownload.started_at > lease_cutoff
+        ).count()
+        if in_flight >= rollout.max_concurrent:
+            db.session.rollback()
+            return False
+
+    if not download:
+        download = FirmwareRolloutDownload(rollout_id=rollout.id, device_id=device.id)
+        db.session.add(download)
+    download.status = 'downloading'
+    download.started_at = now
+    download.finished_at = None
+    try:
+        db.session.commit()
+    except IntegrityError:  # already offered to this device by another worker
+        db.session.rollback()
+    return True
+
+
+def _holds_slot(download, lease_cutoff):
+    return download is not None and download.status == 'downloading' and download.started_at > lease_cutoff
+
+
+def report_result(rollout, device, succeeded):
+    """Record a device's OTA outcome, release its slot and auto-pause on failures.
+
+    Only a device holding a 'downloading' slot is counted, and only once: the
+    slot leaves that state in the same transaction as the counter moves.
+    Returns whether the report was counted.
+    """
+    released = FirmwareRolloutDownload.query.filter_by(
+        rollout_id=rollout.id, device_id=device.id, status='downloading'
+    ).update({'status': 'succeeded' if succeeded else 'failed', 'finished_at': datetime.utcnow()},
+             synchronize_session=False)
+    if not released:
+        db.session.rollback()
+        return False
+
+    counter = FirmwareRollout.success_count if succeeded else FirmwareRollout.failure_count
+    FirmwareRollout.query.filter_by(id=rollout.id).update({counter: counter + 1})
+    db.session.commit()
+
+    db.session.refresh(rollout)
+    if rollout.status == 'running' and rollout.should_pause():
+        total = rollout.success_count + rollout.failure_count
+        rollout.status = 'paused'
+        rollout.paused_reason = f'Auto-paused: {rollout.failure_count}/{total} devices reported a failed update'
+        db.session.commit()
+    return True
+
+
+def delete_rollouts(firmware):
+    """Remove every rollout of `firmware` and its download slots (not committed)."""
+    rollout_ids = [r.id for r in firmware.rollouts]
+    if rollout_ids:
+        FirmwareRolloutDownload.query.filter(FirmwareRolloutDownload.rollout_id.in_(rollout_ids)) \
+            .delete(synchronize_session=False)
+    for rollout in firmware.rollouts:
+        db.session.delete(rollout)
@@ -0,0 +1,214 @@
+import atexit
+import importlib
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+METRICS = ('rpm', 'volt', 'speed', 'tilt')
+
+MinuteRollup = namedtuple('MinuteRollup', ['device_id', 'minute', 'count', 'min', 'max', 'avg'])
+
+_ROLLUP_UPSERT = '''
+    INSERT INTO rollups_minute (metric, minute, device_id, n, vmin, vmax, vsum) VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (metric, minute, device_id) DO UPDATE SET
+        n = n + excluded.n,
+        vmin = min(vmin, excluded.vmin),
+        vmax = max(vmax, excluded.vmax),
+        vsum = vsum + excluded.vsum
+'''
+
+
+def _native(module, name):
+    """`module.name` as it was before gevent monkey-patching (as is when gevent isn't in use)."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return getattr(importlib.import_module(module), name)
+    return monkey.get_original(module, name)
+
+
+def _day(ts_ms):
+    return datetime.fromtimestamp(ts_ms / 1000, timezone.utc).strftime('%Y%m%d')
+
+
+class TelemetryBufferFull(Exception):
+    """The write-behind buffer is at TELEMETRY_BUFFER_MAX; the device should retry later."""
+
+
+class TelemetryStore:
+    """Buffered, append-only telemetry storage in its own SQLite file.
+
+    `ingest()` only appends to an in-memory buffer, so the request path never
+    waits on disk. A writer thread per worker drains the buffer every
+    TELEMETRY_FLUSH_INTERVAL seconds into one samples_YYYYMMDD table per UTC
+    day, and in the same transaction folds the batch into rollups_minute
+    (count/min/max/sum per device, metric and minute), which is what rollup
+    queries read. Day tables past TELEMETRY_RETENTION_DAYS are dropped whole.
+
+    Under gevent workers the writer still runs in a real OS thread, so its
+    blocking sqlite3 calls release the GIL instead of stalling the hub, and
+    connections are cached per OS thread rather than per greenlet.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.flush_interval = 1.0
+        self.buffer_max = 200000
+        self.retention_days = 30
+        self._buffer = []  # (device_id, ts_ms, rpm, volt, speed, tilt)
+        self._lock = _native('threading', 'Lock')()  # shared with the native writer thread
+        self._local = _native('threading', 'local')()
+        self._day_tables = set()
+        self._pruned_day = None
+        self._writer_pid = None
+
+    def init_app(self, app):
+        self.path = app.config['TELEMETRY_DB']
+        self.flush_interval = app.config['TELEMETRY_FLUSH_INTERVAL']
+        self.buffer_max = app.config['TELEMETRY_BUFFER_MAX']
+        self.retention_days = app.config['TELEMETRY_RETENTION_DAYS']
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        atexit.register(self.flush)
+
+    # --- Write path ---
+
+    def ingest(self, rows):
+        """Queue sample rows for writing. Raises TelemetryBufferFull instead of blocking."""
+        self._ensure_writer()
+        with self._lock:
+            if len(self._buffer) + len(rows) > self.buffer_max:
+                raise TelemetryBufferFull()
+            self._buffer.extend(rows)
+
+    def flush(self):
+        """Write everything buffered. Returns the number of samples written."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+
+        by_day = {}
+        rollups = {}
+        for row in batch:
+            by_day.setdefault(_day(row[1]), []).append(row)
+            minute = row[1] // 60000
+            for metric, value in zip(METRICS, row[2:]):
+                if value is None:
+                    continue
+                key = (metric, minute, row[0])
+                agg = rollups.get(key)
+                if agg is None:
+                    rollups[key] = [1, value, value, value]
+                else:
+                    agg[0] += 1
+                    agg[1] = min(agg[1], value)
+                    agg[2] = max(agg[2], value)
+                    agg[3] += value
+
+        conn = self._connection()
+        try:
+            with conn:
+                for day, rows in by_day.items():
+                    table = self._day_table(conn, day)
+                    conn.executemany(f'INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?)', rows)
+                conn.executemany(_ROLLUP_UPSERT, [(*key, *agg) for key, agg in rollups.items()])
+        except sqlite3.Error:
+            # Put the batch back for the next attempt (e.g. the file was locked)
+            with self._lock:
+                self._buffer[:0] = batch
+            raise
+        self._prune(conn)
+        return len(batch)
+
+    # --- Read path ---
+
+    def minute_rollups(self, metric, start, end, device_ids=None):
+        """MinuteRollup rows for `metric` with start <= minute < end (datetimes, UTC)."""
+        return [MinuteRollup(device_id, datetime.utcfromtimestamp(minute * 60), n, vmin, vmax, vsum / n)
+                for device_id, minute, n, vmin, vmax, vsum in self.rollup_rows(metric, start, end, device_ids)]
+
+    def rollup_rows(self, metric, start, end, device_ids=None):
+        """Raw (device_id, minute, n, vmin, vmax, vsum) tuples ordered by device then minute.
+
+        `minute` is minutes since the epoch. For bulk consumers that would
+        rather not build a MinuteRollup per row.
+        """
+        if metric not in METRICS:
+            raise ValueError(f'Unknown metric: {metric}')
+        query = ('SELECT device_id, minute, n, vmin, vmax, vsum FROM rollups_minute '
+                 'WHERE metric = ? AND minute >= ? AND minute < ?')
+        params = [metric, int(start.replace(tzinfo=timezone.utc).timestamp()) // 60,
+                  int(end.replace(tzinfo=timezone.utc).timestamp()) // 60]
+        if device_ids is not None:
+            device_ids = list(device_ids)
+            query += f' AND device_id IN ({",".join("?" * len(device_ids))})'
+            params += device_ids
+        query += ' ORDER BY device_id, minute'
+        return self._connection().execute(query, params).fetchall()
+
+    # --- Storage ---
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS rollups_minute (
+                metric TEXT NOT NULL, minute INTEGER NOT NULL, device_id INTEGER NOT NULL,
+                n INTEGER NOT NULL, vmin REAL, vmax REAL, vsum REAL,
+                PRIMARY KEY (metric, minute, device_id)) WITHOUT ROWID''')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_rollups_minute_device '
+                         'ON rollups_minute (device_id, metric, minute)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _day_table(self, conn, day):
+        table = f'samples_{day}'
+        if table not in self._day_tables:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (device_id INTEGER NOT NULL, ts INTEGER NOT NULL, '
+                         f'{", ".join(f"{m} REAL" for m in METRICS)})')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_device_ts ON {table} (device_id, ts)')
+            self._day_tables.add(table)
+        return table
+
+    def _prune(self, conn):
+        """Once a day: drop expired day tables and rollups."""
+        today = time.strftime('%Y%m%d', time.gmtime())
+        if self._pruned_day == today:
+            return
+        self._pruned_day = today
+        cutoff = time.time() - self.retention_days * 86400
+        cutoff_day = time.strftime('%Y%m%d', time.gmtime(cutoff))
+        with conn:
+            for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'samples_%'").fetchall():
+                if table[len('samples_'):] < cutoff_day:
+                    conn.execute(f'DROP TABLE {table}')
+                    self._day_tables.discard(table)
+            conn.execute('DELETE FROM rollups_minute WHERE minute < ?', (int(cutoff) // 60,))
+
+    def _ensure_writer(self):
+        if self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+            self._buffer = []  # anything inherited across a fork belongs to the parent
+            # Not threading.Thread: with threading patched its start() spawns a greenlet
+            _native('_thread', 'start_new_thread')(self._write_loop, ())
+
+    def _write_loop(self):
+        sleep = _native('time', 'sleep')
+        while True:
+            sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass  # batch was re-queued; retried on the next tick
+
+
+telemetry = TelemetryStore()
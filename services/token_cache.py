@@ -0,0 +1,54 @@
+from collections import namedtuple
+
+from models import db, DeviceToken
+from .generation import SharedGeneration
+from .lru import LRUCache
+
+CachedToken = namedtuple('CachedToken', ['token', 'device_id', 'user_id', 'is_active'])
+
+
+class DeviceTokenCache:
+    """Per-worker cache of device tokens for `require_device_token`.
+
+    Entries expire after DEVICE_TOKEN_CACHE_TTL seconds. Revocations made in
+    any worker bump a shared generation, and every worker clears its cache
+    when it notices the change (within `SharedGeneration.check_interval`).
+    """
+
+    def __init__(self):
+        self._entries = LRUCache()
+        self._generation = SharedGeneration('device_tokens')
+        self._seen_generation = None
+
+    def init_app(self, app):
+        self._entries.configure(max_entries=app.config['DEVICE_TOKEN_CACHE_SIZE'],
+                                ttl=app.config['DEVICE_TOKEN_CACHE_TTL'])
+        self._generation.init_app(app)
+
+    def lookup(self, token_str):
+        """Return the CachedToken for `token_str`, or None if it does not exist."""
+        generation = self._generation.current()
+        if generation != self._seen_generation:
+            self._entries.clear()
+            self._seen_generation = generation
+
+        entry = self._entries.get(token_str)
+        if entry is not None:
+            return entry
+
+        row = db.session.query(DeviceToken.device_id, DeviceToken.user_id, DeviceToken.is_active) \
+            .filter(DeviceToken.token == token_str).first()
+        if not row:
+            return None
+
+        entry = CachedToken(token_str, row.device_id, row.user_id, row.is_active)
+        self._entries.set(token_str, entry)
+        return entry
+
+    def invalidate_device(self, device_id):
+        """Forget every token of `device_id` here and in the other workers."""
+        self._entries.discard_where(lambda key, entry: entry.device_id == device_id)
+        self._generation.bump()
+
+
+token_cache = DeviceTokenCache()
@@ -9,6 +9,8 @@ sleep 1
 nohup /home/dezzip/multigauge/venv/bin/gunicorn \
     --bind 0.0.0.0:5001 \
     --workers 2 \
+    --worker-class gevent \
+    --worker-connections 1000 \
     --timeout 120 \
     app:app \
     > /home/dezzip/multigauge/gunicorn.log 2>&1 &
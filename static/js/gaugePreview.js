@@ -1,9 +1,11 @@
 import { GaugeFace } from "/static/js/core/gauge/GaugeFace.js";
 
-document.addEventListener("DOMContentLoaded", () => {
-    const canvases = document.querySelectorAll(".post-canvas");
+// Draw every not-yet-drawn post preview under `root` (cards appended later call this again)
+export function renderGaugePreviews(root = document) {
+    const canvases = root.querySelectorAll(".post-canvas:not([data-rendered])");
 
     canvases.forEach((canvas) => {
+        canvas.dataset.rendered = "1";
         const postId = canvas.id.split("-")[1]; // Extract the post ID from the canvas ID
         const gaugeDataElement = document.getElementById(`gaugeData-${postId}`);
 
@@ -23,9 +25,11 @@ document.addEventListener("DOMContentLoaded", () => {
 
         const context = canvas.getContext("2d");
         const loadedGaugeFace = GaugeFace.fromJSON(gaugeData); // Deserialize the GaugeFace
-        
+
         console.log("GaugeFace:", loadedGaugeFace);
 
         loadedGaugeFace.draw(canvas, context); // Draw the GaugeFace on the canvas
     });
-});
\ No newline at end of file
+}
+
+document.addEventListener("DOMContentLoaded", () => renderGaugePreviews());
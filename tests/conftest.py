@@ -0,0 +1,85 @@
+import atexit
+import os
+import secrets
+import shutil
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+# Before app is imported: site.db, telemetry.db and shared state go to a throwaway directory
+if 'MULTIGAUGE_INSTANCE_PATH' not in os.environ:
+    os.environ['MULTIGAUGE_INSTANCE_PATH'] = tempfile.mkdtemp(prefix='multigauge-tests-')
+    atexit.register(shutil.rmtree, os.environ['MULTIGAUGE_INSTANCE_PATH'], ignore_errors=True)
+
+from app import app as flask_app  # noqa: E402
+from models import db, bcrypt, User, Device, DeviceToken  # noqa: E402
+from services import presence  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        presence.flush()  # don't carry pending presence into the next test's database
+        db.session.remove()
+        db.drop_all()
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('DROP TABLE IF EXISTS posts_fts')  # virtual table, not in the metadata
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username, role='user'):
+        user = User(username=username, email=f'{username}@example.com', role=role,
+                    password=bcrypt.generate_password_hash('password').decode('utf-8'))
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make_user
+
+
+@pytest.fixture
+def make_device(app, make_user):
+    """make_device(hardware_id, **columns) -> (device, bearer token), owned by a shared 'owner' user."""
+    owner = []
+
+    def make_device(hardware_id, **columns):
+        if not owner:
+            owner.append(make_user('owner'))
+        device = Device(hardware_id=hardware_id, name=f'Gauge {hardware_id}', user_id=owner[0].id, **columns)
+        db.session.add(device)
+        db.session.flush()
+        token = DeviceToken(token=secrets.token_hex(32), device_id=device.id, user_id=owner[0].id)
+        db.session.add(token)
+        db.session.commit()
+        return device, token.token
+    return make_device
+
+
+@pytest.fixture
+def login(client):
+    def login(user):
+        client.get('/logout')  # /login ignores an already logged-in client
+        return client.post('/login', data={'username': user.username, 'password': 'password'})
+    return login
+
+
+@pytest.fixture
+def queries(app):
+    """SQL statements sent to the database while the test runs; clear() before the part being measured."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', record)
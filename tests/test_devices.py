@@ -0,0 +1,34 @@
+import pytest
+
+from models import db, Device
+
+
+def _bulk(client, **body):
+    return client.post('/devices/bulk', json=body)
+
+
+def test_bulk_tag_by_filter(client, login, make_device):
+    tagged, _ = make_device('AA:01', country='DE')
+    other, _ = make_device('AA:02', country='FR')
+    login(tagged.user)
+
+    response = _bulk(client, action='tag', tag='lab', filter={'country': 'DE', 'q': None})
+    assert response.status_code == 200
+    assert response.get_json()['updated'] == 1
+    db.session.expire_all()
+    assert (db.session.get(Device, tagged.id).tag, db.session.get(Device, other.id).tag) == ('lab', None)
+
+
+@pytest.mark.parametrize('body', [
+    {'action': 'tag', 'tag': 'lab', 'filter': {'country': ['DE']}},
+    {'action': 'tag', 'tag': 'lab', 'filter': {'fw': {'x': 1}}},
+    {'action': 'tag', 'tag': 'lab', 'filter': {'status': 1}},
+    {'action': 'profile', 'profile': ['default'], 'device_ids': [1]},
+    {'action': 'profile', 'profile': {'name': 'default'}, 'device_ids': [1]},
+])
+def test_malformed_bulk_request_is_a_bad_request(client, login, make_device, body):
+    device, _ = make_device('AA:01')
+    login(device.user)
+
+    assert _bulk(client, **body).status_code == 400
+    assert client.post('/devices/bulk', json=[body]).status_code == 400
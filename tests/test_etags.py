@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from models import db, Post
+
+
+@pytest.fixture
+def gauge(make_user):
+    post = Post(title='Boost', description='', gauge_type='boost', data=json.dumps({'elements': [1]}),
+                posted_by=make_user('author').id)
+    db.session.add(post)
+    db.session.commit()
+    return post
+
+
+def _get(client, path, token, etag=None, **headers):
+    if etag:
+        headers['If-None-Match'] = etag
+    return client.get(path, headers={'Authorization': f'Bearer {token}', **headers})
+
+
+def test_gauge_not_modified(client, make_device, gauge, queries):
+    _, token = make_device('AA:01', assigned_post_id=gauge.id)
+    queries.clear()
+    first = _get(client, '/api/v1/gauge', token)
+    assert first.status_code == 200
+    assert [q for q in queries if 'posts.data AS' in q]
+    assert first.get_json()['data'] == {'elements': [1]}
+
+    queries.clear()
+    again = _get(client, '/api/v1/gauge', token, first.headers['ETag'])
+    assert again.status_code == 304
+    assert again.headers['ETag'] == first.headers['ETag']
+    assert not [q for q in queries if 'posts.data AS' in q]  # answered without loading the JSON
+
+    gauge.data = json.dumps({'elements': [2]})
+    db.session.commit()
+    changed = _get(client, '/api/v1/gauge', token, first.headers['ETag'])
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != first.headers['ETag']
+    assert changed.get_json()['data'] == {'elements': [2]}
+
+
+def test_config_not_modified(client, make_device):
+    device, token = make_device('AA:01')
+    first = _get(client, '/api/v1/config', token)
+    assert first.status_code == 200
+
+    assert _get(client, '/api/v1/config', token, first.headers['ETag']).status_code == 304
+
+    device.config_json = json.dumps({'volt_warning_low': 11.0})
+    db.session.commit()
+    changed = _get(client, '/api/v1/config', token, first.headers['ETag'])
+    assert changed.status_code == 200
+    assert changed.get_json()['config']['volt_warning_low'] == 11.0
+
+
+def test_each_format_has_its_own_etag(client, make_device, gauge):
+    _, token = make_device('AA:01', assigned_post_id=gauge.id)
+    for path in ('/api/v1/gauge', '/api/v1/config'):
+        as_json = _get(client, path, token)
+        as_cbor = _get(client, path, token, Accept='application/cbor')
+        assert as_cbor.mimetype == 'application/cbor'
+        assert as_cbor.headers['ETag'] != as_json.headers['ETag']
+        assert _get(client, path, token, as_json.headers['ETag'], Accept='application/cbor').status_code == 200
@@ -0,0 +1,94 @@
+import hashlib
+import io
+import os
+import random
+
+import bsdiff4
+import pytest
+from werkzeug import formparser
+
+from models import db, Firmware, FirmwareDelta
+from routes import admin
+
+
+@pytest.fixture
+def firmware_dir(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'FIRMWARE_UPLOAD_DIR', str(tmp_path))
+    return tmp_path
+
+
+def _firmware(firmware_dir, version, data, uploader, **columns):
+    filename = f'firmware_v{version}.bin'
+    (firmware_dir / filename).write_bytes(data)
+    firmware = Firmware(version=version, filename=filename, file_size=len(data), uploaded_by=uploader.id, **columns)
+    db.session.add(firmware)
+    db.session.commit()
+    return firmware
+
+
+def test_activation_starts_the_build(client, make_user, login, firmware_dir, monkeypatch):
+    moderator = make_user('moderator', role='moderator')
+    firmware = _firmware(firmware_dir, '3.1.0', b'image', moderator)
+    started = []
+    monkeypatch.setattr(admin, 'start_build', started.append)
+    login(moderator)
+
+    assert client.post(f'/admin/firmware/{firmware.id}/activate').status_code == 302
+    assert started == [client.application]
+
+
+def test_build_command_offers_the_patch(app, client, make_user, make_device, firmware_dir):
+    uploader = make_user('uploader', role='admin')
+    old = random.Random(1).randbytes(64 * 1024)
+    new = old[:30000] + b'patched' + old[30000:]
+    _firmware(firmware_dir, '3.0.0', old, uploader)
+    _firmware(firmware_dir, '3.1.0', new, uploader, is_active=True)
+    _, token = make_device('AA:01', firmware_version='3.0.0')
+
+    result = app.test_cli_runner().invoke(args=['build-firmware-deltas'])
+    assert '1 delta update(s) built for v3.1.0' in result.output
+    delta = FirmwareDelta.query.one()
+    assert os.path.exists(firmware_dir / delta.filename)
+
+    headers = {'Authorization': f'Bearer {token}'}
+    offer = client.post('/api/v1/sync', json={'firmware_version': '3.0.0'}, headers=headers).get_json()['firmware']
+    assert offer['delta']['file_size'] == delta.file_size
+    patch = client.get(offer['delta']['download_url'], headers=headers)
+    assert bsdiff4.patch(old, patch.data) == new
+
+    result = app.test_cli_runner().invoke(args=['build-firmware-deltas'])
+    assert '0 delta update(s)' in result.output
+
+
+def _upload(client, version, data, filename='image.bin'):
+    return client.post('/admin/firmware/upload', content_type='multipart/form-data',
+                       data={'version': version, 'notes': '', 'firmware': (io.BytesIO(data), filename)})
+
+
+def test_upload_is_hashed_as_it_streams(client, make_user, login, firmware_dir, monkeypatch):
+    login(make_user('moderator', role='moderator'))
+    data = random.Random(2).randbytes(600 * 1024)  # above werkzeug's in-memory limit
+    spooled = []
+    spool = formparser.SpooledTemporaryFile
+    monkeypatch.setattr(formparser, 'SpooledTemporaryFile', lambda **kw: spooled.append(kw) or spool(**kw))
+
+    assert _upload(client, '3.2.0', data).status_code == 302
+    assert _upload(client, '3.2.1', data).status_code == 302  # same binary
+    assert _upload(client, '3.2.2', data, 'image.txt').status_code == 302  # rejected
+
+    firmware = Firmware.query.filter_by(version='3.2.0').one()
+    assert (firmware.file_size, firmware.checksum) == (len(data), hashlib.sha256(data).hexdigest())
+    assert Firmware.query.filter_by(version='3.2.1').one().filename == firmware.filename
+    assert not Firmware.query.filter_by(version='3.2.2').first()
+    assert os.listdir(firmware_dir) == [firmware.filename]  # no temp files left behind
+    assert (firmware_dir / firmware.filename).read_bytes() == data
+    assert os.stat(firmware_dir / firmware.filename).st_mode & 0o777 == 0o644
+    assert not spooled
+
+
+def test_oversized_upload_leaves_no_temp_file(app, client, make_user, login, firmware_dir, monkeypatch):
+    login(make_user('moderator', role='moderator'))
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 64 * 1024)
+
+    assert _upload(client, '3.3.0', bytes(128 * 1024)).status_code == 413
+    assert os.listdir(firmware_dir) == []
@@ -0,0 +1,72 @@
+import io
+
+import pytest
+
+from models import db, Firmware
+from routes import admin
+from services import firmware_registry
+from services.firmware_registry import FirmwareRegistry
+
+
+@pytest.fixture
+def moderator(client, make_user, login, monkeypatch):
+    monkeypatch.setattr(admin, 'start_build', lambda app: None)
+    user = make_user('moderator', role='moderator')
+    login(user)
+    return user
+
+
+def _firmware(uploader, version, **columns):
+    firmware = Firmware(version=version, filename=f'firmware_v{version}.bin', file_size=1024,
+                        uploaded_by=uploader.id, **columns)
+    db.session.add(firmware)
+    db.session.commit()
+    return firmware
+
+
+def _check(client, token):
+    response = client.get('/api/v1/firmware/check', query_string={'current_version': '3.0.0'},
+                          headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_checks_run_no_firmware_queries(client, make_device, moderator, queries):
+    _firmware(moderator, '3.1.0', is_active=True)
+    firmware_registry.invalidate()
+    _, token = make_device('AA:01')
+    assert _check(client, token)['version'] == '3.1.0'
+
+    queries.clear()
+    assert _check(client, token)['update_available']
+    assert not [q for q in queries if 'firmwares' in q]
+
+
+def test_activation_reloads_every_worker(app, client, make_device, moderator):
+    _firmware(moderator, '3.1.0', is_active=True)
+    newer = _firmware(moderator, '3.2.0')
+    firmware_registry.invalidate()
+    other_worker = FirmwareRegistry()
+    other_worker.init_app(app)
+    _, token = make_device('AA:01')
+    assert _check(client, token)['version'] == '3.1.0'
+    assert other_worker.active().version == '3.1.0'
+
+    assert client.post(f'/admin/firmware/{newer.id}/activate').status_code == 302
+    assert _check(client, token)['version'] == '3.2.0'
+
+    other_worker.refresh()
+    assert other_worker.active().version == '3.2.0'
+    assert other_worker.active().version_tuple == (3, 2, 0)
+
+
+def test_latest_version_without_an_active_release(app, client, moderator, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'FIRMWARE_UPLOAD_DIR', str(tmp_path))
+    _firmware(moderator, '3.1.0')
+    firmware_registry.invalidate()
+    assert firmware_registry.active() is None
+    assert firmware_registry.latest_version() == '3.1.0'
+
+    client.post('/admin/firmware/upload', content_type='multipart/form-data',
+                data={'version': '3.2.0', 'firmware': (io.BytesIO(b'image'), 'image.bin')})
+    assert firmware_registry.latest_version() == '3.2.0'
@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from services import fleet_analytics
+
+
+def test_empty_window(app):
+    summary = fleet_analytics.summary(60, now=datetime(2000, 1, 1))
+
+    assert summary['countries'] == {}
+    fleet = summary['fleet']
+    assert fleet['devices'] == 0
+    assert fleet['volt']['samples'] == 0 and fleet['volt']['mean'] is None
+    assert fleet['volt']['histogram'] == [0] * (len(summary['volt_bins']) - 1)
+    assert fleet['tilt']['devices'] == 0 and fleet['tilt']['peak_percentiles'] is None
+
+
+def test_analytics_endpoint_without_telemetry(client, make_user, login):
+    login(make_user('moderator', role='moderator'))
+
+    response = client.get('/admin/fleet/analytics')
+    assert response.status_code == 200
+    assert response.get_json()['countries'] == {}
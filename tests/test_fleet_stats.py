@@ -0,0 +1,60 @@
+from models import db, Firmware, FleetStat
+from services import fleet_stats, presence
+
+
+def _consistent():
+    """The incrementally maintained snapshot, after checking it against a full rebuild."""
+    maintained = fleet_stats.snapshot()
+    fleet_stats.rebuild()
+    assert fleet_stats.snapshot() == maintained
+    return maintained
+
+
+def test_counters_follow_device_changes(client, login, make_user, make_device):
+    device, token = make_device('AA:01', country='DE')
+    make_device('AA:02')
+    login(device.user)
+    assert _consistent()['total'] == 2
+
+    response = client.post('/devices/register', data={'hardware_id': 'aa:03', 'module_type': 'ESP32-C3',
+                                                      'usage': 'lab', 'ajax': '1'})
+    assert response.status_code == 200
+    stats = _consistent()
+    assert stats['module_type'] == {'ESP32-S3': 2, 'ESP32-C3': 1}
+    assert stats['tag'] == {'lab': 1, 'unknown': 2}
+
+    client.post(f'/devices/{device.id}/tag', json={'tag': 'vehicle'})
+    client.post('/devices/bulk', json={'action': 'tag', 'tag': 'test', 'filter': {'country': 'FR'}})
+    assert _consistent()['tag'] == {'vehicle': 1, 'test': 2}
+
+    client.post('/api/v1/heartbeat', json={'firmware_version': '3.1.0'}, headers={'Authorization': f'Bearer {token}'})
+    presence.flush()
+    stats = _consistent()
+    assert (stats['online'], stats['offline']) == (1, 2)
+    assert stats['firmware'] == {'3.1.0': 1, 'unknown': 2}
+
+    moderator = make_user('moderator', role='moderator')
+    firmware = Firmware(version='3.2.0', filename='firmware_v3.2.0.bin', file_size=1, uploaded_by=moderator.id)
+    db.session.add(firmware)
+    db.session.commit()
+    login(moderator)
+    response = client.post('/admin/devices/push-firmware', json={'device_ids': [device.id], 'firmware_id': firmware.id})
+    assert response.status_code == 200
+    assert _consistent()['firmware'] == {'3.2.0': 1, 'unknown': 2}
+
+    login(device.user)
+    assert client.post(f'/devices/{device.id}/delete').status_code == 302
+    stats = _consistent()
+    assert (stats['total'], stats['online'], stats['country']) == (2, 0, {'FR': 2})
+
+
+def test_presence_flush_reconciles_drift(app, make_device, monkeypatch):
+    device, _ = make_device('AA:01')
+    FleetStat.query.filter_by(dimension='total').update({'device_count': 7})
+    db.session.commit()
+    assert fleet_stats.snapshot()['total'] == 7
+
+    monkeypatch.setattr(presence, 'reconcile_interval', 0)
+    presence.record(device.id)
+    presence.flush()
+    assert fleet_stats.snapshot()['total'] == 1
@@ -0,0 +1,58 @@
+import base64
+import json
+
+import pytest
+
+from models import db, Post
+from services.pagination import encode_cursor
+
+
+def _cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _make_posts(count, user):
+    for i in range(count):
+        db.session.add(Post(title=f'Gauge {i}', description='', gauge_type='tachometer', data='{}',
+                            posted_by=user.id))
+    db.session.commit()
+
+
+def test_next_cursor_pages_through_every_post(client, make_user):
+    _make_posts(30, make_user('author'))
+
+    seen, cursor = [], None
+    while True:
+        page = client.get('/workshop/feed', query_string={'sort': 'top', **({'cursor': cursor} if cursor else {})})
+        assert page.status_code == 200
+        seen += [post['id'] for post in page.get_json()['posts']]
+        cursor = page.get_json()['next_cursor']
+        if not cursor:
+            break
+    assert sorted(seen) == sorted(post.id for post in Post.query)
+
+
+@pytest.mark.parametrize('cursor', [
+    _cursor([[1], {'a': 1}]),   # not scalars
+    _cursor(['many', 5]),       # wrong type for like_count
+    _cursor([True, 5]),
+    _cursor([10 ** 30, 5]),     # out of SQLite's integer range
+    _cursor([1]),               # wrong length
+    _cursor({'like_count': 1}),
+    'not base64!',
+])
+def test_malformed_cursor_is_a_bad_request(client, make_user, cursor):
+    _make_posts(3, make_user('author'))
+
+    assert client.get('/workshop/', query_string={'sort': 'top', 'cursor': cursor}).status_code == 400
+
+
+def test_datetime_cursor(client, make_user):
+    _make_posts(3, make_user('author'))
+    newest = Post.query.order_by(Post.id.desc()).first()
+
+    cursor = encode_cursor([newest.posted_at, newest.id])
+    response = client.get('/workshop/feed', query_string={'cursor': cursor})
+    assert response.status_code == 200
+    assert [post['id'] for post in response.get_json()['posts']] == [newest.id - 1, newest.id - 2]
+    assert client.get('/workshop/', query_string={'cursor': _cursor(['yesterday', 1])}).status_code == 400
@@ -0,0 +1,96 @@
+import gzip
+import json
+
+from models import db, Post
+from services import gauge_payload_cache
+from services.payload_cache import GaugePayloadCache
+
+
+def _post(author, title='Boost', elements=(1,)):
+    post = Post(title=title, description='', gauge_type='boost', data=json.dumps({'elements': list(elements)}),
+                posted_by=author.id)
+    db.session.add(post)
+    db.session.commit()
+    return post
+
+
+def _gauge(client, token, **headers):
+    response = client.get('/api/v1/gauge', headers={'Authorization': f'Bearer {token}', **headers})
+    assert response.status_code == 200
+    return response
+
+
+def _worker(app, monkeypatch, **config):
+    for key, value in config.items():
+        monkeypatch.setitem(app.config, key, value)
+    cache = GaugePayloadCache()
+    cache.init_app(app)
+    return cache
+
+
+def test_devices_sharing_a_gauge_share_its_bytes(client, make_user, make_device, queries):
+    post = _post(make_user('author'))
+    _, first = make_device('AA:01', assigned_post_id=post.id)
+    _, second = make_device('AA:02', assigned_post_id=post.id)
+    body = _gauge(client, first).data
+
+    queries.clear()
+    assert _gauge(client, second).data == body
+    assert not [q for q in queries if 'posts.data AS' in q]
+
+    zipped = _gauge(client, second, **{'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(zipped.data) == body
+
+
+def test_edits_change_the_payload(client, make_user, make_device):
+    post = _post(make_user('author'))
+    _, token = make_device('AA:01', assigned_post_id=post.id)
+    _gauge(client, token)
+
+    post.title = 'Boost v2'
+    db.session.commit()
+    assert _gauge(client, token).get_json()['title'] == 'Boost v2'
+
+    post.data = json.dumps({'elements': [2]})
+    db.session.commit()
+    assert _gauge(client, token).get_json()['data'] == {'elements': [2]}
+
+
+def test_invalidation_reaches_other_workers(app, make_user, monkeypatch):
+    post = _post(make_user('author'))
+    other_worker = _worker(app, monkeypatch)
+    encoded = []
+
+    def encode():
+        encoded.append(post.id)
+        return b'{}'
+
+    other_worker.get(post, encode)
+    other_worker.get(post, encode)
+    assert len(encoded) == 1
+
+    gauge_payload_cache.invalidate_post(post.id)  # as an edit in this worker does
+    other_worker._generation.expire()  # as if its check_interval had passed
+    other_worker.get(post, encode)
+    assert len(encoded) == 2
+
+
+def test_memory_ceiling_evicts_least_recently_used(app, make_user, monkeypatch):
+    author = make_user('author')
+    posts = [_post(author, title=f'Gauge {i}') for i in range(3)]
+    cache = _worker(app, monkeypatch, GAUGE_PAYLOAD_CACHE_BYTES=2500, GAUGE_PAYLOAD_CACHE_GZIP=False)
+    encoded = []
+
+    def get(post):
+        return cache.get(post, lambda: encoded.append(post.id) or bytes(1000))
+
+    get(posts[0])
+    get(posts[1])
+    get(posts[0])
+    get(posts[2])  # evicts posts[1], the least recently used
+    assert encoded == [posts[0].id, posts[1].id, posts[2].id]
+
+    get(posts[0])
+    get(posts[1])
+    assert encoded[3:] == [posts[1].id]
@@ -0,0 +1,80 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from models import db, Device
+from services import presence, fleet_stats
+
+
+def _heartbeat(client, token, **body):
+    return client.post('/api/v1/heartbeat', json=body, headers={'Authorization': f'Bearer {token}'})
+
+
+def test_flush_writes_last_seen_and_firmware(client, make_device):
+    device, token = make_device('AA:01')
+
+    assert _heartbeat(client, token, firmware_version='3.1.0').status_code == 200
+    assert device.current_firmware() == '3.1.0'  # visible before the flush
+    assert presence.flush() == 1
+
+    db.session.expire_all()
+    device = db.session.get(Device, device.id)
+    assert device.firmware_version == '3.1.0'
+    assert device.last_seen_at is not None
+    assert fleet_stats.snapshot()['firmware'] == {'3.1.0': 1}
+    assert fleet_stats.snapshot()['online'] == 1
+
+
+@pytest.mark.parametrize('version', [{'x': 1}, ['3.1.0'], 3, 'x' * 100])
+def test_malformed_firmware_version_is_ignored(client, make_device, version):
+    device, token = make_device('AA:02', firmware_version='3.0.0')
+
+    assert _heartbeat(client, token, firmware_version=version).status_code == 200
+    assert client.post('/api/v1/ping', json={'mac': 'AA:02', 'firmware_version': version}).status_code == 200
+    assert presence.flush() == 1
+    assert _heartbeat(client, token).status_code == 200
+
+    db.session.expire_all()
+    assert db.session.get(Device, device.id).firmware_version == '3.0.0'
+
+
+def test_failed_flush_is_dropped(app, make_device):
+    device, _ = make_device('AA:03')
+    presence.record(device.id, {'x': 1})  # unhashable in the fleet_stats delta
+
+    assert presence.flush() == 0
+    assert presence.last_seen(device.id) is None
+
+    presence.record(device.id, '3.2.0')
+    assert presence.flush() == 1
+
+
+def test_locked_database_keeps_presence_pending(client, make_device, monkeypatch):
+    device, token = make_device('AA:04')
+
+    def locked(snapshot):
+        raise OperationalError('BEGIN IMMEDIATE', {}, Exception('database is locked'))
+    monkeypatch.setattr(presence, '_write', locked)
+    monkeypatch.setattr(presence, 'flush_interval', 0)
+
+    assert _heartbeat(client, token, firmware_version='3.3.0').status_code == 200  # flushed after the request
+    assert presence.firmware_version(device.id) == '3.3.0'
+
+    monkeypatch.undo()
+    assert presence.flush() == 1
+    db.session.expire_all()
+    assert db.session.get(Device, device.id).firmware_version == '3.3.0'
+
+
+def test_heartbeats_do_not_write(client, make_device, queries):
+    device, token = make_device('AA:05')
+
+    queries.clear()
+    for _ in range(3):
+        assert _heartbeat(client, token, firmware_version='3.1.0').status_code == 200
+    assert client.post('/api/v1/ping', json={'mac': 'AA:05'}).status_code == 200
+    assert not [q for q in queries if not q.lstrip().upper().startswith('SELECT')]
+    assert presence.last_seen(device.id) is not None
+
+    queries.clear()
+    assert presence.flush() == 1
+    assert len([q for q in queries if q.startswith('UPDATE devices')]) == 1
@@ -0,0 +1,129 @@
+import threading
+
+import pytest
+from sqlalchemy import text
+
+from models import db, Device, Firmware, FirmwareRollout
+from services import firmware_registry, offer_update
+
+
+@pytest.fixture
+def rollout(app, make_user):
+    admin = make_user('admin', role='admin')
+    firmware = Firmware(version='3.1.0', filename='firmware_v3.1.0.bin', file_size=1024, checksum='0' * 64,
+                        is_active=True, uploaded_by=admin.id)
+    db.session.add(firmware)
+    db.session.flush()
+    rollout = FirmwareRollout(firmware_id=firmware.id, max_concurrent=2, created_by=admin.id)
+    db.session.add(rollout)
+    db.session.commit()
+    firmware_registry.invalidate()
+    return rollout
+
+
+def _sync(client, token):
+    response = client.post('/api/v1/sync', json={'firmware_version': '3.0.0'},
+                           headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    return response.get_json()['firmware']
+
+
+def _report(client, token, status):
+    response = client.post('/api/v1/firmware/report', json={'version': '3.1.0', 'status': status},
+                           headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+
+
+def test_download_budget(client, make_device, rollout):
+    tokens = [make_device(f'AA:0{i}')[1] for i in range(3)]
+
+    assert _sync(client, tokens[0])['update_available']
+    assert _sync(client, tokens[1])['update_available']
+    assert _sync(client, tokens[0])['update_available']  # still holds its slot
+    assert _sync(client, tokens[2])['deferred']
+
+    _report(client, tokens[0], 'success')
+    assert _sync(client, tokens[2])['update_available']
+
+
+def test_only_slot_holders_are_counted_once(client, make_device, rollout):
+    tokens = [make_device(f'AA:0{i}')[1] for i in range(3)]
+    _sync(client, tokens[0])
+    _sync(client, tokens[1])
+    assert _sync(client, tokens[2])['deferred']
+
+    for _ in range(12):
+        _report(client, tokens[2], 'failure')  # never got a slot
+        _report(client, tokens[0], 'failure')
+
+    rollout = db.session.get(FirmwareRollout, rollout.id)
+    db.session.refresh(rollout)
+    assert (rollout.success_count, rollout.failure_count) == (0, 1)
+    assert rollout.status == 'running'
+
+
+def test_auto_pause(client, make_device, rollout):
+    rollout.max_concurrent = None
+    rollout.min_reports = 4
+    db.session.commit()
+    tokens = [make_device(f'AA:0{i}')[1] for i in range(4)]
+    for token in tokens:
+        assert _sync(client, token)['update_available']
+
+    for token, status in zip(tokens, ['success', 'failure', 'success', 'failure']):
+        _report(client, token, status)
+
+    db.session.refresh(rollout)
+    assert rollout.status == 'paused'
+    assert rollout.paused_reason == 'Auto-paused: 2/4 devices reported a failed update'
+    assert _sync(client, make_device('AA:10')[1])['deferred']
+
+
+def test_concurrent_offers_stay_within_budget(app, make_device, rollout):
+    device_ids = [make_device(f'CC:{i:02}')[0].id for i in range(8)]
+    rollout_id = rollout.id
+    barrier = threading.Barrier(len(device_ids))
+    offered = []
+
+    def offer(device_id):
+        with app.app_context():
+            device = db.session.get(Device, device_id)
+            gating = db.session.get(FirmwareRollout, rollout_id)
+            barrier.wait()
+            offered.append(offer_update(gating, device))
+            db.session.remove()
+
+    threads = [threading.Thread(target=offer, args=(device_id,)) for device_id in device_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert offered.count(True) == 2
+
+
+def test_completing_a_rollout_commits_before_invalidating(client, make_user, login, rollout, monkeypatch):
+    login(make_user('moderator', role='moderator'))
+    seen = []
+    invalidate = firmware_registry.invalidate
+
+    def check_committed():
+        with db.engine.connect() as conn:  # what another worker reloading now would read
+            seen.append(conn.execute(text('SELECT status FROM firmware_rollouts WHERE id = :id'),
+                                     {'id': rollout.id}).scalar())
+        invalidate()
+    monkeypatch.setattr(firmware_registry, 'invalidate', check_committed)
+
+    assert client.post(f'/admin/firmware/rollouts/{rollout.id}', data={'action': 'complete'}).status_code == 302
+    assert seen == ['completed']
+    assert firmware_registry.active().rollout_id is None
+
+
+@pytest.mark.parametrize('version', [{'x': 1}, ['3.0.0'], 300])
+def test_non_string_versions_are_bad_requests(client, make_device, rollout, version):
+    _, token = make_device('AA:01')
+    headers = {'Authorization': f'Bearer {token}'}
+
+    assert client.post('/api/v1/sync', json={'firmware_version': version}, headers=headers).status_code == 400
+    assert client.post('/api/v1/firmware/report', json={'version': version, 'status': 'success'},
+                       headers=headers).status_code == 400
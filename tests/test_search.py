@@ -0,0 +1,20 @@
+import pytest
+
+from models import db, Post
+from models import search as post_search
+
+
+@pytest.mark.parametrize('ranked_matches', [100, 5])  # bm25 candidates, then newest candidates
+def test_filter_finds_matches_outside_the_unfiltered_candidates(app, make_user, monkeypatch, ranked_matches):
+    monkeypatch.setattr(post_search, 'CANDIDATES', 5)
+    monkeypatch.setattr(post_search, 'RANKED_MATCHES', ranked_matches)
+    author = make_user('author')
+    boost = Post(title='Turbo boost', description='', gauge_type='boost', data='{}', posted_by=author.id)
+    db.session.add(boost)
+    for i in range(20):
+        db.session.add(Post(title=f'Turbo turbo tach {i}', description='', gauge_type='tachometer', data='{}',
+                            posted_by=author.id))
+    db.session.commit()
+
+    assert boost not in post_search.search('turbo', limit=50)
+    assert post_search.search('turbo', Post.query.filter(Post.gauge_type == 'boost')) == [boost]
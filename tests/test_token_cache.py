@@ -0,0 +1,46 @@
+from services.token_cache import DeviceTokenCache
+
+
+def _status(client, token):
+    return client.get('/api/v1/status', headers={'Authorization': f'Bearer {token}'}).status_code
+
+
+def test_token_lookups_are_cached(client, make_device, queries):
+    _, token = make_device('AA:01')
+    assert _status(client, token) == 200
+
+    queries.clear()
+    assert _status(client, token) == 200
+    assert not [q for q in queries if 'device_tokens' in q]
+
+
+def test_regenerate_revokes_the_cached_token(client, login, make_device):
+    device, token = make_device('AA:01')
+    assert _status(client, token) == 200
+    login(device.user)
+
+    assert client.post(f'/devices/{device.id}/regenerate-token').status_code == 200
+    assert _status(client, token) == 401
+    assert _status(client, device.tokens[-1].token) == 200
+
+
+def test_delete_revokes_the_cached_token(client, login, make_device):
+    device, token = make_device('AA:01')
+    assert _status(client, token) == 200
+    login(device.user)
+
+    assert client.post(f'/devices/{device.id}/delete').status_code == 302
+    assert _status(client, token) == 401
+
+
+def test_revocation_reaches_other_workers(app, client, login, make_device):
+    device, token = make_device('AA:01')
+    other_worker = DeviceTokenCache()
+    other_worker.init_app(app)
+    assert other_worker.lookup(token).is_active
+
+    login(device.user)
+    client.post(f'/devices/{device.id}/regenerate-token')
+
+    other_worker._generation.expire()  # as if its check_interval had passed
+    assert not other_worker.lookup(token).is_active
@@ -0,0 +1,61 @@
+import json
+
+from models import db, Post, PostComment, PostFeature
+
+from routes.workshop import POSTS_PER_PAGE
+
+
+def _make_posts(count, authors, viewer):
+    posts = []
+    for i in range(count):
+        post = Post(title=f'Gauge {i}', description='A test gauge', gauge_type='tachometer',
+                    data=json.dumps({'elements': []}), posted_by=authors[i % len(authors)].id)
+        db.session.add(post)
+        db.session.flush()
+        db.session.add(PostComment(post_id=post.id, user_id=viewer.id, content='Nice'))
+        db.session.add(PostFeature(post_id=post.id, moderator_id=viewer.id))
+        Post.increment(post.id, comment_count=1, feature_count=1)
+        posts.append(post)
+    db.session.commit()
+    for post in posts:
+        viewer.toggle_like_post(post)
+        viewer.toggle_favorite_post(post)
+    return posts
+
+
+def _listing_queries(client, queries):
+    queries.clear()
+    response = client.get('/workshop/')
+    assert response.status_code == 200
+    return len(queries)
+
+
+def test_workshop_listing_query_count_does_not_grow_with_the_page(client, make_user, login, queries):
+    viewer = make_user('viewer', role='moderator')
+    authors = [viewer, make_user('author')]
+    login(viewer)
+
+    _make_posts(2, authors, viewer)
+    small_page = _listing_queries(client, queries)
+
+    _make_posts(POSTS_PER_PAGE, authors, viewer)
+    full_page = _listing_queries(client, queries)
+
+    # Session user, page of posts, then one batched query each for authors, features, likes and favorites
+    assert full_page == small_page
+    assert full_page <= 8
+
+
+def test_workshop_listing_shows_one_page(client, make_user, login):
+    viewer = make_user('viewer')
+    login(viewer)
+    _make_posts(POSTS_PER_PAGE + 1, [viewer], viewer)
+
+    response = client.get('/workshop/')
+    assert response.status_code == 200
+    assert response.data.count(b'class="post-canvas') == POSTS_PER_PAGE
+
+    feed = client.get('/workshop/feed').get_json()
+    assert len(feed['posts']) == POSTS_PER_PAGE
+    assert all(post['liked'] and post['favorited'] and post['featured'] for post in feed['posts'])
+    assert client.get('/workshop/feed', query_string={'cursor': feed['next_cursor']}).get_json()['posts']